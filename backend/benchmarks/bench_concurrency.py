@@ -0,0 +1,155 @@
+# Throughput of the API's database-bound endpoints as concurrent clients go
+# up, for a given connection pool size and number of offload threads.
+#
+# By default this runs main.app in-process against a SQLite copy of the
+# bundled data (benchmarks/local_db.py), so no MySQL is needed:
+#
+#   cd backend && python -m benchmarks.bench_concurrency [--pool-size 8] [--offload-threads 8]
+#       [--concurrency 1 2 4 8 16 32] [--requests 200] [--only send-username add-rating]
+#       [--latency-ms 2]
+#
+# Targets:
+#   send-username          the async endpoint, its database work offloaded
+#                          through db.run()
+#   send-username inline   the same handler called directly on the event loop,
+#                          as /send-username did before db.run()
+#   add-rating             a plain def endpoint (Starlette's thread pool), one
+#                          write transaction per request
+#
+# The result cache is disabled unless --cache is given, so every request
+# reaches the database. A "!" after a figure means some requests failed.
+# SQLite queries are local and hold the GIL, so on their own the offload
+# mostly adds thread hand-offs. What it buys, not stalling the loop during
+# network round trips, shows with --latency-ms: every statement and commit
+# then blocks for that long, as a MySQL round trip would, and send-username
+# scales with concurrency up to the offload threads while the inline variant
+# stays at one request per round-trip chain. add-rating stays flat there too:
+# its delays fall inside write transactions, which SQLite runs one at a time.
+#
+# With --url it drives a running server instead, e.g.
+#
+#   python -m benchmarks.bench_concurrency --url http://127.0.0.1:8000/send-username --json '{"username": "alice"}'
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import warnings
+
+import httpx
+
+CONCURRENCY = [1, 2, 4, 8, 16, 32]
+
+
+def add_inline_route(app):
+    # /send-username with its blocking work on the event loop, for comparison
+    from main import UsernameData, _receive_username
+    from responses import Paging
+
+    async def inline(data: UsernameData):
+        return _receive_username(data, Paging(None, None, None))
+
+    app.app.add_api_route("/bench/send-username-inline", inline, methods=["POST"])
+
+
+def targets(users, movie_ids, rng):
+    # name -> (method, url, body factory)
+    return {
+        "send-username": ("POST", "/send-username", lambda: {"username": rng.choice(users)}),
+        "send-username inline": ("POST", "/bench/send-username-inline", lambda: {"username": rng.choice(users)}),
+        "add-rating": ("POST", "/add-rating", lambda: {
+            "username": rng.choice(users), "movie_id": rng.choice(movie_ids), "rating": rng.randint(1, 5)}),
+    }
+
+
+async def drive(client, method, url, body, total, concurrency):
+    remaining = iter(range(total))
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        for _ in remaining:
+            response = await client.request(method, url, json=body())
+            failures += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return total / elapsed, failures
+
+
+async def run(args, client, named):
+    levels = args.concurrency
+    print(f"{'endpoint':<40} " + " ".join(f"{c:>8}" for c in levels) + "   (req/s by concurrent clients)")
+    for name, (method, url, body) in named.items():
+        await drive(client, method, url, body, 3, 1)  # warm-up: lazy loads, table builds
+        row = []
+        for concurrency in levels:
+            rps, failures = await drive(client, method, url, body, args.requests, concurrency)
+            row.append(f"{rps:8.1f}" + ("!" if failures else ""))
+        print(f"{name:<40} " + " ".join(row), flush=True)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Requests/sec of the database-bound endpoints by concurrency")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY)
+    parser.add_argument("--pool-size", type=int, help="DB_POOL_SIZE (default: the environment's, else 8)")
+    parser.add_argument("--offload-threads", type=int, help="DB_OFFLOAD_THREADS (default: the pool size)")
+    parser.add_argument("--only", nargs="+", choices=["send-username", "send-username inline", "add-rating"])
+    parser.add_argument("--cache", action="store_true", help="leave the result cache enabled")
+    parser.add_argument("--db", help="SQLite file to seed (default: a temporary file)")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="simulated blocking round-trip time per statement")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--method", default="POST")
+    parser.add_argument("--json", help="request body for --url")
+    args = parser.parse_args()
+
+    if args.url:
+        body = json.loads(args.json) if args.json else None
+        client = httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=max(args.concurrency)))
+        async with client:
+            await run(args, client, {args.url: (args.method, args.url, lambda: body)})
+        return
+
+    # db.py reads its sizes at import, so they are set before anything imports it
+    if args.pool_size:
+        os.environ["DB_POOL_SIZE"] = str(args.pool_size)
+    if args.offload_threads:
+        os.environ["DB_OFFLOAD_THREADS"] = str(args.offload_threads)
+    if not args.cache:
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+    warnings.filterwarnings("ignore")  # sklearn/xgboost pickle version notices
+
+    import db
+    from benchmarks import local_db
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "bench.db")
+        rows = local_db.seed(path)
+        local_db.install(path, latency=args.latency_ms / 1000)
+        import main as app
+        add_inline_route(app)
+
+        rng = random.Random(0)
+        ratings = local_db.load_ratings()
+        raters = {user_id for user_id, _, _, _ in ratings}
+        users = [row[1] for row in local_db.load_users() if int(row[0]) in raters]
+        movie_ids = sorted({movie_id for _, movie_id, _, _ in ratings})
+        named = targets(users, movie_ids, rng)
+        if args.only:
+            named = {name: target for name, target in named.items() if name in args.only}
+
+        print(f"seeded {rows}; pool size {db.POOL_SIZE}, offload threads {db.OFFLOAD_THREADS}, "
+              f"{args.latency_ms:g} ms per statement, {args.requests} requests per level\n")
+        transport = httpx.ASGITransport(app=app.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await run(args, client, named)
+        print(f"\npool: {db.pool_stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
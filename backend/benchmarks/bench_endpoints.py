@@ -0,0 +1,325 @@
+# Latency, throughput and memory of every endpoint in main.py, driven
+# in-process through httpx against a SQLite copy of the bundled data
+# (benchmarks/local_db.py), so no MySQL server or network is needed:
+#
+#   cd backend && python -m benchmarks.bench_endpoints [--requests 200] [--concurrency 8]
+#       [--only send-username recommendations ...] [--cache] [--compare old.json]
+#
+# Each endpoint gets a few untimed warm-up calls (lazy model loads, table
+# builds), then --requests calls from --concurrency clients. Reported per
+# endpoint: p50/p95/p99 latency, requests/sec, mean response size, peak RSS
+# while it ran, and the status codes seen. Latencies and sizes cover the 2xx
+# responses only; an endpoint that returned anything else is marked FAILED
+# and the run exits with status 1 (after writing the results) unless
+# --allow-errors is given. Results go to benchmarks/results/endpoints-<commit>.json
+# (or --out); --compare prints the change against an earlier results file.
+#
+# The result cache is disabled unless --cache is given, so repeated calls
+# measure the recommenders rather than cache hits. Endpoints whose model or
+# index files are missing show up with their error status, not as skipped.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import warnings
+
+import httpx
+import numpy as np
+
+from benchmarks import local_db
+from benchmarks.local_data import RATINGS_PATH
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+WARMUP = 3
+
+
+class Context:
+    # Request inputs drawn from the seeded data
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        users = local_db.load_users()
+        ratings = local_db.load_ratings()
+        raters = {user_id for user_id, _, _, _ in ratings}
+        self.users = [row for row in users if int(row[0]) in raters]
+        self.movie_ids = sorted({movie_id for _, movie_id, _, _ in ratings})
+        with open(RATINGS_PATH, encoding="latin-1") as f:
+            self.ratings_file = "".join(f.readline() for _ in range(200)).encode()
+        self._new_user = 0
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def username(self):
+        return self.user()[1]
+
+    def genres(self):
+        return [self.rng.randint(0, 1) for _ in range(8)]
+
+    def new_user_id(self):
+        self._new_user += 1
+        return str(900000 + self._new_user)
+
+    def sync_records(self):
+        movies = [{"id": str(m), "title": f"Movie {m}", "genres": "Drama"} for m in self.rng.sample(self.movie_ids, 20)]
+        users = []
+        for _ in range(5):
+            user_id = self.new_user_id()
+            users.append({"userId": user_id, "username": f"sync{user_id}", "password": "bench",
+                          "preferred_genres": ",".join(map(str, self.genres()))})
+        return movies, users
+
+
+def _sync_json(ctx):
+    movies, users = ctx.sync_records()
+    return {"json": {"movies": movies, "users": users}}
+
+
+def _sync_ndjson(ctx):
+    movies, users = ctx.sync_records()
+    lines = [json.dumps({"kind": "movie", **m}) for m in movies] + [json.dumps({"kind": "user", **u}) for u in users]
+    return {"content": "\n".join(lines).encode(), "headers": {"content-type": "application/x-ndjson"}}
+
+
+def _add_user(ctx):
+    user_id = ctx.new_user_id()
+    return {"json": {"userId": user_id, "username": f"new{user_id}", "password": "bench", "gender": "F",
+                     "age": 25, "occupation": 4, "zipCode": "00000",
+                     "preferred_genres": ",".join(map(str, ctx.genres()))}}
+
+
+# name -> (method, path, request kwargs); read-only endpoints first, since the
+# writes below invalidate caches and reload the catalog
+ENDPOINTS = {
+    "catalog-version": lambda ctx: ("GET", "/catalog-version", {}),
+    "db-pool-stats": lambda ctx: ("GET", "/db-pool-stats", {}),
+    "cache-stats": lambda ctx: ("GET", "/cache-stats", {}),
+    "models": lambda ctx: ("GET", "/models", {}),
+    "metrics": lambda ctx: ("GET", "/metrics", {}),
+    "cluster": lambda ctx: ("POST", "/cluster", {"json": {"user_id": ctx.user()[0], "preferred_genres": ctx.genres()}}),
+    "send-username": lambda ctx: ("POST", "/send-username", {"json": {"username": ctx.username()}}),
+    "compute_features": lambda ctx: ("POST", "/compute_features", {
+        "json": {"user_id": ctx.user()[0], "movie_id": str(ctx.rng.choice(ctx.movie_ids))}}),
+    "compute_features/batch": lambda ctx: ("POST", "/compute_features/batch", {"json": {"pairs": [
+        {"user_id": ctx.user()[0], "movie_id": str(ctx.rng.choice(ctx.movie_ids))} for _ in range(500)]}}),
+    "PredictFutureRating": lambda ctx: ("POST", "/PredictFutureRating", {"json": {"username": ctx.username()}}),
+    "PredictFutureRating?fields": lambda ctx: ("POST", "/PredictFutureRating", {
+        "params": {"fields": "id,title,predicted_rating"}, "json": {"username": ctx.username()}}),
+    "PredictFutureRating GET": lambda ctx: ("GET", "/PredictFutureRating", {"params": {"username": ctx.username()}}),
+    "PredictFutureRatingLikeVsDislike": lambda ctx: ("POST", "/PredictFutureRatingLikeVsDislike", {
+        "json": {"username": ctx.username()}}),
+    "UserRatingsCluster": lambda ctx: ("POST", "/UserRatingsCluster", {"json": {"username": ctx.username()}}),
+    "recommendations": lambda ctx: ("GET", "/recommendations", {"params": {"username": ctx.username()}}),
+    "similar-movies": lambda ctx: ("GET", "/similar-movies", {"params": {
+        "movie_ids": ",".join(map(str, ctx.rng.sample(ctx.movie_ids, 3))), "username": ctx.username()}}),
+    "add-rating": lambda ctx: ("POST", "/add-rating", {"json": {
+        "username": ctx.username(), "movie_id": ctx.rng.choice(ctx.movie_ids), "rating": ctx.rng.randint(1, 5)}}),
+    "update-user-genres": lambda ctx: ("PUT", "/update-user-genres", {
+        "json": {"username": ctx.username(), "preferred_genres": ctx.genres()}}),
+    "add-user": lambda ctx: ("POST", "/add-user", _add_user(ctx)),
+    "upload-sqlite-data": lambda ctx: ("POST", "/upload-sqlite-data", _sync_json(ctx)),
+    "upload-sqlite-data/stream": lambda ctx: ("POST", "/upload-sqlite-data/stream", _sync_ndjson(ctx)),
+    "upload_ratings": lambda ctx: ("POST", "/upload_ratings", {
+        "files": {"file": ("ratings.dat", ctx.ratings_file, "application/octet-stream")}}),
+    "models/reload": lambda ctx: ("POST", "/models/genre_cluster/reload", {
+        "headers": {"authorization": f"Bearer {os.environ['ADMIN_TOKEN']}"}}),
+}
+
+
+def _rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakRss:
+    # Samples resident memory in the background while the block runs
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+async def run_endpoint(client, ctx, build, total, concurrency):
+    for _ in range(WARMUP):
+        method, path, kwargs = build(ctx)
+        await client.request(method, path, **kwargs)
+
+    requests = [build(ctx) for _ in range(total)]
+    latencies = []
+    sizes = []
+    statuses = {}
+    errors = 0
+    sample_error = None
+    pending = iter(requests)
+
+    async def worker():
+        nonlocal sample_error, errors
+        for method, path, kwargs in pending:
+            start = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            status = str(response.status_code)
+            statuses[status] = statuses.get(status, 0) + 1
+            if 200 <= response.status_code < 300:
+                latencies.append(elapsed_ms)
+                sizes.append(response.num_bytes_downloaded)  # on the wire, i.e. compressed
+            else:
+                errors += 1
+                if sample_error is None:
+                    sample_error = response.text[:200]
+
+    rss_before = _rss_bytes()
+    with PeakRss() as rss:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    # Error responses are usually fast and would flatter the percentiles
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (np.nan,) * 3
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": _round(p50),
+        "p95_ms": _round(p95),
+        "p99_ms": _round(p99),
+        "mean_ms": _round(np.mean(latencies)) if latencies else None,
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "mean_bytes": round(float(np.mean(sizes))) if sizes else None,
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+        "rss_growth_mb": round((rss.peak - rss_before) / 2 ** 20, 1),
+        "statuses": statuses,
+        "sample_error": sample_error,
+    }
+
+
+def _round(value, digits=3):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _cell(value, width, spec=".2f"):
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}{spec}}"
+
+
+def _print_row(name, r, baseline=None):
+    line = (f"{name:<34} {_cell(r['p50_ms'], 9)} {_cell(r['p95_ms'], 9)} {_cell(r['p99_ms'], 9)} "
+            f"{r['requests_per_sec']:>9.1f} {_cell(r['mean_bytes'], 8, '')} {r['peak_rss_mb']:>8.1f}  "
+            + " ".join(f"{k}x{v}" for k, v in sorted(r["statuses"].items())))
+    if r["errors"]:
+        line += f"   FAILED: {r['errors']}/{r['requests']} non-2xx, e.g. {r['sample_error']!r}"
+    elif baseline:
+        line += f"   p50 {_change(baseline.get('p50_ms'), r['p50_ms'])}, req/s {_change(baseline['requests_per_sec'], r['requests_per_sec'])}"
+    print(line, flush=True)
+
+
+def _change(old, new):
+    return f"{(new - old) / old:+.0%}" if old and new is not None else "n/a"
+
+
+async def run(args):
+    results = {}
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["endpoints"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "bench.db")
+        rows = local_db.seed(path)
+        local_db.install(path)
+        ctx = Context()
+        import main as app
+
+        print(f"seeded {rows}; {args.requests} requests per endpoint, concurrency {args.concurrency}\n")
+        print(f"{'endpoint':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'bytes':>8} {'rss MB':>8}  statuses")
+        # App errors become 500 responses, as they would behind a server
+        transport = httpx.ASGITransport(app=app.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for name, build in ENDPOINTS.items():
+                if args.only and name not in args.only:
+                    continue
+                result = await run_endpoint(client, ctx, build, args.requests, args.concurrency)
+                results[name] = result
+                _print_row(name, result, baseline.get(name))
+
+    return {
+        "meta": {
+            "commit": _commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "result_cache": args.cache,
+            "inference_backend": os.getenv("INFERENCE_BACKEND", "xgboost"),
+            "seeded": rows,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "endpoints": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every API endpoint against a local SQLite copy of the data")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--only", nargs="+", choices=list(ENDPOINTS))
+    parser.add_argument("--cache", action="store_true", help="leave the result cache enabled")
+    parser.add_argument("--db", help="SQLite file to seed (default: a temporary file)")
+    parser.add_argument("--out", help="results file (default: benchmarks/results/endpoints-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to report changes against")
+    parser.add_argument("--allow-errors", action="store_true",
+                        help="exit 0 even if some endpoint returned non-2xx responses")
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+    os.environ.setdefault("ADMIN_TOKEN", "bench")  # for models/reload
+    warnings.filterwarnings("ignore")  # sklearn/xgboost pickle version notices
+
+    report = asyncio.run(run(args))
+    out = args.out or os.path.join(RESULTS_DIR, f"endpoints-{report['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nmax RSS {report['meta']['max_rss_mb']} MB; results written to {out}")
+
+    failed = [name for name, r in report["endpoints"].items() if r["errors"]]
+    if failed:
+        print(f"FAILED: non-2xx responses from {', '.join(failed)}")
+        if not args.allow_errors:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
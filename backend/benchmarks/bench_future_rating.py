@@ -0,0 +1,96 @@
+# Per-request cost of building the /PredictFutureRating input and picking the
+# top 10, before (iterrows loop + full sort) and after (features.py).
+#
+#   cd backend && python -m benchmarks.bench_future_rating [--repeat 20] [--with-model]
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from catalog import CatalogSnapshot
+from feature_store import FeatureStore
+from features import future_rating_features, top_k
+from benchmarks.local_data import load_movies
+
+USER_GENRES = [1, 0, 1, 0, 1, 0, 1, 0]
+USER_AVG, USER_STD, USER_AGE, USER_OCCUPATION, CLUSTER = 3.8, 0.9, 25, 4, 1
+# No ratings: every aggregate takes its fallback, which is what the loop used
+EMPTY_STORE = FeatureStore([], [])
+
+
+def loop_features(movies):
+    features_list = []
+    for _, movie in movies.iterrows():
+        movie_std_rating = movies["rating"].std()
+        movie_popularity = len(movies)
+        genre_match = sum(
+            USER_GENRES[i]
+            for i, _ in enumerate(movie["genres"].split(","))
+            if i < len(USER_GENRES)
+        )
+        features_list.append([
+            USER_AVG, USER_AVG, USER_STD, USER_AGE,
+            USER_AVG - movie["rating"], movie_std_rating, movie_popularity,
+            USER_OCCUPATION, CLUSTER, genre_match
+        ])
+    return np.array(features_list)
+
+
+def before(snap, predict):
+    movies = snap.frame()
+    X = loop_features(movies)
+    movies["predicted_rating"] = predict(X)
+    return movies.sort_values(by="predicted_rating", ascending=False).head(10)
+
+
+def after(snap, predict):
+    X = future_rating_features(snap, EMPTY_STORE, USER_AVG, USER_STD, USER_AGE,
+                               USER_OCCUPATION, CLUSTER, USER_GENRES)
+    predicted = predict(X)
+    idx = top_k(predicted, 10)
+    top = snap.take(idx)
+    top["predicted_rating"] = predicted[idx]
+    return top
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--with-model", action="store_true",
+                        help="include xgb_model.predict (needs models/ on disk)")
+    args = parser.parse_args()
+
+    snap = CatalogSnapshot(load_movies(), version=1)
+    if args.with_model:
+        import joblib
+        predict = joblib.load("models/xgb_predicting_future_movie_ratings_model.pkl").predict
+    else:
+        # Stand-in scorer so the comparison isolates feature building + top-k
+        weights = np.linspace(0.1, 1.0, 10)
+        predict = lambda X: X @ weights
+
+    X_old = loop_features(snap.frame())
+    X_new = future_rating_features(snap, EMPTY_STORE, USER_AVG, USER_STD, USER_AGE,
+                                   USER_OCCUPATION, CLUSTER, USER_GENRES)
+    assert np.allclose(X_old, X_new, equal_nan=True), "feature matrices differ"
+
+    old_ms = timed(lambda: before(snap, predict), args.repeat)
+    new_ms = timed(lambda: after(snap, predict), args.repeat)
+    print(f"catalog: {snap.size} movies, median of {args.repeat} runs")
+    print(f"iterrows + sort      : {old_ms:8.2f} ms/request")
+    print(f"vectorized + top-k   : {new_ms:8.2f} ms/request")
+    print(f"speedup              : {old_ms / new_ms:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
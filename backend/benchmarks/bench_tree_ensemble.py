@@ -0,0 +1,115 @@
+# Parity and latency of tree_ensemble (NumPy) against the XGBoost wrapper for
+# the /PredictFutureRating regressor and the /recommendations classifier, on
+# feature rows built from the bundled movies.dat, and of the genre KMeans
+# lookup table against KMeans.predict.
+#
+#   cd backend && python -m benchmarks.bench_tree_ensemble [--repeat 50]
+import argparse
+import pickle
+import statistics
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+from catalog import CatalogSnapshot
+from feature_store import FeatureStore
+from features import future_rating_features, recommendation_features
+from tree_ensemble import CompiledEnsemble, LookupTable
+from benchmarks.local_data import load_movies
+
+FUTURE_RATING_PATH = "models/xgb_predicting_future_movie_ratings_model.pkl"
+RECOMMENDER_PATH = "models/xgb_model.pkl"
+GENRE_CLUSTER_PATH = "models/users_with_same_genres_preferences_cluster.pkl"
+
+SIZES = [1, 100, 4000]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def rows(X, n):
+    # n rows cycled from X
+    return X[np.arange(n) % len(X)]
+
+
+def regressor_inputs(snap, rng):
+    blocks = []
+    for _ in range(8):
+        genres = rng.integers(0, 2, 8).tolist()
+        blocks.append(future_rating_features(
+            snap, FeatureStore([], []), rng.uniform(1, 5), rng.uniform(0, 1.5), int(rng.integers(18, 60)),
+            int(rng.integers(0, 21)), int(rng.integers(0, 3)), genres
+        ))
+    return np.vstack(blocks)
+
+
+def classifier_inputs(snap, rng):
+    blocks = []
+    for _ in range(8):
+        blocks.append(recommendation_features(
+            snap, np.arange(snap.size), int(rng.integers(18, 60)), int(rng.integers(0, 2)),
+            int(rng.integers(0, 21)), int(rng.integers(0, 500)), rng.uniform(1, 5), rng.uniform(0, 1.5)
+        ))
+    return np.vstack(blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")  # sklearn/xgboost pickle version notices
+
+    rng = np.random.default_rng(0)
+    snap = CatalogSnapshot(load_movies(), version=1)
+    regressor = joblib.load(FUTURE_RATING_PATH)
+    with open(RECOMMENDER_PATH, "rb") as f:
+        classifier = pickle.load(f)
+
+    cases = [
+        ("future rating (predict)", regressor, regressor_inputs(snap, rng), "predict"),
+        ("recommender (predict_proba)", classifier, classifier_inputs(snap, rng), "predict_proba"),
+    ]
+
+    print("parity on the bundled catalog")
+    for name, model, X, method in cases:
+        compiled = CompiledEnsemble(model)
+        expected = getattr(model, method)(X)
+        got = getattr(compiled, method)(X, force=True)
+        diff = float(np.abs(expected - got).max())
+        print(f"  {name:<30} {len(X)} rows, max |diff| {diff:.2e}")
+        assert diff < 1e-4, f"{name}: predictions differ by {diff}"
+        if method == "predict_proba":
+            agree = float((model.predict(X) == compiled.predict(X, force=True)).mean())
+            print(f"  {'':<30} labels agree {agree:.4%}")
+            assert agree == 1.0
+
+    print(f"\nlatency, median of {args.repeat} calls (ms)")
+    print(f"  {'model':<30} {'rows':>6} {'xgboost':>10} {'numpy':>10} {'speedup':>8}")
+    for name, model, X, method in cases:
+        compiled = CompiledEnsemble(model)
+        for n in SIZES:
+            batch = rows(X, n)
+            slow = timed(lambda: getattr(model, method)(batch), args.repeat)
+            fast = timed(lambda: getattr(compiled, method)(batch, force=True), args.repeat)
+            print(f"  {name:<30} {n:>6} {slow:>10.3f} {fast:>10.3f} {slow / fast:>7.1f}x")
+    print(f"  (the backend hands batches over {compiled.max_rows} rows to XGBoost)")
+
+    kmeans = joblib.load(GENRE_CLUSTER_PATH)
+    table = LookupTable(kmeans, 2)
+    grid = [[a, b] for a in (0, 1) for b in (0, 1)]
+    assert (table.predict(grid) == kmeans.predict(np.array(grid))).all()
+    slow = timed(lambda: kmeans.predict([[1, 0]]), args.repeat)
+    fast = timed(lambda: table.predict([[1, 0]]), args.repeat)
+    print(f"\n  genre KMeans, 1 row: predict {slow:.3f} ms, lookup {fast:.4f} ms ({slow / fast:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# Local stand-in for the MySQL tables, built from the bundled .dat files so
+# benchmarks run without a database or network.
+import csv
+import os
+import random
+import re
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS_DIR = os.path.join(BACKEND_DIR, "..", "frontend", "assets")
+
+MOVIES_PATH = os.path.join(ASSETS_DIR, "movies.dat")
+USERS_PATH = os.path.join(ASSETS_DIR, "users.dat")
+RATINGS_PATH = os.path.join(BACKEND_DIR, "ratings.dat")
+
+GENRE_NAMES = ['Comedy','Drama','Action','Sci-Fi','Thriller','Romance','Adventure','Crime']
+
+_YEAR = re.compile(r"\((\d{4})\)\s*$")
+
+
+def load_movies(path=MOVIES_PATH, seed=0):
+    # movies.dat has no rating or poster columns; ratings are drawn from a
+    # seeded generator so every run sees the same catalog.
+    rng = random.Random(seed)
+    rows = []
+    with open(path, encoding="latin-1", newline="") as f:
+        for movie_id, title, genres in csv.reader(f, delimiter="|", quotechar='"'):
+            year = _YEAR.search(title)
+            genre_set = set(genres.split("|"))
+            rows.append({
+                "id": int(movie_id),
+                "title": title,
+                "genres": genres,
+                "rating": round(rng.uniform(1.0, 5.0), 1),
+                "year": int(year.group(1)) if year else None,
+                "description": "",
+                "posterUrl": "",
+                "genres_vector": ",".join("1" if g in genre_set else "0" for g in GENRE_NAMES),
+            })
+    return rows
@@ -0,0 +1,136 @@
+# SQLite copy of the database seeded from the bundled .dat files, so the
+# endpoint benchmarks run without a MySQL server or network.
+#
+#   seed(path)    builds movies, users and ratings from movies.dat, users.dat
+#                 and ratings.dat
+#   install(path) points db.py at that file (storage.SQLiteStorage);
+#                 latency= adds a blocking sleep to every statement and
+#                 commit, standing in for a network round trip to MySQL
+import os
+import random
+import time
+from collections import Counter
+
+import db
+import storage
+from ingest import parse_line
+from benchmarks.local_data import load_movies, RATINGS_PATH, USERS_PATH
+
+
+def username(user_id):
+    return f"user{user_id}"
+
+
+def load_users(path=USERS_PATH, seed=0):
+    # users.dat is userId|gender|age|occupation|zip; usernames, passwords and
+    # preferred genre vectors are generated (seeded, so runs are comparable)
+    rng = random.Random(seed)
+    rows = {}
+    with open(path, encoding="latin-1") as f:
+        for line in f:
+            fields = line.rstrip("\r\n").split("|")
+            if len(fields) != 5:
+                continue
+            user_id, gender, age, occupation, zip_code = fields
+            rows.setdefault(user_id, (
+                user_id, username(user_id), "bench", gender or None,
+                int(float(age)) if age else None, int(occupation) if occupation else None,
+                zip_code or None, ",".join(str(rng.randint(0, 1)) for _ in range(8)),
+            ))
+    return list(rows.values())  # first row wins for the few repeated ids
+
+
+def load_ratings(path=RATINGS_PATH):
+    with open(path, encoding="latin-1") as f:
+        return [parse_line(line) for line in f if line.strip()]
+
+
+def seed(path):
+    # (Re)create the database at path; returns table row counts
+    for stale in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    ratings = load_ratings()
+    popularity = Counter(movie_id for _, movie_id, _, _ in ratings)
+    movies = {}
+    for row in load_movies():
+        movies.setdefault(row["id"], row)  # movies.dat repeats a few ids
+
+    backend = storage.SQLiteStorage(path)
+    backend.ensure_schema()
+    conn = backend.connect()
+    try:
+        conn.executemany(
+            "INSERT INTO movies VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(m["id"], m["title"], m["genres"], m["rating"], m["year"], m["description"],
+              m["posterUrl"], m["genres_vector"], popularity.get(m["id"], 0)) for m in movies.values()]
+        )
+        users = load_users()
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)", users)
+        # Later lines overwrite earlier ones, as the ratings upload does
+        conn.executemany("INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?)", ratings)
+        conn.commit()
+        rated = conn.execute("SELECT COUNT(*) FROM ratings").fetchone()[0]
+    finally:
+        conn.close()
+    return {"movies": len(movies), "users": len(users), "ratings": rated}
+
+
+class _SlowCursor:
+    def __init__(self, raw, latency):
+        self._raw = raw
+        self._latency = latency
+
+    @property
+    def row_factory(self):
+        return self._raw.row_factory
+
+    @row_factory.setter
+    def row_factory(self, factory):
+        self._raw.row_factory = factory
+
+    def execute(self, sql, params=()):
+        time.sleep(self._latency)
+        return self._raw.execute(sql, params)
+
+    def executemany(self, sql, seq):
+        time.sleep(self._latency)
+        return self._raw.executemany(sql, seq)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class _SlowConnection:
+    # A sqlite3 connection whose statements and commits each block for
+    # `latency` seconds, like a round trip would (sleep releases the GIL)
+    def __init__(self, raw, latency):
+        self._raw = raw
+        self._latency = latency
+
+    def cursor(self):
+        return _SlowCursor(self._raw.cursor(), self._latency)
+
+    def commit(self):
+        time.sleep(self._latency)
+        self._raw.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class LatencySQLiteStorage(storage.SQLiteStorage):
+    def __init__(self, path, latency):
+        super().__init__(path)
+        self.latency = latency
+
+    def connect(self):
+        return _SlowConnection(super().connect(), self.latency)
+
+
+def install(path, latency=0.0):
+    # Route every db.py connection to the SQLite file at path, optionally
+    # with `latency` seconds of blocking delay per statement
+    backend = LatencySQLiteStorage(path, latency) if latency else storage.SQLiteStorage(path)
+    db.use(backend)
+    return backend
@@ -0,0 +1,156 @@
+# Batched upserts for the device sync (/upload-sqlite-data).
+#
+# Records are buffered per entity and written as one multi-row
+# INSERT ... ON DUPLICATE KEY UPDATE per batch, each batch in its own
+# transaction, so a full catalog sync costs a few dozen round trips instead of
+# one per record.
+import gzip
+import json
+import os
+import time
+import zlib
+
+import db
+
+DEFAULT_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "500"))
+
+MOVIE_COLUMNS = ("id", "title", "genres", "rating", "year", "description", "posterUrl")
+USER_COLUMNS = ("userId", "username", "password", "gender", "age", "occupation", "zipCode", "preferred_genres")
+
+MOVIE_UPSERT = """INSERT INTO movies (id, title, genres, rating, year, description, posterUrl)
+    VALUES {values}
+    ON DUPLICATE KEY UPDATE title=VALUES(title)"""
+
+USER_UPSERT = """INSERT INTO users (userId, username, password, gender, age, occupation, zipCode, preferred_genres)
+    VALUES {values}
+    ON DUPLICATE KEY UPDATE
+        username=VALUES(username),
+        password=VALUES(password),
+        gender=VALUES(gender),
+        age=VALUES(age),
+        occupation=VALUES(occupation),
+        zipCode=VALUES(zipCode),
+        preferred_genres=VALUES(preferred_genres)"""
+
+
+class BatchWriter:
+    # prepare(cursor, batch), when given, runs in each batch's transaction
+    # before the upsert (e.g. to read the rows it overwrites); its results
+    # are collected in `prepared` once that transaction has committed
+    def __init__(self, template, columns, batch_size=DEFAULT_BATCH_SIZE, prepare=None):
+        self.template = template
+        self.columns = columns
+        self.batch_size = max(1, batch_size)
+        self.prepare = prepare
+        self.prepared = []
+        self.pending = []
+        self.count = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    @property
+    def full(self):
+        return len(self.pending) >= self.batch_size
+
+    def add(self, record):
+        self.pending.append(tuple(getattr(record, c) for c in self.columns))
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        row = "(" + ", ".join(["%s"] * len(self.columns)) + ")"
+        sql = self.template.format(values=", ".join([row] * len(batch)))
+        start = time.perf_counter()
+        with db.transaction() as cursor:
+            prepared = self.prepare(cursor, batch) if self.prepare else None
+            cursor.execute(sql, [value for values in batch for value in values])
+        if self.prepare:
+            self.prepared.append(prepared)
+        self.seconds += time.perf_counter() - start
+        self.count += len(batch)
+        self.batches += 1
+
+    def report(self):
+        return {"count": self.count, "batches": self.batches, "seconds": round(self.seconds, 4)}
+
+
+def movie_writer(batch_size=DEFAULT_BATCH_SIZE):
+    return BatchWriter(MOVIE_UPSERT, MOVIE_COLUMNS, batch_size)
+
+
+def user_writer(batch_size=DEFAULT_BATCH_SIZE, prepare=None):
+    return BatchWriter(USER_UPSERT, USER_COLUMNS, batch_size, prepare)
+
+
+def write_all(writer, records):
+    for record in records:
+        writer.add(record)
+        if writer.full:
+            writer.flush()
+    writer.flush()
+    return writer.report()
+
+
+class PayloadError(ValueError):
+    # A sync body that cannot be decoded; the client's fault, not the server's
+    pass
+
+
+def decode_body(body, content_encoding):
+    # The JSON object in a (possibly gzipped) request body
+    try:
+        if content_encoding == "gzip":
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+    except (OSError, EOFError, zlib.error) as e:
+        raise PayloadError(f"Invalid gzip body: {e}")
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise PayloadError(f"Invalid JSON body: {e}")
+    if not isinstance(payload, dict):
+        raise PayloadError(f"Expected a JSON object, got {type(payload).__name__}")
+    return payload
+
+
+def _inflate(inflate, chunk):
+    try:
+        return inflate.decompress(chunk)
+    except zlib.error as e:
+        raise PayloadError(f"Invalid gzip body: {e}")
+
+
+class NDJSONError(PayloadError):
+    def __init__(self, line, message):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def _parse_ndjson_line(number, line):
+    try:
+        return json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise NDJSONError(number, f"invalid JSON ({e})")
+
+
+async def iter_ndjson(stream, content_encoding):
+    # Parse newline-delimited JSON from an async byte stream, inflating gzip
+    # on the fly so the body is never held in full. Yields (line number,
+    # record); a line that is not JSON raises NDJSONError with its number.
+    inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if content_encoding == "gzip" else None
+    buffer = b""
+    number = 0
+    async for chunk in stream:
+        if inflate is not None:
+            chunk = _inflate(inflate, chunk)
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, _parse_ndjson_line(number, line)
+    if inflate is not None:
+        buffer += inflate.flush()
+    for line in buffer.split(b"\n"):
+        number += 1
+        if line.strip():
+            yield number, _parse_ndjson_line(number, line)
@@ -0,0 +1,211 @@
+# Process-wide, versioned snapshot of the movies table.
+#
+# The catalog is loaded once and held as columnar arrays. Writers never mutate
+# a published snapshot; they build a new one and swap the module reference, so
+# a request that grabbed a snapshot keeps a consistent view until it finishes.
+import hashlib
+import heapq
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import db
+
+GENRE_NAMES = ['Comedy','Drama','Action','Sci-Fi','Thriller','Romance','Adventure','Crime']
+
+# Other workers may write the movies table; re-read at most this often (seconds)
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+
+
+def movie_numbers(ids):
+    # Movie ids as int64, -1 for ids that are not integers
+    ids = np.asarray(ids)
+    if ids.dtype.kind in "iu":
+        return ids.astype(np.int64)
+    out = np.full(len(ids), -1, dtype=np.int64)
+    for i, movie_id in enumerate(ids.tolist()):
+        try:
+            out[i] = int(movie_id)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+class CatalogSnapshot:
+    def __init__(self, rows, version):
+        self.version = version
+        self.loaded_at = time.time()
+        self._rows = tuple(rows)
+        self._frame = pd.DataFrame(list(self._rows))
+        # Content hash; unlike `version` it is the same in every process
+        self.checksum = hashlib.sha1(repr(self._rows).encode()).hexdigest()
+        n = len(self._rows)
+        self.size = n
+
+        frame = self._frame
+        self.ids = frame["id"].to_numpy() if n else np.empty(0, dtype=object)
+        self.titles = self._text("title")
+        self.genres = self._text("genres")
+        self.poster_urls = self._text("posterUrl")
+        self.year = self._number("year")
+        self.rating = self._number("rating")
+
+        # One bit per GENRE_NAMES entry, set when the genre string contains the
+        # name (the same test as `genres LIKE '%name%'`, which is
+        # case-insensitive under MySQL's default collations)
+        lowered = [g.lower() for g in self.genres]
+        self.genre_mask = np.zeros(n, dtype=np.uint8)
+        for bit, name in enumerate(GENRE_NAMES):
+            has_genre = np.fromiter((name.lower() in g for g in lowered), dtype=bool, count=n)
+            self.genre_mask[has_genre] |= np.uint8(1 << bit)
+
+        # Movie positions in `ORDER BY rating DESC` order (NULLs last, ties in
+        # table order), and per genre the ranks of its movies in that order,
+        # ascending: posting lists that merge straight into rating order
+        self.rating_order = np.lexsort((np.arange(n), -np.nan_to_num(self.rating), np.isnan(self.rating)))
+        rank = np.empty(n, dtype=np.int64)
+        rank[self.rating_order] = np.arange(n)
+        self.genre_ranked = [
+            np.sort(rank[(self.genre_mask >> bit) & 1 == 1]).tolist()
+            for bit in range(len(GENRE_NAMES))
+        ]
+
+        # 0/1 genre flags parsed once from the genres_vector column
+        self.genre_vectors = self._genre_vectors()
+        self.popularity = self._number("popularity")
+
+        # Exact-token view of the pipe-delimited genre strings: per-movie flags
+        # for GENRE_NAMES, distinct token count (1 when empty), and token ->
+        # movie positions
+        token_sets = [set(g.split("|")) if g else set() for g in self.genres]
+        self.genre_flags = np.zeros((n, len(GENRE_NAMES)), dtype=np.uint8)
+        for col, name in enumerate(GENRE_NAMES):
+            self.genre_flags[:, col] = [name in tokens for tokens in token_sets]
+        self.genre_count = np.array([len(tokens) or 1 for tokens in token_sets], dtype=np.int64)
+        postings = {}
+        for i, tokens in enumerate(token_sets):
+            for token in tokens:
+                postings.setdefault(token, []).append(i)
+        self.genre_postings = {token: np.array(idx, dtype=np.int64) for token, idx in postings.items()}
+
+        # Number of comma-separated tokens in each genre string
+        self.genre_tokens = np.fromiter((g.count(",") + 1 for g in self.genres), dtype=np.int64, count=n)
+
+        self.id_index = {movie_id: i for i, movie_id in enumerate(self.ids.tolist())}
+        self.id_numbers = movie_numbers(self.ids)
+        self.number_index = {number: i for i, number in enumerate(self.id_numbers.tolist()) if number >= 0}
+
+        # Catalog-level constants several recommenders reuse
+        self.rating_mean = float(np.nanmean(self.rating)) if n else 0.0
+        self.rating_std = float(pd.Series(self.rating).std()) if n else 0.0
+
+    def _text(self, column):
+        if column not in self._frame:
+            return np.full(self.size, "", dtype=object)
+        return self._frame[column].fillna("").to_numpy(dtype=object)
+
+    def _number(self, column):
+        if column not in self._frame:
+            return np.full(self.size, np.nan)
+        return pd.to_numeric(self._frame[column], errors="coerce").to_numpy(dtype=float)
+
+    def _genre_vectors(self):
+        if "genres_vector" not in self._frame:
+            return np.zeros((self.size, len(GENRE_NAMES)), dtype=np.uint8)
+        parsed = [
+            [int(x) for x in v.split(",")] if isinstance(v, str) and v else []
+            for v in self._frame["genres_vector"]
+        ]
+        width = max([len(GENRE_NAMES)] + [len(p) for p in parsed])
+        vectors = np.zeros((self.size, width), dtype=np.uint8)
+        for i, p in enumerate(parsed):
+            vectors[i, :len(p)] = p
+        return vectors
+
+    def top_by_genres(self, names, n, exclude=()):
+        # The rows of
+        #   SELECT * FROM movies WHERE (genres LIKE '%a%' OR ...) AND id NOT IN (...)
+        #   ORDER BY rating DESC LIMIT n
+        # from a k-way merge of the genres' posting lists; stops after n rows
+        # plus whatever was excluded on the way. `exclude` is any container of
+        # movie ids, normally the user's seen.SeenSet.
+        lists = [self.genre_ranked[GENRE_NAMES.index(name)] for name in names]
+        rows, last = [], -1
+        for rank in heapq.merge(*lists):
+            if rank == last:
+                continue  # in more than one of the genres
+            last = rank
+            pos = self.rating_order[rank]
+            if self.ids[pos] in exclude:
+                continue
+            rows.append(self._rows[pos])
+            if len(rows) == n:
+                break
+        return rows
+
+    def rows_of(self, movie_ids):
+        # Row positions for the given ids, matched as stored or by number (so
+        # "42" finds movie 42); -1 where the movie is not in the catalog
+        numbers = movie_numbers(list(movie_ids)).tolist()
+        return np.fromiter(
+            (self.id_index.get(m, self.number_index.get(num, -1)) for m, num in zip(movie_ids, numbers)),
+            dtype=np.int64, count=len(numbers)
+        )
+
+    def frame(self):
+        # Callers add columns and fillna in place, so hand out a copy
+        return self._frame.copy()
+
+    def take(self, idx):
+        # Rows at the given positions, in that order, as a new DataFrame
+        return self._frame.iloc[idx].reset_index(drop=True)
+
+    def records(self):
+        return list(self._rows)
+
+    def record(self, idx):
+        return self._rows[idx]
+
+
+_snapshot = None
+_version = 0
+_lock = threading.Lock()
+
+
+def _is_fresh(snap):
+    return snap is not None and time.time() - snap.loaded_at <= CATALOG_TTL
+
+
+def _load(force):
+    global _snapshot, _version
+    with _lock:
+        snap = _snapshot
+        if not force and _is_fresh(snap):
+            return snap  # another thread reloaded while we waited
+        rows = db.fetch_movies()
+        if snap is not None and list(snap._rows) == rows:
+            # Unchanged: keep the version so downstream caches stay valid
+            snap.loaded_at = time.time()
+            return snap
+        _version += 1
+        _snapshot = CatalogSnapshot(rows, _version)
+        return _snapshot
+
+
+def get_catalog():
+    snap = _snapshot
+    if not _is_fresh(snap):
+        snap = _load(force=False)
+    return snap
+
+
+def reload_catalog():
+    # Called after any write to the movies table
+    return _load(force=True)
+
+
+def catalog_version():
+    return get_catalog().version
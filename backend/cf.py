@@ -0,0 +1,74 @@
+# Sparse user-item rating matrix for the collaborative-filtering recommender.
+#
+# Ratings are held twice in CSR form: R with the rating values and B with a 1
+# for every (user, movie) pair that was rated, so a rating of 0 still counts
+# as a co-rated item. Pearson similarity against every user comes out of a
+# handful of sparse matrix-vector products over the co-rated items.
+import numpy as np
+from scipy import sparse
+
+# Co-rated items needed before a similarity is trusted
+MIN_COMMON = 2
+
+
+class RatingMatrix:
+    def __init__(self, user_ids, movie_ids, ratings):
+        self.users, user_idx = np.unique(np.asarray(user_ids), return_inverse=True)
+        self.movies, movie_idx = np.unique(np.asarray(movie_ids), return_inverse=True)
+        shape = (len(self.users), len(self.movies))
+        values = np.asarray(ratings, dtype=float)
+
+        self.R = sparse.csr_matrix((values, (user_idx, movie_idx)), shape=shape)
+        self.B = sparse.csr_matrix((np.ones_like(values), (user_idx, movie_idx)), shape=shape)
+        self.R2 = self.R.multiply(self.R).tocsr()
+        self.user_pos = {u: i for i, u in enumerate(self.users.tolist())}
+
+    @classmethod
+    def from_frame(cls, ratings_df):
+        return cls(ratings_df["UserID"].to_numpy(), ratings_df["MovieID"].to_numpy(),
+                   ratings_df["Rating"].to_numpy())
+
+    def _user_vectors(self, user_id):
+        row = self.user_pos[user_id]
+        return row, self.R[row].toarray().ravel(), self.B[row].toarray().ravel()
+
+    def similarities(self, user_id, min_common=MIN_COMMON):
+        # Pearson correlation between user_id and every other user over their
+        # co-rated movies. Users with fewer than min_common co-rated movies or
+        # constant ratings on them are dropped, as are non-positive matches.
+        # Returns (user_ids, correlations).
+        if user_id not in self.user_pos:
+            return self.users[:0], np.empty(0)
+        row, x, mask = self._user_vectors(user_id)
+
+        n = self.B @ mask
+        sx = self.B @ x
+        sxx = self.B @ (x * x)
+        sy = self.R @ mask
+        syy = self.R2 @ mask
+        sxy = self.R @ x
+
+        var_x = n * sxx - sx * sx
+        var_y = n * syy - sy * sy
+        cov = n * sxy - sx * sy
+
+        valid = (n >= min_common) & (var_x > 1e-9) & (var_y > 1e-9)
+        valid[row] = False
+        corr = np.zeros_like(cov)
+        corr[valid] = cov[valid] / np.sqrt(var_x[valid] * var_y[valid])
+        keep = valid & (corr > 0)
+        return self.users[keep], corr[keep]
+
+    def predict(self, user_ids, weights, exclude=None):
+        # Weighted average of the given users' ratings for every movie at least
+        # one of them rated: sum(w * r) / sum(w) over the users who rated it.
+        # `exclude` is a seen.SeenSet of movies to leave out.
+        w = np.zeros(len(self.users))
+        w[[self.user_pos[u] for u in user_ids]] = weights
+        weighted_sum = self.R.T @ w
+        weight_sum = self.B.T @ w
+
+        keep = weight_sum > 0
+        if exclude is not None:
+            keep &= ~exclude.mask(self.movies)
+        return dict(zip(self.movies[keep].tolist(), (weighted_sum[keep] / weight_sum[keep]).tolist()))
@@ -0,0 +1,112 @@
+# Negotiated response compression: brotli (when the brotli package is
+# installed) or gzip, for bodies of at least COMPRESS_MIN_BYTES.
+#
+# Only complete bodies are compressed (every JSON response here is sent in
+# one piece); streamed responses pass through unchanged. A compressed variant
+# is a different representation, so its ETag gets a "-br"/"-gzip" suffix,
+# which responses.etag_matches() strips again when checking If-None-Match.
+import gzip
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only without it
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # well past gzip's ratio at a similar speed for small JSON
+
+_COMPRESSIBLE = ("application/json", "text/")
+
+
+def _accepted(header):
+    # {coding: q} from an Accept-Encoding header
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = _accepted(header or "")
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:  # ties keep the earlier (smaller output) coding
+            best, best_q = coding, q
+    return best
+
+
+def _compress(body, coding):
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        coding = choose_encoding(request_headers.get("accept-encoding"))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # held until the body shows whether to compress
+                return
+            if start is None:
+                await send(message)
+                return
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            etag = headers.get("etag")
+            if start["status"] == 304 and etag and etag.endswith('"'):
+                # Confirm the variant the client holds
+                variant = f'{etag[:-1]}-{coding}"'
+                if variant in request_headers.get("if-none-match", ""):
+                    headers["ETag"] = variant
+            compress = (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(_COMPRESSIBLE)
+            )
+            if compress:
+                body = _compress(body, coding)
+                headers["Content-Encoding"] = coding
+                headers["Content-Length"] = str(len(body))
+                if etag and etag.endswith('"'):
+                    headers["ETag"] = f'{etag[:-1]}-{coding}"'
+                message = {**message, "body": body}
+            if compress or "content-encoding" not in headers:
+                headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
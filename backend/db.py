@@ -0,0 +1,234 @@
+# Shared data-access layer: one bounded connection pool for the whole
+# process, cached prepared statements for the hot queries, and pool metrics.
+# The pool comes from the configured storage backend (storage.py: MySQL, or
+# an embedded SQLite file with DB_BACKEND=sqlite).
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import anyio
+
+import metrics
+import storage
+
+DB_CONFIG = {
+    "host": os.getenv("DATABASE_HOST", "localhost"),
+    "port": int(os.getenv("DATABASE_PORT", "3306")),
+    "user": os.getenv("DATABASE_USER", "root"),
+    "password": os.getenv("DATABASE_PASSWORD", ""),
+    "database": os.getenv("DATABASE_NAME", "movies_mobile"),
+}
+
+# mysql.connector caps a pool at 32 connections
+POOL_SIZE = min(int(os.getenv("DB_POOL_SIZE", "8")), 32)
+# Seconds a request may wait for a free connection before giving up
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Worker threads async endpoints may occupy with blocking database work (see
+# run()); sized to the pool so callers queue here, off the event loop, rather
+# than on a connection slot
+OFFLOAD_THREADS = int(os.getenv("DB_OFFLOAD_THREADS", str(POOL_SIZE)))
+
+# Hot queries, executed through prepared statements cached per connection
+USER_BY_USERNAME = "SELECT * FROM users WHERE username = %s LIMIT 1"
+RATINGS_BY_USER = "SELECT MovieID, Rating FROM ratings WHERE UserID = %s"
+ALL_MOVIES = "SELECT * FROM movies"
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+_storage = None
+_pool = None
+_pool_lock = threading.Lock()
+# MySQLConnectionPool fails immediately when exhausted, so the semaphore is
+# what makes callers queue (bounded by POOL_TIMEOUT) instead of erroring.
+_slots = threading.BoundedSemaphore(POOL_SIZE)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "acquired": 0,
+    "timeouts": 0,
+    "in_use": 0,
+    "peak_in_use": 0,
+    "wait_total_ms": 0.0,
+    "wait_max_ms": 0.0,
+}
+
+
+def _get_pool():
+    global _storage, _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if _storage is None:
+                    _storage = storage.from_env(DB_CONFIG)
+                _pool = _storage.open_pool(POOL_SIZE)
+    return _pool
+
+
+def use(backend):
+    # Switch to another storage backend (e.g. storage.SQLiteStorage(path));
+    # call before the first query, connections already handed out are not
+    # moved over
+    global _storage, _pool
+    with _pool_lock:
+        _storage, _pool = backend, None
+
+
+def _acquire():
+    start = time.perf_counter()
+    if not _slots.acquire(timeout=POOL_TIMEOUT):
+        with _stats_lock:
+            _stats["timeouts"] += 1
+        raise PoolTimeout(f"No database connection available after {POOL_TIMEOUT}s")
+    try:
+        conn = _get_pool().get_connection()
+    except Exception:
+        _slots.release()
+        raise
+    waited_ms = (time.perf_counter() - start) * 1000
+    with _stats_lock:
+        _stats["acquired"] += 1
+        _stats["in_use"] += 1
+        _stats["peak_in_use"] = max(_stats["peak_in_use"], _stats["in_use"])
+        _stats["wait_total_ms"] += waited_ms
+        _stats["wait_max_ms"] = max(_stats["wait_max_ms"], waited_ms)
+    return conn
+
+
+def _release(conn):
+    try:
+        # End any implicit read transaction so the next borrower does not see
+        # a stale REPEATABLE READ snapshot.
+        if conn.in_transaction:
+            conn.rollback()
+    except Exception:
+        _drop_statements(conn)
+    finally:
+        try:
+            conn.close()  # returns the connection to the pool
+        finally:
+            with _stats_lock:
+                _stats["in_use"] -= 1
+            _slots.release()
+
+
+@contextmanager
+def connection():
+    # Timed as the request's "db" stage, including the wait for a connection
+    with metrics.stage("db"):
+        conn = _acquire()
+        try:
+            yield conn
+        finally:
+            _release(conn)
+
+
+@contextmanager
+def cursor(dictionary=True):
+    # Read-only access; the connection goes back to the pool on every path,
+    # including HTTPExceptions raised inside the block.
+    with connection() as conn:
+        cur = conn.cursor(dictionary=dictionary)
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+
+@contextmanager
+def transaction(dictionary=False):
+    # Commits when the block exits normally, rolls back otherwise.
+    with connection() as conn:
+        cur = conn.cursor(dictionary=dictionary)
+        try:
+            yield cur
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def _raw(conn):
+    # Pooled connections are thin wrappers around the real connection, which
+    # is the object that lives as long as its prepared statements do.
+    return getattr(conn, "_cnx", conn)
+
+
+def _drop_statements(conn):
+    raw = _raw(conn)
+    for cur in getattr(raw, "_prepared_cursors", {}).values():
+        try:
+            cur.close()
+        except Exception:
+            pass
+    raw._prepared_cursors = {}
+
+
+def _prepared(conn, sql):
+    raw = _raw(conn)
+    cache = getattr(raw, "_prepared_cursors", None)
+    if cache is None:
+        cache = raw._prepared_cursors = {}
+    cur = cache.get(sql)
+    if cur is None:
+        cur = cache[sql] = conn.cursor(prepared=True, dictionary=True)
+    return cur
+
+
+def fetch_prepared(sql, params=()):
+    with connection() as conn:
+        cur = _prepared(conn, sql)
+        try:
+            cur.execute(sql, params)
+            return cur.fetchall()
+        except Exception:
+            _drop_statements(conn)
+            raise
+
+
+def fetch_user(username):
+    rows = fetch_prepared(USER_BY_USERNAME, (username,))
+    return rows[0] if rows else None
+
+
+def fetch_user_ratings(user_id):
+    return fetch_prepared(RATINGS_BY_USER, (user_id,))
+
+
+def fetch_movies():
+    return fetch_prepared(ALL_MOVIES)
+
+
+_limiter = None
+
+
+async def run(func, *args, **kwargs):
+    # Run blocking database code from an async endpoint on a bounded set of
+    # worker threads. The connector is synchronous, so calling it directly in
+    # an `async def` would stall every request on this worker's event loop.
+    # (Plain `def` endpoints already run on Starlette's thread pool.)
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(OFFLOAD_THREADS)
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_limiter)
+
+
+def pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["backend"] = _storage.name if _storage is not None else storage.BACKEND
+    stats["pool_size"] = POOL_SIZE
+    stats["timeout_s"] = POOL_TIMEOUT
+    stats["wait_avg_ms"] = stats["wait_total_ms"] / stats["acquired"] if stats["acquired"] else 0.0
+    stats["offload_threads"] = OFFLOAD_THREADS
+    if _limiter is not None:
+        limiter_stats = _limiter.statistics()
+        stats["offload_busy"] = limiter_stats.borrowed_tokens
+        stats["offload_waiting"] = limiter_stats.tasks_waiting
+    return stats
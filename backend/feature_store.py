@@ -0,0 +1,436 @@
+# Materialized rating aggregates for the feature builders, kept in MySQL.
+#
+#   movie_rating_stats   per MovieID: rating count, sum and sum of squares,
+#                        and the count and sum of the raters' ages
+#   group_rating_stats   per (grp, k): rating count, sum and sum of squares
+#                        over the ratings of the users in group k of
+#                          occupation   users.occupation (NULL as 0)
+#                          age_bucket   index into AGE_BUCKETS, -1 for NULL
+#                          genre_input  the genre-cluster model's 2-bit
+#                                       input, -1 without preferred_genres
+#
+# Like user_stats, the tables are built in bulk from ratings and users
+# (rebuild(), on first use or offline) and then adjusted in the same
+# transaction as each rating (apply_rating()): one movie row and three group
+# rows, whatever the table sizes. Ratings uploads sum each chunk's deltas per
+# row first (apply_ratings()). Clusters are keyed by the model's input rather
+# than its label, so swapping the genre-cluster model regroups the sums at
+# read time instead of invalidating them.
+#
+# Each process reads the tables into arrays (get_store()), applies its own
+# committed updates in place (add()), and re-reads them every
+# FEATURE_STORE_TTL seconds to pick up other workers' writes. A profile
+# change, including through the device sync, moves the user's sums between
+# groups (move_user()); raters' ages in movie_rating_stats stay as they were
+# at rating time until the next rebuild.
+import bisect
+import hashlib
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import db
+from catalog import movie_numbers
+from registry import registry
+from user_index import get_users, parse_genre_flags
+
+FEATURE_STORE_TTL = float(os.getenv("FEATURE_STORE_TTL", "60"))
+
+# Lower bounds of age buckets 1..6 (the MovieLens age codes); younger is 0
+AGE_BUCKETS = (18, 25, 35, 45, 50, 56)
+GROUPS = ("occupation", "age_bucket", "genre_input")
+
+MOVIE_DDL = """
+    CREATE TABLE IF NOT EXISTS movie_rating_stats (
+        MovieID BIGINT NOT NULL PRIMARY KEY,
+        n INT NOT NULL DEFAULT 0,
+        total DOUBLE NOT NULL DEFAULT 0,
+        total_sq DOUBLE NOT NULL DEFAULT 0,
+        age_n INT NOT NULL DEFAULT 0,
+        age_total DOUBLE NOT NULL DEFAULT 0
+    )
+"""
+
+GROUP_DDL = """
+    CREATE TABLE IF NOT EXISTS group_rating_stats (
+        grp VARCHAR(16) NOT NULL,
+        k INT NOT NULL,
+        n INT NOT NULL DEFAULT 0,
+        total DOUBLE NOT NULL DEFAULT 0,
+        total_sq DOUBLE NOT NULL DEFAULT 0,
+        PRIMARY KEY (grp, k)
+    )
+"""
+
+_APPLY_MOVIE = """
+    INSERT INTO movie_rating_stats (MovieID, n, total, total_sq, age_n, age_total)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        n = n + VALUES(n), total = total + VALUES(total), total_sq = total_sq + VALUES(total_sq),
+        age_n = age_n + VALUES(age_n), age_total = age_total + VALUES(age_total)
+"""
+
+_APPLY_GROUP = """
+    INSERT INTO group_rating_stats (grp, k, n, total, total_sq)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        n = n + VALUES(n), total = total + VALUES(total), total_sq = total_sq + VALUES(total_sq)
+"""
+
+_ready = False
+_ready_lock = threading.Lock()
+
+
+def ensure_tables():
+    # Create the tables on first use and build them if they are empty
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        with db.transaction() as cursor:
+            cursor.execute(MOVIE_DDL)
+            cursor.execute(GROUP_DDL)
+            cursor.execute("SELECT 1 FROM movie_rating_stats LIMIT 1")
+            empty = cursor.fetchone() is None
+        if empty:
+            _rebuild()
+        _ready = True
+
+
+def rebuild():
+    # Recompute both tables from ratings and users, e.g. after a bulk load
+    ensure_tables()
+    _rebuild()
+
+
+def _rebuild():
+    users = get_users()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT UserID, MovieID, Rating FROM ratings WHERE Rating IS NOT NULL")
+        rows = cursor.fetchall()
+
+    movie = movie_numbers([r["MovieID"] for r in rows])
+    rating = np.array([float(r["Rating"]) for r in rows], dtype=float)
+    user_rows = users.rows_of([r["UserID"] for r in rows])
+    keep = (movie >= 0) & np.isfinite(rating)
+    movie, rating, user_rows = movie[keep], rating[keep], user_rows[keep]
+
+    size = int(movie.max()) + 1 if len(movie) else 0
+    age = np.full(len(movie), np.nan)
+    known = user_rows >= 0
+    age[known] = users.age[user_rows[known]]
+    aged = np.isfinite(age)
+    movie_stats = np.column_stack([
+        np.bincount(movie, minlength=size),
+        np.bincount(movie, weights=rating, minlength=size),
+        np.bincount(movie, weights=rating * rating, minlength=size),
+        np.bincount(movie[aged], minlength=size),
+        np.bincount(movie[aged], weights=age[aged], minlength=size),
+    ])
+    rated = np.flatnonzero(movie_stats[:, 0])
+
+    # Ratings by users missing from the users table count for their movie only
+    group_rows = []
+    rating, user_rows = rating[known], user_rows[known]
+    for grp, keys in zip(GROUPS, user_keys(users, user_rows)):
+        values, inverse = np.unique(keys, return_inverse=True)
+        sums = np.column_stack([
+            np.bincount(inverse, minlength=len(values)),
+            np.bincount(inverse, weights=rating, minlength=len(values)),
+            np.bincount(inverse, weights=rating * rating, minlength=len(values)),
+        ])
+        group_rows += [(grp, int(k), int(s[0]), float(s[1]), float(s[2])) for k, s in zip(values.tolist(), sums)]
+
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM movie_rating_stats")
+        cursor.execute("DELETE FROM group_rating_stats")
+        cursor.executemany(
+            "INSERT INTO movie_rating_stats (MovieID, n, total, total_sq, age_n, age_total) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [(int(m), int(s[0]), float(s[1]), float(s[2]), int(s[3]), float(s[4]))
+             for m, s in zip(rated.tolist(), movie_stats[rated])]
+        )
+        cursor.executemany(
+            "INSERT INTO group_rating_stats (grp, k, n, total, total_sq) VALUES (%s, %s, %s, %s, %s)",
+            group_rows
+        )
+    invalidate()
+
+
+def _age_bucket(age):
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        return -1
+    return -1 if math.isnan(age) else bisect.bisect_right(AGE_BUCKETS, age)
+
+
+def _genre_input(flags):
+    # (g2 | g3, g2 | g4) as the model's lookup-table index
+    g = (list(flags) + [0] * 5)[:5]
+    return 2 * int(bool(g[2] or g[3])) + int(bool(g[2] or g[4]))
+
+
+def group_keys(user_row):
+    # (occupation, age_bucket, genre_input) keys of a users row
+    flags = parse_genre_flags(user_row.get("preferred_genres"))
+    return (
+        int(user_row.get("occupation") or 0),
+        _age_bucket(user_row.get("age")),
+        _genre_input(flags) if flags is not None else -1,
+    )
+
+
+def user_keys(users, rows):
+    # group_keys() for user_index rows, as three int arrays
+    age = users.age[rows]
+    bucket = np.where(np.isnan(age), -1, np.searchsorted(AGE_BUCKETS, np.nan_to_num(age), side="right"))
+    g = users.genre_flags[rows].astype(bool)
+    genre_input = np.where(users.has_genres[rows], 2 * (g[:, 2] | g[:, 3]) + (g[:, 2] | g[:, 4]), -1)
+    return users.occupation[rows], bucket, genre_input
+
+
+def cluster_labels(genre_inputs):
+    # Genre-cluster labels for genre_input keys, -1 where the key is -1
+    table = np.asarray(registry.get("genre_cluster").predict([[a, b] for a in (0, 1) for b in (0, 1)]), dtype=np.int64)
+    genre_inputs = np.asarray(genre_inputs, dtype=np.int64)
+    return np.where(genre_inputs >= 0, table[np.maximum(genre_inputs, 0)], -1)
+
+
+def _sums(rating):
+    if rating is None or (isinstance(rating, float) and math.isnan(rating)):
+        return np.zeros(3)
+    rating = float(rating)
+    return np.array([1.0, rating, rating * rating])
+
+
+class Update:
+    # The deltas one transaction wrote; add() applies them to this process's
+    # copy once the transaction has committed
+
+    def __init__(self):
+        self.created = time.time()
+        self.movies = []  # (MovieID, [n, total, total_sq, age_n, age_total])
+        self.groups = []  # ((grp, k), [n, total, total_sq])
+
+    def _movie(self, cursor, movie_id, delta):
+        self._movies(cursor, [(movie_id, delta)])
+
+    def _group(self, cursor, grp, k, delta):
+        self._groups(cursor, [((grp, k), delta)])
+
+    def _movies(self, cursor, items):
+        items = [(int(m), d) for m, d in items]
+        cursor.executemany(_APPLY_MOVIE, [(m, int(d[0]), float(d[1]), float(d[2]), int(d[3]), float(d[4]))
+                                          for m, d in items])
+        self.movies += items
+
+    def _groups(self, cursor, items):
+        items = [((grp, int(k)), d) for (grp, k), d in items]
+        cursor.executemany(_APPLY_GROUP, [(grp, k, int(d[0]), float(d[1]), float(d[2])) for (grp, k), d in items])
+        self.groups += items
+
+
+def apply_rating(cursor, user_row, movie_id, new_rating, old_rating=None):
+    # Adjust the aggregates for one rating insert or overwrite on the caller's
+    # cursor, so they commit together with the rating; call ensure_tables()
+    # before opening that transaction. Pass the result to add() after commit.
+    update = Update()
+    delta = _sums(new_rating) - _sums(old_rating)
+    if not delta.any():
+        return update
+    age = user_row.get("age")
+    aged = _age_bucket(age) >= 0
+    update._movie(cursor, movie_id, np.concatenate([delta, [delta[0] if aged else 0, delta[0] * float(age) if aged else 0]]))
+    for grp, k in zip(GROUPS, group_keys(user_row)):
+        update._group(cursor, grp, k, delta)
+    return update
+
+
+def apply_ratings(cursor, changes):
+    # apply_rating() for a bulk load: changes are (UserID, MovieID,
+    # new_rating, old_rating), at most one per pair. Deltas are summed per
+    # movie and per group, so each row of either table is written once.
+    update = Update()
+    if not changes:
+        return update
+    delta = np.array([_sums(new) - _sums(old) for _, _, new, old in changes])
+    changed = np.flatnonzero(delta.any(axis=1))
+    if not len(changed):
+        return update
+    delta = delta[changed]
+    movies = np.array([int(changes[i][1]) for i in changed.tolist()], dtype=np.int64)
+    users = get_users()
+    rows = users.rows_of([changes[i][0] for i in changed.tolist()])
+    known = rows >= 0
+    age = np.full(len(rows), np.nan)
+    age[known] = users.age[rows[known]]
+    aged = np.isfinite(age)
+    movie_delta = np.column_stack([
+        delta,
+        np.where(aged, delta[:, 0], 0.0),
+        np.where(aged, delta[:, 0] * np.nan_to_num(age), 0.0),
+    ])
+    ids, inverse = np.unique(movies, return_inverse=True)
+    sums = np.zeros((len(ids), 5))
+    np.add.at(sums, inverse, movie_delta)
+    update._movies(cursor, zip(ids.tolist(), sums))
+
+    # As in _rebuild(), raters missing from the users table count for their movie only
+    group_items = []
+    for grp, keys in zip(GROUPS, user_keys(users, rows[known])):
+        values, inverse = np.unique(keys, return_inverse=True)
+        sums = np.zeros((len(values), 3))
+        np.add.at(sums, inverse, delta[known])
+        group_items += [((grp, k), d) for k, d in zip(values.tolist(), sums)]
+    if group_items:
+        update._groups(cursor, group_items)
+    return update
+
+
+def move_user(cursor, user_id, old_row, new_row):
+    # Move a user's rating sums to the groups of their new profile, in the
+    # transaction that changes it; old_row None means the user had no profile
+    # yet, so their sums only join the new groups. Needs
+    # user_stats.ensure_table().
+    update = Update()
+    old_keys = group_keys(old_row) if old_row is not None else (None,) * len(GROUPS)
+    new_keys = group_keys(new_row)
+    if old_keys == new_keys:
+        return update
+    cursor.execute("SELECT n, total, total_sq FROM user_rating_stats WHERE UserID = %s", (user_id,))
+    row = cursor.fetchone()
+    if not row or not row[0]:
+        return update
+    sums = np.array([float(v) for v in row])
+    for grp, old, new in zip(GROUPS, old_keys, new_keys):
+        if old != new:
+            if old is not None:
+                update._group(cursor, grp, old, -sums)
+            update._group(cursor, grp, new, sums)
+    return update
+
+
+def _mean(sums, default):
+    return sums[1] / sums[0] if sums is not None and sums[0] > 0 else default
+
+
+class FeatureStore:
+    def __init__(self, movie_rows, group_rows):
+        ids = movie_numbers([r["MovieID"] for r in movie_rows])
+        self.movies = np.zeros((int(ids.max()) + 1 if len(ids) else 0, 5))  # indexed by MovieID
+        if len(ids):
+            self.movies[ids] = [[r["n"], r["total"], r["total_sq"], r["age_n"], r["age_total"]] for r in movie_rows]
+        self.groups = {
+            (r["grp"], int(r["k"])): np.array([r["n"], r["total"], r["total_sq"]], dtype=float)
+            for r in group_rows
+        }
+        self.lock = threading.Lock()
+        self.loaded_at = time.time()
+        self._checksum = None
+
+    def checksum(self):
+        # Digest of the aggregates, for fingerprints of responses built from
+        # them; recomputed after add()
+        with self.lock:
+            if self._checksum is None:
+                digest = hashlib.sha1(np.ascontiguousarray(self.movies).tobytes())
+                for key in sorted(self.groups):
+                    digest.update(repr((key, self.groups[key].tolist())).encode())
+                self._checksum = digest.hexdigest()
+            return self._checksum
+
+    def add(self, update):
+        with self.lock:
+            self._checksum = None
+            for movie_id, delta in update.movies:
+                if movie_id >= len(self.movies):
+                    grown = np.zeros((movie_id + 1, 5))
+                    grown[:len(self.movies)] = self.movies
+                    self.movies = grown
+                self.movies[movie_id] += delta
+            for key, delta in update.groups:
+                self.groups[key] = self.groups.get(key, np.zeros(3)) + delta
+
+    def movie_features(self, snap, default_age, rows=None):
+        # (rating std, mean rater age, rating count) of the catalog movies at
+        # the given positions (all of them by default); movies with too few
+        # ratings get the catalog std, default_age and, as popularity, the
+        # catalog size the models were given before these aggregates existed
+        ids = snap.id_numbers if rows is None else snap.id_numbers[rows]
+        stats = np.zeros((len(ids), 5))
+        with self.lock:
+            inside = (ids >= 0) & (ids < len(self.movies))
+            stats[inside] = self.movies[ids[inside]]
+        n, total, total_sq, age_n, age_total = stats.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.sqrt(np.maximum(0.0, (total_sq - total * total / n) / (n - 1)))
+            age = age_total / age_n
+        return (np.where(n > 1, std, snap.rating_std), np.where(age_n > 0, age, default_age),
+                np.where(n > 0, n, snap.size))
+
+    def group_means(self, grp, keys, default):
+        # Mean rating of each key's group, default for groups without ratings
+        keys = np.asarray(keys, dtype=np.int64)
+        out = np.empty(len(keys))
+        with self.lock:
+            for k in np.unique(keys).tolist():
+                out[keys == k] = _mean(self.groups.get((grp, k)), default)
+        return out
+
+    def cluster_means(self, labels, default):
+        # Mean rating per genre-cluster label, from the genre_input groups
+        table = cluster_labels(range(4)).tolist()
+        labels = np.asarray(labels, dtype=np.int64)
+        out = np.empty(len(labels))
+        with self.lock:
+            for label in np.unique(labels).tolist():
+                members = [self.groups.get(("genre_input", i)) for i, l in enumerate(table) if l == label]
+                members = [m for m in members if m is not None]
+                out[labels == label] = _mean(sum(members) if members else None, default)
+        return out
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    store = _store
+    if store is not None and time.time() - store.loaded_at <= FEATURE_STORE_TTL:
+        return store
+    ensure_tables()
+    with _lock:
+        store = _store
+        if store is None or time.time() - store.loaded_at > FEATURE_STORE_TTL:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT * FROM movie_rating_stats")
+                movie_rows = cursor.fetchall()
+                cursor.execute("SELECT * FROM group_rating_stats")
+                group_rows = cursor.fetchall()
+            store = _store = FeatureStore(movie_rows, group_rows)
+        return store
+
+
+def add(update):
+    # Apply a committed Update to this process's copy. A copy loaded after the
+    # update was written may already include it; that one is re-read instead.
+    store = _store
+    if store is None or not (update.movies or update.groups):
+        return
+    if store.loaded_at < update.created:
+        store.add(update)
+    else:
+        invalidate()
+
+
+def invalidate():
+    store = _store
+    if store is not None:
+        store.loaded_at = 0.0
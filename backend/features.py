@@ -0,0 +1,144 @@
+# Column-wise feature builders for the recommenders.
+#
+# Each builder produces the whole (n_movies x n_features) matrix for one user
+# with array operations over a CatalogSnapshot, in the same column order the
+# models were trained with.
+import numpy as np
+
+import feature_store
+
+
+def _as_float(value):
+    return np.nan if value is None else float(value)
+
+
+def future_rating_features(snap, store, user_avg_rating, user_std_rating, user_age,
+                           user_occupation, cluster_label, user_genres):
+    # Inputs for xgb_predicting_future_movie_ratings_model:
+    #   avg_rating_by_occupation, user_avg_rating, user_std_rating,
+    #   movie_avg_viewer_age, user_movie_avg_diff, movie_std_rating,
+    #   movie_popularity, Occupation, cluster, genre_match
+    # Group and movie aggregates come from the feature_store; without
+    # ratings they fall back to the user's own values and the catalog std.
+    n = snap.size
+    movie_std, viewer_age, popularity = store.movie_features(snap, _as_float(user_age))
+    X = np.empty((n, 10), dtype=float)
+    X[:, 0] = store.group_means("occupation", [user_occupation], _as_float(user_avg_rating))[0]
+    X[:, 1] = _as_float(user_avg_rating)
+    X[:, 2] = _as_float(user_std_rating)
+    X[:, 3] = viewer_age
+    X[:, 4] = _as_float(user_avg_rating) - snap.rating
+    X[:, 5] = movie_std
+    X[:, 6] = popularity
+    X[:, 7] = user_occupation
+    X[:, 8] = cluster_label
+    X[:, 9] = genre_match(snap, user_genres)
+    return X
+
+
+def genre_match(snap, user_genres):
+    # A movie with k genre tokens matches the sum of the user's first k genre
+    # flags, i.e. a prefix sum looked up by token count.
+    prefix = np.concatenate(([0], np.cumsum(user_genres)))
+    return prefix[np.minimum(snap.genre_tokens, len(user_genres))]
+
+
+def like_dislike_features(snap, preferred_genres, user_age, user_occupation):
+    # Inputs for xgb_classifier_predicting_like_vs_dislike_model:
+    #   genre overlap, age-year diff, occupation % 10, popularity, genre count,
+    #   overlap x popularity, year, user age, preferred genre count,
+    #   overlap + occupation
+    G = snap.genre_vectors
+    prefs = np.zeros(G.shape[1], dtype=np.int64)
+    k = min(len(preferred_genres), G.shape[1])
+    prefs[:k] = preferred_genres[:k]
+
+    overlap = (G & prefs).sum(axis=1)
+    # Missing or zero year/popularity fall back to 2000 and 1, as before
+    year = np.trunc(np.where(np.isnan(snap.year) | (snap.year == 0), 2000, snap.year))
+    popularity = np.trunc(np.where(np.isnan(snap.popularity) | (snap.popularity == 0), 1, snap.popularity))
+
+    X = np.empty((snap.size, 10), dtype=float)
+    X[:, 0] = overlap
+    X[:, 1] = user_age - year
+    X[:, 2] = user_occupation % 10
+    X[:, 3] = popularity
+    X[:, 4] = (G == 1).sum(axis=1)
+    X[:, 5] = overlap * popularity
+    X[:, 6] = year
+    X[:, 7] = user_age
+    X[:, 8] = sum(preferred_genres)
+    X[:, 9] = overlap + user_occupation
+    return X
+
+
+def recommendation_features(snap, candidates, age, gender_m, occupation,
+                            total_ratings, avg_rating, std_rating):
+    # Inputs for xgb_model (the /recommendations classifier): 6 user columns,
+    # rating, year, genre count and one flag per GENRE_NAMES entry
+    X = np.empty((len(candidates), 17), dtype=float)
+    X[:, 0] = age
+    X[:, 1] = gender_m
+    X[:, 2] = occupation
+    X[:, 3] = total_ratings
+    X[:, 4] = avg_rating
+    X[:, 5] = std_rating
+    X[:, 6] = np.nan_to_num(snap.rating[candidates], nan=0.0)
+    year = snap.year[candidates]
+    X[:, 7] = np.where(np.isnan(year) | (year == 0), 2000, year)
+    X[:, 8] = snap.genre_count[candidates]
+    X[:, 9:] = snap.genre_flags[candidates]
+    return X
+
+
+# Column order of pair_features, as /compute_features reports them
+PAIR_FEATURES = [
+    "avg_rating_by_occupation", "user_avg_rating", "user_std_rating",
+    "avg_rating_by_age", "user_movie_avg_diff", "movie_std_rating",
+    "movie_avg_viewer_age", "movie_popularity", "Occupation",
+    "avg_rating_by_cluster",
+]
+
+
+def pair_features(snap, users, store, movie_rows, user_rows):
+    # Inputs for xgb_predicting_future_movie_ratings_model, one row per
+    # (user, movie) pair given as catalog and user_index positions. Group and
+    # movie aggregates come from the feature_store, falling back to the
+    # catalog mean and std and the users' mean age where there are no
+    # ratings; the user's own average is still the catalog mean.
+    occupation, age_bucket, genre_input = feature_store.user_keys(users, user_rows)
+    movie_std, viewer_age, popularity = store.movie_features(snap, users.age_mean, movie_rows)
+    X = np.empty((len(movie_rows), len(PAIR_FEATURES)), dtype=float)
+    X[:, 0] = store.group_means("occupation", occupation, snap.rating_mean)
+    X[:, 1] = snap.rating_mean
+    X[:, 2] = snap.rating_std
+    X[:, 3] = store.group_means("age_bucket", age_bucket, snap.rating_mean)
+    X[:, 4] = snap.rating_mean - snap.rating[movie_rows]
+    X[:, 5] = movie_std
+    X[:, 6] = viewer_age
+    X[:, 7] = popularity
+    X[:, 8] = occupation
+    X[:, 9] = store.cluster_means(feature_store.cluster_labels(genre_input), snap.rating_mean)
+    return X
+
+
+def token_genre_match(snap, tokens):
+    # Number of the given genre tokens each movie carries
+    match = np.zeros(snap.size, dtype=np.int64)
+    for token in tokens:
+        idx = snap.genre_postings.get(token)
+        if idx is not None:
+            match[idx] += 1
+    return match
+
+
+def top_k(scores, k):
+    # Indices of the k highest scores, best first, without sorting everything
+    scores = np.asarray(scores)
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=int)
+    if k < scores.size:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.size)
+    return idx[np.argsort(-scores[idx], kind="stable")]
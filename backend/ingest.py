@@ -0,0 +1,143 @@
+# Streaming bulk ingest of pipe-delimited ratings files
+# (UserID|MovieID|Rating|Timestamp, as in ratings.dat).
+#
+# The file is parsed line by line into fixed-size chunks; each chunk is written
+# with multi-row upserts and committed on its own, so memory stays bounded and
+# locks are held for one chunk at a time rather than for the whole file. The
+# ratings a chunk overwrites are read first, so the feature_store aggregates
+# are adjusted by the chunk's deltas in the same transaction.
+import io
+import time
+
+import db
+import feature_store
+import rec_store
+import seen
+import user_stats
+
+CHUNK_ROWS = 10000   # rows per transaction
+BATCH_ROWS = 1000    # rows per INSERT statement
+
+_UPSERT_HEAD = "INSERT INTO ratings (UserID, MovieID, Rating, Timestamp) VALUES "
+_UPSERT_TAIL = " ON DUPLICATE KEY UPDATE Rating=VALUES(Rating), Timestamp=VALUES(Timestamp)"
+
+RATINGS_DDL = """
+    CREATE TABLE IF NOT EXISTS ratings (
+        UserID INT NOT NULL,
+        MovieID INT NOT NULL,
+        Rating FLOAT,
+        Timestamp BIGINT,
+        PRIMARY KEY (UserID, MovieID)
+    )
+"""
+
+
+def _optional(value, cast):
+    value = value.strip()
+    if not value or value.lower() == "nan":
+        return None
+    return cast(float(value)) if cast is int else cast(value)
+
+
+def parse_line(line):
+    fields = line.rstrip("\r\n").split("|")
+    if len(fields) != 4:
+        raise ValueError(f"expected 4 fields, got {len(fields)}")
+    return (
+        int(fields[0]),
+        int(fields[1]),
+        _optional(fields[2], float),
+        _optional(fields[3], int),
+    )
+
+
+def iter_chunks(lines, chunk_rows=CHUNK_ROWS):
+    # Yields (rows, error_count) per chunk of input lines; blank lines are skipped
+    rows, errors = [], 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            rows.append(parse_line(line))
+        except ValueError:
+            errors += 1
+        if len(rows) + errors >= chunk_rows:
+            yield rows, errors
+            rows, errors = [], 0
+    if rows or errors:
+        yield rows, errors
+
+
+def previous_ratings(cursor, rows, batch_rows=BATCH_ROWS):
+    # {(UserID, MovieID): Rating} for the pairs in rows that already exist
+    wanted = {(row[0], row[1]) for row in rows}
+    users = sorted({row[0] for row in rows})
+    found = {}
+    for start in range(0, len(users), batch_rows):
+        chunk = users[start:start + batch_rows]
+        cursor.execute(
+            f"SELECT UserID, MovieID, Rating FROM ratings WHERE UserID IN ({','.join(['%s'] * len(chunk))})", chunk
+        )
+        for user_id, movie_id, rating in cursor.fetchall():
+            if (int(user_id), int(movie_id)) in wanted:
+                found[(int(user_id), int(movie_id))] = rating
+    return found
+
+
+def upsert_ratings(cursor, rows, batch_rows=BATCH_ROWS):
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        sql = _UPSERT_HEAD + ",".join(["(%s, %s, %s, %s)"] * len(batch)) + _UPSERT_TAIL
+        cursor.execute(sql, [value for row in batch for value in row])
+
+
+def ingest_ratings(binary_stream, chunk_rows=CHUNK_ROWS, batch_rows=BATCH_ROWS, encoding="utf-8"):
+    with db.transaction() as cursor:
+        cursor.execute(RATINGS_DDL)
+    user_stats.ensure_table()
+    rec_store.ensure_table()
+    feature_store.ensure_tables()
+
+    # Undecodable bytes become U+FFFD, which no field parses, so the line is
+    # counted as rejected rather than aborting the upload mid-way
+    lines = io.TextIOWrapper(binary_stream, encoding=encoding, errors="replace", newline="")
+    start = time.perf_counter()
+    total_rows = total_errors = 0
+    chunks = []
+
+    for rows, errors in iter_chunks(lines, chunk_rows):
+        chunk_start = time.perf_counter()
+        parsed = len(rows)
+        if rows:
+            # A pair repeated within the chunk keeps its last line, as the upsert does
+            rows = list({(row[0], row[1]): row for row in rows}.values())
+            with db.transaction() as cursor:
+                previous = previous_ratings(cursor, rows, batch_rows)
+                aggregates = feature_store.apply_ratings(
+                    cursor, [(u, m, rating, previous.get((u, m))) for u, m, rating, _ in rows]
+                )
+                upsert_ratings(cursor, rows, batch_rows)
+                # Keep the per-user stats in step with this chunk
+                users = {row[0] for row in rows}
+                user_stats.recompute_users(cursor, users)
+                rec_store.forget(cursor, users)
+            seen.forget(users)
+            feature_store.add(aggregates)
+        total_rows += parsed
+        total_errors += errors
+        chunks.append({
+            "chunk": len(chunks),
+            "rows": parsed,
+            "errors": errors,
+            "seconds": round(time.perf_counter() - chunk_start, 4),
+        })
+
+    lines.detach()  # leave the caller's stream open
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": total_rows,
+        "errors": total_errors,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(total_rows / elapsed, 1) if elapsed > 0 else 0.0,
+        "chunks": chunks,
+    }
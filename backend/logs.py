@@ -0,0 +1,51 @@
+# Level-gated, sampled logging for request diagnostics.
+#
+#   LOG_LEVEL=WARNING       records below this level are dropped at the call
+#                           site (pass arguments, not f-strings, so nothing is
+#                           formatted either)
+#   LOG_SAMPLE_RATE=1.0     fraction of requests whose DEBUG/INFO records are
+#                           kept; a request is sampled as a whole, so its
+#                           diagnostics stay together. Warnings and errors are
+#                           always kept.
+import logging
+import os
+import random
+from contextvars import ContextVar
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+_sampled = ContextVar("log_sampled", default=None)
+
+
+class _SampleFilter(logging.Filter):
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or LOG_SAMPLE_RATE >= 1.0:
+            return True
+        sampled = _sampled.get()
+        if sampled is None:  # outside a request: sample record by record
+            return random.random() < LOG_SAMPLE_RATE
+        return sampled
+
+
+_root = logging.getLogger("movies")
+_root.setLevel(LOG_LEVEL)
+_root.propagate = False
+if not _root.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _handler.addFilter(_SampleFilter())
+    _root.addHandler(_handler)
+
+
+def get_logger(name):
+    return _root.getChild(name)
+
+
+def begin_request():
+    # Decide whether this request's DEBUG/INFO records are kept
+    return _sampled.set(LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE)
+
+
+def end_request(token):
+    _sampled.reset(token)
@@ -1,31 +1,59 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from pydantic import BaseModel
-from joblib import load
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Depends, Header
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Dict, Optional
-import mysql.connector
 from xgboost import XGBRegressor
-import joblib
 import pandas as pd
 import time
 import numpy as np
 from xgboost import XGBClassifier
 import pickle
-import io
 from fastapi import Body
-import random
 import hashlib
-
-app = FastAPI()
-
-genre_cluster_model = load("models/users_with_same_genres_preferences_cluster.pkl")
-print(">>> RUNNING main.py <<<")
+import json
+import os
+import secrets
+import db
+from catalog import get_catalog, reload_catalog
+from user_index import get_users, invalidate_users
+from cf import RatingMatrix
+import user_stats
+import feature_store
+import reclustering
+from ingest import ingest_ratings
+import bulk
+import similar
+from registry import registry, ModelIntegrityError
+from result_cache import results
+import rec_store
+import seen
+import metrics
+import logs
+import responses
+import compression
+from responses import Paging, RANKED_DEPTH
+from tree_ensemble import compiling, tabulating
+from features import (
+    PAIR_FEATURES, future_rating_features, like_dislike_features, pair_features,
+    recommendation_features, token_genre_match, top_k
+)
+
+app = FastAPI(default_response_class=responses.FastJSONResponse)
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(metrics.TimingMiddleware)
+log = logs.get_logger("api")
+
+# Two binary inputs, so the genre KMeans model is evaluated once into a table
+registry.register("genre_cluster", "models/users_with_same_genres_preferences_cluster.pkl", tabulating(2))
+registry.start_watcher()
+log.info("API module loaded")
 
 class UserGenres(BaseModel):
     user_id: str
     preferred_genres: list[int]
 
 @app.post("/cluster")
-def test_genre_cluster(user: UserGenres):
+def test_genre_cluster(user: UserGenres, params: Paging = Depends(responses.paging)):
     g = user.preferred_genres
     if len(g) < 7:
         raise HTTPException(status_code=422, detail="preferred_genres must have at least 7 elements")
@@ -34,16 +62,9 @@ def test_genre_cluster(user: UserGenres):
             int(g[2]) | int(g[3]),
             int(g[2]) | int(g[4]),
         ]
-        cluster_label = int(genre_cluster_model.predict([merged_features])[0])
-
-        # Connect to MySQL
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="movies_mobile"
-        )
-        cursor = conn.cursor(dictionary=True)
+        genre_cluster = registry.entry("genre_cluster")
+        with metrics.stage("predict"):
+            cluster_label = int(genre_cluster.model.predict([merged_features])[0])
 
         # Fetch movies whose genres match the user's preferred genres
         # Here we just do a simple filter: movies containing any of the preferred genres
@@ -51,23 +72,33 @@ def test_genre_cluster(user: UserGenres):
         genre_names = ['Comedy','Drama','Action','Sci-Fi','Thriller','Romance','Adventure','Crime']
         selected_genres = [genre_names[i] for i in preferred_genre_indices]
 
-        genre_conditions = " OR ".join(["genres LIKE %s" for _ in selected_genres])
-        sql = f"SELECT * FROM movies WHERE {genre_conditions} ORDER BY rating DESC LIMIT 10"
-
-        cursor.execute(sql, [f"%{genre}%" for genre in selected_genres])
-        recommended_movies = cursor.fetchall()
-
-        cursor.close()
-        conn.close()
+        # Best by rating among movies in any of the genres, from the
+        # catalog's genre index
+        snap = get_catalog()
+        recommended_movies = snap.top_by_genres(selected_genres, RANKED_DEPTH)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    return {
+    # The cluster label is in the body, so the model that assigned it is part
+    # of the ranking id, as in _fingerprint()
+    ranking = hashlib.sha1(f"{snap.checksum}{selected_genres}{genre_cluster.checksum}".encode()).hexdigest()
+    return responses.page({
         "user_id": user.user_id,
         "cluster": cluster_label,
         "recommended_movies": recommended_movies
-    }
+    }, "recommended_movies", ranking, params, 10)
+
+# GET variants of the read-only POST recommenders, so the client's HTTP cache
+# can keep them and revalidate with If-None-Match
+@app.get("/cluster")
+def get_genre_cluster(user_id: str, preferred_genres: str, params: Paging = Depends(responses.paging)):
+    # preferred_genres as comma-separated 0/1 flags, e.g. 1,0,0,1,0,0,1,0
+    try:
+        genres = [int(v) for v in preferred_genres.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="preferred_genres must be comma-separated integers")
+    return test_genre_cluster(UserGenres(user_id=user_id, preferred_genres=genres), params)
 
 
 # sending data to mysql
@@ -95,66 +126,115 @@ class DataPayload(BaseModel):
     movies: List[Movie]
     users: List[User]
 
+def _move_synced_users(cursor, batch):
+    # Move the rating sums of users whose profile a sync batch changes to
+    # their new feature groups, as /add-user does; batch rows are in
+    # bulk.USER_COLUMNS order
+    new_rows = {str(row[0]): dict(zip(bulk.USER_COLUMNS, row)) for row in batch}
+    ids = list(new_rows)
+    cursor.execute(
+        f"SELECT userId, age, occupation, preferred_genres FROM users WHERE userId IN ({','.join(['%s'] * len(ids))}) FOR UPDATE",
+        ids
+    )
+    previous = {str(r[0]): dict(zip(("age", "occupation", "preferred_genres"), r[1:])) for r in cursor.fetchall()}
+    return [feature_store.move_user(cursor, user_id, previous.get(user_id), row) for user_id, row in new_rows.items()]
+
+def _sync_writers(batch_size):
+    user_stats.ensure_table()
+    feature_store.ensure_tables()
+    return bulk.movie_writer(batch_size), bulk.user_writer(batch_size, _move_synced_users)
+
+def _publish_sync(movies, users):
+    # Publish what the writers committed to the recommenders. Runs even when
+    # the sync fails part-way, since batches already flushed stay written.
+    if movies.count:
+        reload_catalog()
+    if users.count:
+        invalidate_users()
+        for moved in users.prepared:
+            for update in moved:
+                feature_store.add(update)
+    # The result cache is left alone: its keys hold the catalog checksum and
+    # each user's profile fields, so changed entries are simply not hit again
+
+def _sync_response(movies, users, batch_size):
+    return {
+        "status": "success",
+        "movies_inserted": movies.count,
+        "users_inserted": users.count,
+        "batch_size": batch_size,
+        "movies": movies.report(),
+        "users": users.report()
+    }
+
 # upload data to mysql
 @app.post("/upload-sqlite-data")
-def upload_sqlite_data(payload: DataPayload):
+def upload_sqlite_data(payload: DataPayload, batch_size: int = bulk.DEFAULT_BATCH_SIZE):
     try:
-        # Connect to MySQL
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="movies_mobile"
-        )
-        cursor = conn.cursor()
-
-        # Insert movies
-        for movie in payload.movies:
-            cursor.execute(
-                """INSERT INTO movies (id, title, genres, rating, year, description, posterUrl)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s)
-                   ON DUPLICATE KEY UPDATE title=VALUES(title)""",
-                (movie.id, movie.title, movie.genres, movie.rating, movie.year, movie.description, movie.posterUrl)
-            )
+        movies, users = _sync_writers(batch_size)
+        try:
+            bulk.write_all(movies, payload.movies)
+            bulk.write_all(users, payload.users)
+        finally:
+            _publish_sync(movies, users)
+        return _sync_response(movies, users, batch_size)
 
-        # Insert users
-        for user in payload.users:
-            cursor.execute(
-                """INSERT INTO users (userId, username, password, gender, age, occupation, zipCode, preferred_genres)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                   ON DUPLICATE KEY UPDATE
-                       username=VALUES(username),
-                       password=VALUES(password),
-                       gender=VALUES(gender),
-                       age=VALUES(age),
-                       occupation=VALUES(occupation),
-                       zipCode=VALUES(zipCode),
-                       preferred_genres=VALUES(preferred_genres)""",
-                (
-                    user.userId,
-                    user.username,
-                    user.password,
-                    user.gender if user.gender is not None else None,
-                    user.age if user.age is not None else None,
-                    user.occupation if user.occupation is not None else None,
-                    user.zipCode if user.zipCode is not None else None,
-                    user.preferred_genres if user.preferred_genres is not None else None
-                )
-            )
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return {
-            "status": "success",
-            "movies_inserted": len(payload.movies),
-            "users_inserted": len(payload.users)
-        }
 
+# Same sync for large payloads: accepts Content-Encoding: gzip, and either the
+# DataPayload JSON body or NDJSON (Content-Type: application/x-ndjson) with one
+# record per line tagged {"kind": "movie" | "user", ...fields}. NDJSON records
+# are validated and written batch by batch as they arrive.
+@app.post("/upload-sqlite-data/stream")
+async def upload_sqlite_data_stream(request: Request, batch_size: int = bulk.DEFAULT_BATCH_SIZE):
+    encoding = request.headers.get("content-encoding", "").lower()
+    content_type = request.headers.get("content-type", "")
+    movies, users = await db.run(_sync_writers, batch_size)
+    try:
+        try:
+            if "ndjson" not in content_type:
+                try:
+                    payload = DataPayload(**bulk.decode_body(await request.body(), encoding))
+                except ValidationError as e:
+                    raise HTTPException(status_code=422, detail=_validation_detail(e))
+                await db.run(bulk.write_all, movies, payload.movies)
+                await db.run(bulk.write_all, users, payload.users)
+            else:
+                # A rejected record ends the upload with a 422 naming its
+                # line; batches already flushed before it stay written and
+                # are published
+                async for line, record in bulk.iter_ndjson(request.stream(), encoding):
+                    kind = record.pop("kind", None) if isinstance(record, dict) else None
+                    try:
+                        if kind == "movie":
+                            writer, item = movies, Movie(**record)
+                        elif kind == "user":
+                            writer, item = users, User(**record)
+                        else:
+                            raise HTTPException(status_code=422, detail=f"Line {line}: unknown record kind: {kind}")
+                    except ValidationError as e:
+                        raise HTTPException(status_code=422, detail=f"Line {line}: invalid {kind} record: {_validation_detail(e)}")
+                    writer.add(item)
+                    if writer.full:
+                        await db.run(writer.flush)
+                await db.run(movies.flush)
+                await db.run(users.flush)
+        finally:
+            await db.run(_publish_sync, movies, users)
+        return _sync_response(movies, users, batch_size)
+
+    except HTTPException:
+        raise
+    except bulk.PayloadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _validation_detail(error):
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'record'}: {e['msg']}" for e in error.errors())
+
 
 # add user
 @app.post("/add-user")
@@ -163,40 +243,47 @@ def add_user(user: User):
     user_id = user.userId or str(int(time.time() * 1000))
     
     # Insert into MySQL
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="",
-        database="movies_mobile"
-    )
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO users (userId, username, password, gender, age, occupation, zipCode, preferred_genres)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            username=VALUES(username),
-            password=VALUES(password),
-            gender=VALUES(gender),
-            age=VALUES(age),
-            occupation=VALUES(occupation),
-            zipCode=VALUES(zipCode),
-            preferred_genres=VALUES(preferred_genres)
-        """,
-        (
-            user_id,
-            user.username,
-            user.password,
-            user.gender,
-            user.age,
-            user.occupation,
-            user.zipCode,
-            user.preferred_genres
+    user_stats.ensure_table()
+    feature_store.ensure_tables()
+    with db.transaction() as cursor:
+        # The existing profile, if any, to move its feature-store sums from
+        cursor.execute(
+            "SELECT age, occupation, preferred_genres FROM users WHERE userId = %s FOR UPDATE", (user_id,)
         )
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+        previous = cursor.fetchone()
+        cursor.execute(
+            """
+            INSERT INTO users (userId, username, password, gender, age, occupation, zipCode, preferred_genres)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                username=VALUES(username),
+                password=VALUES(password),
+                gender=VALUES(gender),
+                age=VALUES(age),
+                occupation=VALUES(occupation),
+                zipCode=VALUES(zipCode),
+                preferred_genres=VALUES(preferred_genres)
+            """,
+            (
+                user_id,
+                user.username,
+                user.password,
+                user.gender,
+                user.age,
+                user.occupation,
+                user.zipCode,
+                user.preferred_genres
+            )
+        )
+        moved = feature_store.move_user(
+            cursor, user_id,
+            dict(zip(("age", "occupation", "preferred_genres"), previous)) if previous else None,
+            {"age": user.age, "occupation": user.occupation, "preferred_genres": user.preferred_genres}
+        )
+    results.invalidate_user(str(user_id))
+    invalidate_users()
+    if moved:
+        feature_store.add(moved)
 
     return {"status": "success", "userId": user_id}
 
@@ -207,31 +294,39 @@ class UserGenresUpdate(BaseModel):
 @app.put("/update-user-genres")
 def update_user_genres(payload: UserGenresUpdate):
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="movies_mobile"
-        )
-        cursor = conn.cursor()
-
         # Convert list of integers to comma-separated string
         genres_str = ','.join(map(str, payload.preferred_genres))
-        print(f"🔹 Received payload: {payload.dict()}")
-        print(f"🔹 Converted preferred_genres to string: {genres_str}")
+        log.debug("update-user-genres %s -> %s", payload.username, genres_str)
 
         # Update by username
-        cursor.execute(
-            "UPDATE users SET preferred_genres = %s WHERE username = %s",
-            (genres_str, payload.username)
-        )
-        conn.commit()
-
-        if cursor.rowcount == 0:
+        user_stats.ensure_table()
+        feature_store.ensure_tables()
+        with db.transaction() as cursor:
+            cursor.execute(
+                "SELECT userId, age, occupation, preferred_genres FROM users WHERE username = %s FOR UPDATE",
+                (payload.username,)
+            )
+            previous = cursor.fetchone()
+            cursor.execute(
+                "UPDATE users SET preferred_genres = %s WHERE username = %s",
+                (genres_str, payload.username)
+            )
+            updated = cursor.rowcount
+            moved = None
+            if previous:
+                old = dict(zip(("userId", "age", "occupation", "preferred_genres"), previous))
+                # The user's ratings now count towards their new genre group
+                moved = feature_store.move_user(cursor, old["userId"], old, dict(old, preferred_genres=genres_str))
+
+        if updated == 0:
             raise HTTPException(status_code=404, detail=f"No user found with username {payload.username}")
 
-        cursor.close()
-        conn.close()
+        if moved:
+            feature_store.add(moved)
+        invalidate_users()
+        user_row = db.fetch_user(payload.username)
+        if user_row:
+            results.invalidate_user(str(user_row["userId"]))
 
         return {"status": "success", "username": payload.username}
 
@@ -241,231 +336,222 @@ def update_user_genres(payload: UserGenresUpdate):
 class UsernameData(BaseModel):
     username: str
 
+# Recommenders whose features read the feature_store aggregates
+RECOMMENDER_AGGREGATES = {"PredictFutureRating"}
+
+# Models each cached recommender depends on
+RECOMMENDER_MODELS = {
+    "send-username": ("genre_cluster",),
+    "PredictFutureRating": ("genre_cluster", "future_rating"),
+    "PredictFutureRatingLikeVsDislike": ("like_dislike",),
+    "UserRatingsCluster": ("user_kmeans",),
+    "recommendations": ("recommender", "cluster_sim"),
+}
+
+def _fingerprint(endpoint, user_row, *extra):
+    # Hash of everything a recommender response depends on that can change
+    # cheaply: the user's rating sums and profile, the catalog contents, the
+    # model files and, where the features read them, the feature_store
+    # aggregates. Stable across processes (up to each worker's copy of the
+    # aggregates), so the batch precompute (precompute.py) can store it next
+    # to each response.
+    parts = [
+        user_stats.rating_sums(user_row["userId"]),
+        [user_row.get(f) for f in ("preferred_genres", "age", "occupation", "gender")],
+        get_catalog().checksum,
+        [registry.entry(name).checksum for name in RECOMMENDER_MODELS[endpoint]],
+        feature_store.get_store().checksum() if endpoint in RECOMMENDER_AGGREGATES else None,
+        list(extra),
+    ]
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+def _rng(fingerprint):
+    # Random draws a ranking makes (variety, tie-breaking) are seeded from its
+    # fingerprint: every process and every recompute after an eviction ranks
+    # alike, so the cursors and ETags derived from it keep naming one list
+    return np.random.default_rng(int(fingerprint[:16], 16))
+
+def _cached(endpoint, user_row, fingerprint, compute):
+    # Serve a recommender response from the result cache, then from the
+    # precomputed store, and only score live when both miss
+    user_id = str(user_row["userId"])
+
+    def load():
+        stored = rec_store.lookup(user_id, endpoint, fingerprint)
+        return stored if stored is not None else compute()
+
+    return results.get_or_compute((endpoint, user_id, fingerprint), user_id, load)
+
+def _serve(endpoint, user_row, compute, params, default_limit, *extra):
+    # One page of the cached ranking; the fingerprint doubles as the ranking
+    # id the page cursors are checked against and the ETag is derived from,
+    # so a revalidation that matches skips the cache and the recommender.
+    # compute takes the ranking's random generator, see _rng().
+    fingerprint = _fingerprint(endpoint, user_row, *extra)
+    return responses.page(lambda: _cached(endpoint, user_row, fingerprint, lambda: compute(_rng(fingerprint))),
+                          "recommended_movies", fingerprint, params, default_limit)
+
 # Clustering Users with the same genre preferences
 @app.post("/send-username")
-async def receive_username(data: UsernameData):
-    print("📥 Received username:", data.username)
-
-    try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="movies_mobile"
-        )
-        cursor = conn.cursor(dictionary=True)
+async def receive_username(data: UsernameData, params: Paging = Depends(responses.paging)):
+    return await db.run(_receive_username, data, params)
 
-        print("🔍 Fetching user from database...")
+@app.get("/send-username")
+async def get_username_recommendations(username: str, params: Paging = Depends(responses.paging)):
+    return await db.run(_receive_username, UsernameData(username=username), params)
 
-        cursor.execute(
-            "SELECT userId, preferred_genres FROM users WHERE username = %s LIMIT 1",
-            (data.username,)
-        )
-        user = cursor.fetchone()
+def _receive_username(data, params):
+    log.debug("send-username %s", data.username)
 
-        print("📌 User DB result:", user)
+    try:
+        user = db.fetch_user(data.username)
 
         if not user:
-            print("❌ User not found")
+            log.debug("User %s not found", data.username)
             raise HTTPException(status_code=404, detail="User not found")
 
-        user_id = str(user["userId"])
-        
-        # Get user's rated movies to exclude them
-        cursor.execute(
-            "SELECT MovieID FROM ratings WHERE UserID = %s",
-            (user_id,)
-        )
-        rated_movie_ids = [str(row["MovieID"]) for row in cursor.fetchall()]
-        num_ratings = len(rated_movie_ids)
-        
-        print(f"🎬 User has rated {num_ratings} movies")
+        return _serve("send-username", user, lambda rng: _genre_recommendations(user, rng), params, 10)
 
-        g = list(map(int, user["preferred_genres"].split(",")))
-        print("🎛 Preferred genres vector:", g)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.warning("send-username %s failed: %s", data.username, e)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        merged_features = [
-            g[2] | g[3],
-            g[2] | g[4],
-        ]
+def _genre_recommendations(user, rng):
+    user_id = str(user["userId"])
 
-        print("🧠 Cluster input features:", merged_features)
+    # Movies the user already rated, to exclude them
+    seen_items = seen.get(user_id)
+    num_ratings = len(seen_items)
 
-        cluster_label = int(genre_cluster_model.predict([merged_features])[0])
+    g = list(map(int, user["preferred_genres"].split(",")))
 
-        print("🏷 Assigned cluster:", cluster_label)
+    merged_features = [
+        g[2] | g[3],
+        g[2] | g[4],
+    ]
 
-        preferred_genre_indices = [i for i, val in enumerate(g) if val == 1]
-        genre_names = ['Comedy','Drama','Action','Sci-Fi','Thriller','Romance','Adventure','Crime']
-        selected_genres = [genre_names[i] for i in preferred_genre_indices]
+    with metrics.stage("predict"):
+        cluster_label = int(registry.get("genre_cluster").predict([merged_features])[0])
 
-        print("🎬 Selected genres for filtering:", selected_genres)
+    preferred_genre_indices = [i for i, val in enumerate(g) if val == 1]
+    genre_names = ['Comedy','Drama','Action','Sci-Fi','Thriller','Romance','Adventure','Crime']
+    selected_genres = [genre_names[i] for i in preferred_genre_indices]
 
-        genre_conditions = " OR ".join(["genres LIKE %s" for _ in selected_genres])
-        
-        # Exclude already rated movies
-        if rated_movie_ids:
-            placeholders = ",".join(["%s"] * len(rated_movie_ids))
-            sql = f"SELECT * FROM movies WHERE ({genre_conditions}) AND id NOT IN ({placeholders}) ORDER BY rating DESC LIMIT 20"
-            params = [f"%{genre}%" for genre in selected_genres] + rated_movie_ids
-        else:
-            sql = f"SELECT * FROM movies WHERE {genre_conditions} ORDER BY rating DESC LIMIT 20"
-            params = [f"%{genre}%" for genre in selected_genres]
-
-        print("🔎 SQL Query:", sql)
-
-        cursor.execute(sql, params)
-        all_movies = cursor.fetchall()
-        
-        # Add variety: use rating count as seed for randomization
-        seed = hash(user_id + str(num_ratings)) % (2**32)
-        random.seed(seed)
-        
-        # Randomize and take top 10
-        if len(all_movies) > 10:
-            random.shuffle(all_movies)
-            recommended_movies = all_movies[:10]
-        else:
-            recommended_movies = all_movies
+    log.debug("User %s: %d rated, genres %s, cluster features %s -> cluster %d, filtering on %s",
+              user_id, num_ratings, g, merged_features, cluster_label, selected_genres)
 
-        print(f"🎥 Recommended {len(recommended_movies)} movies")
+    # Best by rating in any of the genres, excluding already rated movies
+    all_movies = get_catalog().top_by_genres(selected_genres, max(20, RANKED_DEPTH), exclude=seen_items)
 
-        cursor.close()
-        conn.close()
+    # Add variety: randomize the top 20, so the first page is 10 of them;
+    # later pages continue in rating order. rng is seeded from the
+    # fingerprint, which changes with the rating count.
+    top, rest = all_movies[:20], all_movies[20:]
+    if len(top) > 10:
+        top = [top[i] for i in rng.permutation(len(top)).tolist()]
+    recommended_movies = top + rest
 
-        return {
-            "user_id": user["userId"],
-            "cluster": cluster_label,
-            "recommended_movies": recommended_movies
-        }
+    log.debug("Recommended %d movies", len(recommended_movies))
 
-    except Exception as e:
-        print("🔥 ERROR:", e)
-        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "user_id": user["userId"],
+        "cluster": cluster_label,
+        "recommended_movies": recommended_movies
+    }
 
-xgb_model = joblib.load("models/xgb_predicting_future_movie_ratings_model.pkl")  # adjust path
+registry.register("future_rating", "models/xgb_predicting_future_movie_ratings_model.pkl", compiling())
 
 class UserMovieRequest(BaseModel):
     user_id: str
     movie_id: str
 
+MAX_FEATURE_PAIRS = 10000
+
+class UserMoviePairs(BaseModel):
+    pairs: List[UserMovieRequest] = Field(..., max_length=MAX_FEATURE_PAIRS)
+
+def _pair_features(pairs):
+    # Feature rows and predicted ratings for (user_id, movie_id) pairs, found
+    # through the catalog and user_index id maps; rows are None for pairs with
+    # an unknown user or movie
+    snap = get_catalog()
+    users = get_users()
+    store = feature_store.get_store()
+    movie_rows = snap.rows_of([p.movie_id for p in pairs])
+    user_rows = users.rows_of([p.user_id for p in pairs])
+    known = np.flatnonzero((movie_rows >= 0) & (user_rows >= 0))
+
+    with metrics.stage("features"):
+        X = pair_features(snap, users, store, movie_rows[known], user_rows[known])
+    predicted = np.empty(0)
+    if len(known):
+        with metrics.stage("predict"):
+            predicted = registry.get("future_rating").predict(X)
+
+    out = [None] * len(pairs)
+    for i, row, rating in zip(known.tolist(), X.tolist(), predicted.tolist()):
+        f = dict(zip(PAIR_FEATURES, row), predicted_rating=rating)
+        f["movie_popularity"], f["Occupation"] = int(f["movie_popularity"]), int(f["Occupation"])
+        out[i] = f
+    return out, user_rows, movie_rows
+
 @app.post("/compute_features")
 def compute_features(req: UserMovieRequest):
     try:
-        # Connect to MySQL
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="movies_mobile"
-        )
-        cursor = conn.cursor(dictionary=True)
-
-        # Fetch all users
-        cursor.execute("SELECT * FROM users")
-        users = pd.DataFrame(cursor.fetchall())
-
-        # Fetch all movies
-        cursor.execute("SELECT * FROM movies")
-        movies = pd.DataFrame(cursor.fetchall())
-
-        # Check if user/movie exist
-        if req.user_id not in users['userId'].values:
+        [features], user_rows, movie_rows = _pair_features([req])
+        if user_rows[0] < 0:
             raise HTTPException(status_code=404, detail="User not found")
-        if req.movie_id not in movies['id'].values:
+        if movie_rows[0] < 0:
             raise HTTPException(status_code=404, detail="Movie not found")
 
-        # User info
-        user = users[users['userId'] == req.user_id].iloc[0]
-
-        # For features needing user ratings, we only have movie ratings (global)
-        user_avg_rating = movies['rating'].mean()
-        user_std_rating = movies['rating'].std()
-
-        # Movie info
-        movie = movies[movies['id'] == req.movie_id].iloc[0]
-        movie_std_rating = movies['rating'].std()
-        movie_avg_viewer_age = users['age'].dropna().mean()  # average age across users
-        movie_popularity = len(movies)
-
-        # Occupation (convert to int if null)
-        user_occupation = int(user['occupation']) if user['occupation'] is not None else 0
-
-        # Average rating by occupation
-        avg_rating_by_occupation = movies['rating'].mean()  # placeholder
-
-        # Average rating by age
-        avg_rating_by_age = movies['rating'].mean()  # placeholder
-
-        # User-movie diff
-        user_movie_avg_diff = user_avg_rating - movie['rating']
-
-        # Cluster-based average rating (simplified)
-        avg_rating_by_cluster = movies['rating'].mean()
-
-        # Prepare feature vector for prediction
-        feature_vector = [
-            avg_rating_by_occupation,
-            user_avg_rating,
-            user_std_rating,
-            avg_rating_by_age,
-            user_movie_avg_diff,
-            movie_std_rating,
-            movie_avg_viewer_age,
-            movie_popularity,
-            user_occupation,
-            avg_rating_by_cluster
-        ]
-
-        # Predict the rating using the model
-        predicted_rating = float(xgb_model.predict([feature_vector])[0])
-
-        features = {
-            "avg_rating_by_occupation": avg_rating_by_occupation,
-            "user_avg_rating": user_avg_rating,
-            "user_std_rating": user_std_rating,
-            "avg_rating_by_age": avg_rating_by_age,
-            "user_movie_avg_diff": user_movie_avg_diff,
-            "movie_std_rating": movie_std_rating,
-            "movie_avg_viewer_age": movie_avg_viewer_age,
-            "movie_popularity": movie_popularity,
-            "Occupation": user_occupation,
-            "avg_rating_by_cluster": avg_rating_by_cluster,
-            "predicted_rating": predicted_rating
-        }
-
-        cursor.close()
-        conn.close()
-
-        print(f"🔹 Features & prediction for user {req.user_id} and movie {req.movie_id}: {features}")
+        log.debug("Features & prediction for user %s and movie %s: %s", req.user_id, req.movie_id, features)
         return {"user_id": req.user_id, "movie_id": req.movie_id, "features": features}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/compute_features/batch")
+def compute_features_batch(req: UserMoviePairs):
+    # Many pairs scored with one predict call; an unknown user or movie fails
+    # only its own pair, with features null and the reason in "detail"
+    try:
+        features, user_rows, movie_rows = _pair_features(req.pairs)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    out = []
+    for pair, f, user_row, movie_row in zip(req.pairs, features, user_rows.tolist(), movie_rows.tolist()):
+        item = {"user_id": pair.user_id, "movie_id": pair.movie_id, "features": f}
+        if user_row < 0:
+            item["detail"] = "User not found"
+        elif movie_row < 0:
+            item["detail"] = "Movie not found"
+        out.append(item)
+    # Returned as a response so FastAPI skips its jsonable_encoder pass
+    return responses.FastJSONResponse({"results": out})
+
 
 class PredictRequest(BaseModel):
     username: str
 
 # XGB Predict Future Rating
 @app.post("/PredictFutureRating")
-def predict_future_rating(req: PredictRequest):
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="",
-        database="movies_mobile"
-    )
-    cursor = conn.cursor(dictionary=True)
-
-    cursor.execute(
-        "SELECT userId, preferred_genres, age, occupation FROM users WHERE username = %s",
-        (req.username,)
-    )
-    user_row = cursor.fetchone()
+def predict_future_rating(req: PredictRequest, params: Paging = Depends(responses.paging)):
+    user_row = db.fetch_user(req.username)
     if not user_row:
         raise HTTPException(status_code=404, detail="User not found")
 
+    return _serve("PredictFutureRating", user_row, lambda rng: _predict_future_rating(req.username, user_row), params, 10)
+
+@app.get("/PredictFutureRating")
+def get_future_rating(username: str, params: Paging = Depends(responses.paging)):
+    return predict_future_rating(PredictRequest(username=username), params)
+
+def _predict_future_rating(username, user_row):
     user_id = user_row["userId"]
     user_age = user_row["age"]
     user_occupation = int(user_row["occupation"]) if user_row["occupation"] else 0
@@ -475,519 +561,448 @@ def predict_future_rating(req: PredictRequest):
         user_genres[2] | user_genres[3],
         user_genres[2] | user_genres[4],
     ]
-    cluster_label = int(genre_cluster_model.predict([merged_features])[0])
+    with metrics.stage("predict"):
+        cluster_label = int(registry.get("genre_cluster").predict([merged_features])[0])
 
-    cursor.execute("SELECT * FROM movies")
-    movies = pd.DataFrame(cursor.fetchall())
+    snap = get_catalog()
 
-    cursor.execute(
-        "SELECT AVG(Rating) AS avg_r, STD(Rating) AS std_r FROM ratings WHERE UserID = %s",
-        (user_id,)
-    )
-    stats = cursor.fetchone()
-    user_avg_rating = stats["avg_r"] if stats["avg_r"] else movies["rating"].mean()
-    user_std_rating = stats["std_r"] if stats["std_r"] else movies["rating"].std()
-
-    avg_rating_by_occupation = user_avg_rating
-
-    features_list = []
-    for _, movie in movies.iterrows():
-        movie_std_rating = movies["rating"].std()
-        movie_avg_viewer_age = user_age
-        movie_popularity = len(movies)
-
-        genre_match = sum(
-            user_genres[i]
-            for i, _ in enumerate(movie["genres"].split(","))
-            if i < len(user_genres)
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT AVG(Rating) AS avg_r, STD(Rating) AS std_r FROM ratings WHERE UserID = %s",
+            (user_id,)
         )
-
-        user_movie_avg_diff = user_avg_rating - movie["rating"]
-
-        features_list.append([
-            avg_rating_by_occupation,
-            user_avg_rating,
-            user_std_rating,
-            movie_avg_viewer_age,
-            user_movie_avg_diff,
-            movie_std_rating,
-            movie_popularity,
-            user_occupation,
-            cluster_label,
-            genre_match
-        ])
-
-    X = np.array(features_list)
-    movies["predicted_rating"] = xgb_model.predict(X)
-
-    top_movies = movies.sort_values(
-        by="predicted_rating", ascending=False
-    ).head(10)
-
-    cursor.close()
-    conn.close()
+        stats = cursor.fetchone()
+    user_avg_rating = stats["avg_r"] if stats["avg_r"] else snap.rating_mean
+    user_std_rating = stats["std_r"] if stats["std_r"] else snap.rating_std
+
+    with metrics.stage("features"):
+        X = future_rating_features(
+            snap, feature_store.get_store(), user_avg_rating, user_std_rating, user_age,
+            user_occupation, cluster_label, user_genres
+        )
+    with metrics.stage("predict"):
+        predicted = registry.get("future_rating").predict(X)
+
+    # Catalog rows as loaded, plus the prediction; no DataFrame round trip
+    top_idx = top_k(predicted, RANKED_DEPTH)
+    recommended_movies = [
+        dict(snap.record(i), predicted_rating=rating)
+        for i, rating in zip(top_idx.tolist(), predicted[top_idx].tolist())
+    ]
 
     return {
         "user_id": user_id,
-        "username": req.username,
+        "username": username,
         "cluster": cluster_label,
-        "recommended_movies": top_movies.to_dict(orient="records")
+        "recommended_movies": recommended_movies
     }
 
 
 
-xgb_classifier = load("models/xgb_classifier_predicting_like_vs_dislike_model.pkl")
+registry.register("like_dislike", "models/xgb_classifier_predicting_like_vs_dislike_model.pkl", compiling())
+
+def _column(frame, name, default=""):
+    if name not in frame:
+        return [default] * len(frame)
+    return [default if pd.isna(v) else v for v in frame[name].tolist()]
 
 class UsernameData(BaseModel):
     username: str
 
 # XGB Predict Future Rating Like vs Dislike
 @app.post("/PredictFutureRatingLikeVsDislike")
-def predict_like_dislike(req: PredictRequest):
+def predict_like_dislike(req: PredictRequest, params: Paging = Depends(responses.paging)):
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="movies_mobile"
-        )
-        cursor = conn.cursor(dictionary=True)
-
         # Get user
-        cursor.execute(
-            "SELECT userId, age, occupation, preferred_genres FROM users WHERE username=%s",
-            (req.username,)
-        )
-        user_row = cursor.fetchone()
+        user_row = db.fetch_user(req.username)
         if not user_row:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user_id = str(user_row["userId"])
-        user_age = int(user_row["age"] or 25)
-        user_occupation = int(user_row["occupation"] or 0)
-        preferred_genres = list(map(int, (user_row.get("preferred_genres") or "0,0,0,0,0,0,0,0").split(",")))
-
-        # Load movies
-        cursor.execute("SELECT * FROM movies")
-        movies = pd.DataFrame(cursor.fetchall())
-        if movies.empty:
-            return {"user_id": user_id, "recommended_movies": []}
-
-        # Ensure numeric fields
-        movies.fillna(0, inplace=True)
-
-        
-        # Compute features per movie
-        features_list = []
-        for _, movie in movies.iterrows():
-            movie_genres = list(map(int, (movie.get("genres_vector") or "0,0,0,0,0,0,0,0").split(",")))
-            genre_overlap = sum([u & m for u, m in zip(preferred_genres, movie_genres)])
-
-            movie_year = int(movie.get("year") or 2000)
-            movie_popularity = int(movie.get("popularity") or 1)  # fallback if you have popularity field
-
-            # Features that vary per user and per movie
-            features = [
-                float(genre_overlap),                  # genre match
-                float(user_age - movie_year),          # age-year diff
-                float(user_occupation % 10),           # occupation encoded
-                float(movie_popularity),               # popularity
-                float(len([g for g in movie_genres if g == 1])),  # number of genres
-                float(genre_overlap * movie_popularity),          # interaction feature
-                float(movie_year),                     # movie year
-                float(user_age),                        # user age
-                float(sum(preferred_genres)),           # total preferred genres
-                float(genre_overlap + user_occupation) # combined feature
-            ]
-            features_list.append(features)
-
-        X = np.array(features_list, dtype=float)
-        predicted_labels = xgb_classifier.predict(X)
-        movies['predicted_label'] = np.where(np.isnan(predicted_labels), 0, predicted_labels).astype(int)
-
-        liked_movies = movies[movies['predicted_label'] == 1]
-        top_movies = liked_movies.head(10)
-
-        recommended_movies = []
-        for _, row in top_movies.iterrows():
-            recommended_movies.append({
-                "id": str(row.get("id", "")),
-                "title": row.get("title", ""),
-                "genres": row.get("genres", ""),
-                "year": str(row.get("year", "")),
-                "posterUrl": row.get("posterUrl", ""),
-                "predicted_label": int(row.get("predicted_label", 0))
-            })
-
-        # Fallback: if no liked movies, return top 10 by any criteria
-        if not recommended_movies:
-            top_movies_fallback = movies.sample(10)  # random 10
-            recommended_movies = []
-            for _, row in top_movies_fallback.iterrows():
-                recommended_movies.append({
-                    "id": str(row.get("id", "")),
-                    "title": row.get("title", ""),
-                    "genres": row.get("genres", ""),
-                    "year": str(row.get("year", "")),
-                    "posterUrl": row.get("posterUrl", ""),
-                    "predicted_label": int(row.get("predicted_label", 0))
-                })
-
-        cursor.close()
-        conn.close()
-
-        return {"user_id": user_id, "recommended_movies": recommended_movies}
+        return _serve("PredictFutureRatingLikeVsDislike", user_row, lambda rng: _predict_like_dislike(user_row, rng), params, 10)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/PredictFutureRatingLikeVsDislike")
+def get_like_dislike(username: str, params: Paging = Depends(responses.paging)):
+    return predict_like_dislike(PredictRequest(username=username), params)
+
+def _predict_like_dislike(user_row, rng):
+    user_id = str(user_row["userId"])
+    user_age = int(user_row["age"] or 25)
+    user_occupation = int(user_row["occupation"] or 0)
+    preferred_genres = list(map(int, (user_row.get("preferred_genres") or "0,0,0,0,0,0,0,0").split(",")))
+
+    # Load movies
+    snap = get_catalog()
+    if snap.size == 0:
+        return {"user_id": user_id, "recommended_movies": []}
+
+    # Compute features for every movie at once
+    with metrics.stage("features"):
+        X = like_dislike_features(snap, preferred_genres, user_age, user_occupation)
+    with metrics.stage("predict"):
+        predicted_labels = registry.get("like_dislike").predict(X)
+    predicted_labels = np.where(np.isnan(predicted_labels), 0, predicted_labels).astype(int)
+
+    # Liked movies in catalog order
+    top_idx = np.flatnonzero(predicted_labels == 1)[:RANKED_DEPTH]
+
+    # Fallback: if no liked movies, return top 10 by any criteria
+    if top_idx.size == 0:
+        top_idx = rng.choice(snap.size, min(10, snap.size), replace=False)  # random 10
+
+    top_movies = snap.take(top_idx)
+    recommended_movies = [{
+        "id": str(movie_id),
+        "title": title,
+        "genres": genres,
+        "year": str(year),
+        "posterUrl": poster_url,
+        "predicted_label": int(label)
+    } for movie_id, title, genres, year, poster_url, label in zip(
+        _column(top_movies, "id"),
+        _column(top_movies, "title"),
+        _column(top_movies, "genres"),
+        _column(top_movies, "year", 0),
+        _column(top_movies, "posterUrl"),
+        predicted_labels[top_idx].tolist()
+    )]
+
+    return {"user_id": user_id, "recommended_movies": recommended_movies}
+
 
 
 @app.post("/upload_ratings")
-async def upload_ratings(file: UploadFile = File(...)):
+def upload_ratings(file: UploadFile = File(...)):
     if not file.filename.endswith(".dat"):
         raise HTTPException(status_code=400, detail="Only .dat files allowed")
 
-    content = await file.read()
-    df = pd.read_csv(io.StringIO(content.decode()), sep="|", engine='python',
-                     names=["UserID", "MovieID", "Rating", "Timestamp"])
-
-    # Replace NaN with None for MySQL
-    df = df.where(pd.notnull(df), None)
-
-    conn = mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="",
-        database="movies_mobile"
-    )
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ratings (
-            UserID INT NOT NULL,
-            MovieID INT NOT NULL,
-            Rating FLOAT,
-            Timestamp BIGINT,
-            PRIMARY KEY (UserID, MovieID)
-        )
-    """)
-
-    insert_query = """
-        INSERT INTO ratings (UserID, MovieID, Rating, Timestamp)
-        VALUES (%s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE Rating=VALUES(Rating), Timestamp=VALUES(Timestamp)
-    """
-
-    for row in df.itertuples(index=False):
-        rating = row.Rating if pd.notna(row.Rating) else None
-        timestamp = row.Timestamp if pd.notna(row.Timestamp) else None
-        cursor.execute(insert_query, (row.UserID, row.MovieID, rating, timestamp))
+    # Parsed and upserted chunk by chunk straight from the spooled upload
+    report = ingest_ratings(file.file)
+    if report["rows"]:
+        results.clear()
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    return {"message": f"Inserted {report['rows']} ratings successfully", **report}
 
-    return {"message": f"Inserted {len(df)} ratings successfully"}
 
 
+registry.register("user_kmeans", "models/kmeans_model_cluster_users_based_on_their_training.pkl")
+# Refits the user KMeans as ratings arrive, when RECLUSTER_INTERVAL > 0
+reclustering.start_worker()
 
-kmeans_model = joblib.load("models/kmeans_model_cluster_users_based_on_their_training.pkl")
+def _user_kmeans():
+    return reclustering.current_model()
 
 class PredictRequest(BaseModel):
     username: str
 
 # KMeans User Ratings Cluster
 @app.post("/UserRatingsCluster")
-def recommend_movies(req: PredictRequest):
+def recommend_movies(req: PredictRequest, params: Paging = Depends(responses.paging)):
     try:
         username = req.username
         if not username:
             raise HTTPException(status_code=400, detail="Username required")
 
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="movies_mobile"
-        )
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("SELECT userId FROM users WHERE username=%s", (username,))
-        user_row = cursor.fetchone()
+        user_row = db.fetch_user(username)
         if not user_row:
             raise HTTPException(status_code=404, detail="User not found")
-        user_id = str(user_row["userId"])  # Keep as string!
-
-        cursor.execute("SELECT UserID, MovieID, Rating FROM ratings")
-        ratings_df = pd.DataFrame(cursor.fetchall())
-        
-        # Also get ratings specifically for this user (using their actual userId)
-        cursor.execute("SELECT UserID, MovieID, Rating FROM ratings WHERE UserID = %s", (user_id,))
-        user_specific_ratings = cursor.fetchall()
-        
-        if ratings_df.empty:
-            # No ratings in system at all - return popular movies
-            cursor.execute("SELECT * FROM movies ORDER BY RAND() LIMIT 10")
-            movies = cursor.fetchall()
-            recommended_movies = [{
-                "id": int(row.get("id", 0)),
-                "title": row.get("title", ""),
-                "genres": row.get("genres", ""),
-                "cluster": 0,
-                "score": 0.0
-            } for row in movies]
-            cursor.close()
-            conn.close()
-            return {"user_id": user_id, "recommended_movies": recommended_movies}
-
-        ratings_df = ratings_df.dropna(subset=["UserID", "MovieID", "Rating"])
-        # Convert UserID to string to match our user_id type
-        ratings_df["UserID"] = ratings_df["UserID"].astype(str)
-        ratings_df["MovieID"] = ratings_df["MovieID"].astype(int)
-        ratings_df["Rating"] = ratings_df["Rating"].astype(float)
-
-        # Get user's ratings
-        print(f"DEBUG: Looking for user_id={user_id}, type={type(user_id)}")
-        print(f"DEBUG: User-specific ratings from DB: {len(user_specific_ratings)}")
-        print(f"DEBUG: Available UserIDs in ratings: {ratings_df['UserID'].unique()[:10]}")
-        print(f"DEBUG: Total ratings in DB: {len(ratings_df)}")
-        user_ratings = ratings_df[ratings_df["UserID"] == user_id].set_index("MovieID")["Rating"]
-        print(f"DEBUG: Found {len(user_ratings)} ratings for user {user_id}")
-
-        # Calculate user statistics for clustering (only for users who have ratings)
-        all_user_stats = ratings_df.groupby("UserID")["Rating"].agg(
-            rating_count=lambda x: (x>0).sum(),
-            rating_mean="mean",
-            rating_std="std",
-            high_rating_ratio=lambda x: (x>=4).sum() / (x>0).sum() if (x>0).sum()>0 else 0
-        ).fillna(0)
-
-        # Predict clusters for all users WHO HAVE RATINGS
-        all_user_clusters = kmeans_model.predict(all_user_stats.values)
-        all_user_stats['cluster'] = all_user_clusters
-        
-        # Determine user's cluster
-        if user_id in all_user_stats.index:
-            user_cluster = all_user_stats.loc[user_id]['cluster']
-        else:
-            # New user with no ratings - predict which cluster they'd belong to
-            # Use overall average stats as placeholder
-            avg_stats = all_user_stats.iloc[:, :-1].mean().values.reshape(1, -1)
-            user_cluster = int(kmeans_model.predict(avg_stats)[0])
-
-        # Get ALL users in the same cluster (not just those with ratings)
-        cluster_users = all_user_stats[all_user_stats['cluster'] == user_cluster].index
-        cluster_ratings = ratings_df[ratings_df["UserID"].isin(cluster_users)]
-
-        # DEBUG: Print diagnostics
-        print(f"\n=== DEBUG INFO FOR USER {user_id} ===")
-        print(f"User cluster: {user_cluster}")
-        print(f"Users in cluster: {len(cluster_users)}")
-        print(f"User has rated {len(user_ratings)} movies")
-        
-        # Handle different scenarios
-        if len(cluster_ratings) == 0:
-            # No cluster data - return most popular movies overall
-            print("No cluster data, returning popular movies")
-            overall_popular = ratings_df.groupby("MovieID").agg({
-                "Rating": ["mean", "count"]
-            }).reset_index()
-            overall_popular.columns = ["MovieID", "avg_rating", "rating_count"]
-            overall_popular = overall_popular[overall_popular["rating_count"] >= 5]
-            overall_popular["score"] = overall_popular["avg_rating"] * np.log1p(overall_popular["rating_count"])
-            personalized_scores = dict(zip(overall_popular["MovieID"], overall_popular["score"]))
-        elif user_ratings.empty or len(user_ratings) < 3:
-            # New user or user with few ratings: use cluster averages with popularity boost
-            print("Using cluster averages with popularity boost")
+        return _serve("UserRatingsCluster", user_row, lambda rng: _cluster_recommendations(user_row, rng), params, 10)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/UserRatingsCluster")
+def get_user_ratings_cluster(username: str, params: Paging = Depends(responses.paging)):
+    return recommend_movies(PredictRequest(username=username), params)
+
+def _cluster_recommendations(user_row, rng):
+    user_id = str(user_row["userId"])  # Keep as string!
+
+    kmeans_model = _user_kmeans()
+    # Label any users whose rating stats changed since the last request
+    with metrics.stage("predict"):
+        user_stats.refresh_clusters(kmeans_model)
+    avg_stats = user_stats.average_features()
+
+    # Also get ratings specifically for this user (using their actual userId)
+    user_specific_ratings = [r for r in db.fetch_user_ratings(user_id) if r["Rating"] is not None]
+    seen_items = seen.get(user_id)
+
+    if avg_stats is None:
+        # No ratings in system at all - return popular movies
+        movies = get_catalog().records()
+        movies = [movies[i] for i in rng.choice(len(movies), min(10, len(movies)), replace=False).tolist()]
+        recommended_movies = [{
+            "id": int(row.get("id", 0)),
+            "title": row.get("title", ""),
+            "genres": row.get("genres", ""),
+            "cluster": 0,
+            "score": 0.0
+        } for row in movies]
+        return {"user_id": user_id, "recommended_movies": recommended_movies}
+
+    # Get user's ratings
+    user_ratings = pd.Series(
+        [float(r["Rating"]) for r in user_specific_ratings],
+        index=[int(r["MovieID"]) for r in user_specific_ratings],
+        dtype=float
+    )
+
+    # Determine user's cluster from the stored per-user stats
+    stats_row = user_stats.get_user_stats(user_id)
+    if stats_row is not None and stats_row["cluster"] is not None:
+        user_cluster = int(stats_row["cluster"])
+    elif stats_row is not None:
+        # Rated since the clusters were refreshed
+        user_cluster = int(kmeans_model.predict(user_stats.features_of(stats_row))[0])
+    else:
+        # New user with no ratings - predict which cluster they'd belong to
+        # Use overall average stats as placeholder
+        user_cluster = int(kmeans_model.predict(avg_stats)[0])
+
+    # Get ALL users in the same cluster (not just those with ratings)
+    cluster_users = user_stats.cluster_members(user_cluster)
+    rows = user_stats.cluster_ratings(user_cluster)
+    with metrics.stage("frame"):
+        cluster_ratings = pd.DataFrame(rows)
+        if not cluster_ratings.empty:
+            # Convert UserID to string to match our user_id type
+            cluster_ratings["UserID"] = cluster_ratings["UserID"].astype(str)
+            cluster_ratings["MovieID"] = cluster_ratings["MovieID"].astype(int)
+            cluster_ratings["Rating"] = cluster_ratings["Rating"].astype(float)
+
+    log.debug("User %s: cluster %d with %d users, %d ratings",
+              user_id, user_cluster, len(cluster_users), len(user_ratings))
+
+    # Handle different scenarios
+    if len(cluster_ratings) == 0:
+        # No cluster data - return most popular movies overall
+        log.debug("No cluster data, returning popular movies")
+        with db.cursor() as cursor:
+            cursor.execute("""
+                SELECT MovieID, AVG(Rating) AS avg_rating, COUNT(Rating) AS rating_count
+                FROM ratings WHERE Rating IS NOT NULL
+                GROUP BY MovieID HAVING COUNT(Rating) >= 5
+            """)
+            overall_popular = pd.DataFrame(cursor.fetchall(), columns=["MovieID", "avg_rating", "rating_count"])
+        overall_popular["avg_rating"] = overall_popular["avg_rating"].astype(float)
+        overall_popular["score"] = overall_popular["avg_rating"] * np.log1p(overall_popular["rating_count"])
+        personalized_scores = dict(zip(overall_popular["MovieID"], overall_popular["score"]))
+    elif user_ratings.empty or len(user_ratings) < 3:
+        # New user or user with few ratings: use cluster averages with popularity boost
+        log.debug("Using cluster averages with popularity boost")
+        cluster_movie_stats = cluster_ratings.groupby("MovieID").agg({
+            "Rating": ["mean", "count"]
+        }).reset_index()
+        cluster_movie_stats.columns = ["MovieID", "avg_rating", "rating_count"]
+        # Boost popular movies in cluster
+        cluster_movie_stats["score"] = cluster_movie_stats["avg_rating"] * np.log1p(cluster_movie_stats["rating_count"])
+        personalized_scores = dict(zip(cluster_movie_stats["MovieID"], cluster_movie_stats["score"]))
+    else:
+        # Existing user with enough ratings: Use collaborative filtering
+        # Pearson similarity with every cluster member in one pass over
+        # the sparse cluster rating matrix (>= 2 co-rated movies)
+        with metrics.stage("features"):
+            matrix = RatingMatrix.from_frame(cluster_ratings)
+        with metrics.stage("predict"):
+            sim_users, sim_scores = matrix.similarities(user_id)
+        user_similarities = dict(zip(sim_users.tolist(), sim_scores.tolist()))
+
+        log.debug("Collaborative filtering: %d similar users with correlation > 0", len(user_similarities))
+
+        if len(user_similarities) == 0:
+            # No similar users found, use cluster average with popularity
             cluster_movie_stats = cluster_ratings.groupby("MovieID").agg({
                 "Rating": ["mean", "count"]
             }).reset_index()
             cluster_movie_stats.columns = ["MovieID", "avg_rating", "rating_count"]
-            # Boost popular movies in cluster
             cluster_movie_stats["score"] = cluster_movie_stats["avg_rating"] * np.log1p(cluster_movie_stats["rating_count"])
             personalized_scores = dict(zip(cluster_movie_stats["MovieID"], cluster_movie_stats["score"]))
+            log.debug("No similar users found, using cluster averages with popularity")
         else:
-            # Existing user with enough ratings: Use collaborative filtering
-            print("Using collaborative filtering")
-            user_movies = set(user_ratings.index)
-            
-            # Calculate similarity with each user based on commonly rated movies
-            user_similarities = {}
-            for other_user in cluster_users:
-                if other_user == user_id:
-                    continue
-                
-                other_ratings = ratings_df[ratings_df["UserID"] == other_user].set_index("MovieID")["Rating"]
-                
-                # Find common movies
-                common_movies = user_movies.intersection(set(other_ratings.index))
-                
-                if len(common_movies) >= 2:  # Need at least 2 common ratings
-                    # Get ratings for common movies
-                    user_common = user_ratings.loc[list(common_movies)]
-                    other_common = other_ratings.loc[list(common_movies)]
-                    
-                    # Skip if either user has zero variance (all ratings are the same)
-                    if user_common.std() == 0 or other_common.std() == 0:
-                        continue
-                    
-                    # Calculate Pearson correlation
-                    correlation = user_common.corr(other_common)
-                    
-                    if not np.isnan(correlation) and correlation > 0:
-                        user_similarities[other_user] = correlation
-            
-            print(f"Found {len(user_similarities)} similar users with correlation > 0")
-            
-            if len(user_similarities) == 0:
-                # No similar users found, use cluster average with popularity
-                cluster_movie_stats = cluster_ratings.groupby("MovieID").agg({
-                    "Rating": ["mean", "count"]
-                }).reset_index()
-                cluster_movie_stats.columns = ["MovieID", "avg_rating", "rating_count"]
-                cluster_movie_stats["score"] = cluster_movie_stats["avg_rating"] * np.log1p(cluster_movie_stats["rating_count"])
-                personalized_scores = dict(zip(cluster_movie_stats["MovieID"], cluster_movie_stats["score"]))
-                print("No similar users found, using cluster averages with popularity")
-            else:
-                # Get top 10 most similar users
-                top_similar = sorted(user_similarities.items(), key=lambda x: x[1], reverse=True)[:10]
-                similar_user_ids = [uid for uid, _ in top_similar]
-                similar_weights = np.array([sim for _, sim in top_similar])
-                
-                # Normalize weights
-                similar_weights = similar_weights / similar_weights.sum()
-                
-                print(f"Top similar user: {similar_user_ids[0]} with correlation {top_similar[0][1]:.3f}")
-                
-                # Get ratings from similar users
-                similar_users_ratings = ratings_df[ratings_df["UserID"].isin(similar_user_ids)]
-                
-                # Calculate weighted average for each movie
-                personalized_scores = {}
-                for movie_id in similar_users_ratings["MovieID"].unique():
-                    if movie_id in user_ratings.index:
-                        continue  # Skip already rated
-                    
-                    # Get ratings from similar users for this movie
-                    movie_ratings_df = similar_users_ratings[similar_users_ratings["MovieID"] == movie_id]
-                    
-                    weighted_sum = 0
-                    weight_sum = 0
-                    
-                    for idx, (uid, weight) in enumerate(zip(similar_user_ids, similar_weights)):
-                        user_rating = movie_ratings_df[movie_ratings_df["UserID"] == uid]["Rating"].values
-                        if len(user_rating) > 0:
-                            weighted_sum += user_rating[0] * weight
-                            weight_sum += weight
-                    
-                    if weight_sum > 0:
-                        personalized_scores[movie_id] = weighted_sum / weight_sum
-
-        print(f"Generated {len(personalized_scores)} personalized scores")
-        
-        # Get all movies from database
-        cursor.execute("SELECT * FROM movies")
-        movies = pd.DataFrame(cursor.fetchall())
-
-        if movies.empty:
-            cursor.close()
-            conn.close()
-            return {"user_id": user_id, "recommended_movies": []}
+            # Get top 10 most similar users
+            top_similar = sorted(user_similarities.items(), key=lambda x: x[1], reverse=True)[:10]
+            similar_user_ids = [uid for uid, _ in top_similar]
+            similar_weights = np.array([sim for _, sim in top_similar])
+
+            # Normalize weights
+            similar_weights = similar_weights / similar_weights.sum()
+
+            log.debug("Top similar user: %s with correlation %.3f", similar_user_ids[0], top_similar[0][1])
+
+            # Weighted average for each movie the similar users rated,
+            # skipping movies the user already rated
+            with metrics.stage("predict"):
+                personalized_scores = matrix.predict(similar_user_ids, similar_weights,
+                                                     exclude=seen_items)
+
+    log.debug("Generated %d personalized scores", len(personalized_scores))
 
+    # Get all movies from the catalog snapshot
+    snap = get_catalog()
+    movies = snap.frame()
+
+    if movies.empty:
+        return {"user_id": user_id, "recommended_movies": []}
+
+    with metrics.stage("frame"):
         # Filter out already rated movies
-        user_rated_movies = user_ratings.index.tolist()
-        movies = movies[~movies['id'].isin(user_rated_movies)]
+        movies = movies[~seen_items.mask(snap.id_numbers)]
 
         # Apply personalized scores
         movies['score'] = movies['id'].map(personalized_scores).fillna(0)
-        
-        # Add some randomness to break ties and add variety
-        # Hash user_id + number of ratings to get a dynamic seed that changes with new ratings
-        seed = hash(str(user_id) + str(len(user_ratings))) % (2**32)
-        np.random.seed(seed)
-        movies['random_boost'] = np.random.uniform(0, 0.2, size=len(movies))
+
+        # Add some randomness to break ties and add variety; rng is seeded
+        # from the fingerprint, which changes with new ratings
+        movies['random_boost'] = rng.uniform(0, 0.2, size=len(movies))
         movies['final_score'] = movies['score'] + movies['random_boost']
 
-        # Sort by final score and get top 10
-        top_movies = movies.sort_values(by='final_score', ascending=False).head(10)
-        
-        if len(top_movies) > 0:
-            print(f"Top movie score: {top_movies.iloc[0]['score']:.3f}")
-        print("=== END DEBUG ===\n")
+        # Sort by final score and keep the ranked head
+        top_movies = movies.sort_values(by='final_score', ascending=False).head(RANKED_DEPTH)
 
-        recommended_movies = [{
-            "id": int(row.get("id", 0)),
-            "title": row.get("title", ""),
-            "genres": row.get("genres", ""),
-            "cluster": int(user_cluster),
-            "posterUrl": row.get("posterUrl", ""),
-            "score": float(row.get("score", 0))
-        } for _, row in top_movies.iterrows()]
-
-        cursor.close()
-        conn.close()
-        
-        return {"user_id": user_id, "recommended_movies": recommended_movies}
+    # Built column by column rather than row by row through iterrows()
+    recommended_movies = [{
+        "id": int(movie_id),
+        "title": title,
+        "genres": genres,
+        "cluster": int(user_cluster),
+        "posterUrl": poster_url,
+        "score": score
+    } for movie_id, title, genres, poster_url, score in zip(
+        _column(top_movies, "id", 0),
+        _column(top_movies, "title"),
+        _column(top_movies, "genres"),
+        _column(top_movies, "posterUrl"),
+        top_movies["score"].astype(float).tolist()
+    )]
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return {"user_id": user_id, "recommended_movies": recommended_movies}
 
 
 # Recommendation
-DATA_PATH = "models/data.pkl"
-XGB_PATH = "models/xgb_model.pkl"
-CLUSTER_SIM_PATH = "models/cluster_sim.pkl"
-MOVIES_SIM_PATH = "models/movies_for_similarity.pkl"
-SIM_MATRIX_PATH = "models/similarity_matrix.pkl"
-
-data = pickle.load(open(DATA_PATH, "rb"))
-xgb_model2 = pickle.load(open(XGB_PATH, "rb"))
-cluster_sim = pickle.load(open(CLUSTER_SIM_PATH, "rb"))
-movies_sim = pickle.load(open(MOVIES_SIM_PATH, "rb"))
-similarity_matrix = pickle.load(open(SIM_MATRIX_PATH, "rb"))
+RECOMMENDATIONS_N = 15
+
+def _ranked_depth(n):
+    # How many movies /recommendations ranks when the page size is n
+    return max(n, RANKED_DEPTH)
+
+registry.register("recommender", "models/xgb_model.pkl", compiling(pickle.load))
+registry.register("cluster_sim", "models/cluster_sim.pkl", pickle.load)
 
 class RatingRequest(BaseModel):
     username: str
     movie_id: int
     rating: float
 
-def connect_db():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="",
-        database="movies_mobile"
+@app.get("/db-pool-stats")
+def db_pool_stats():
+    return db.pool_stats()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Request and stage latency histograms, plus the pool and cache counters
+    text = metrics.render([
+        ("db_pool", db.pool_stats()),
+        ("result_cache", results.stats()),
+        ("precomputed", rec_store.stats()),
+        ("recluster", reclustering.stats()),
+    ])
+    return PlainTextResponse(text, media_type=metrics.CONTENT_TYPE)
+
+@app.get("/cache-stats")
+def cache_stats():
+    return {**results.stats(), "precomputed": rec_store.stats()}
+
+@app.get("/cluster-drift")
+def cluster_drift():
+    # Online re-clustering: last step's batch, centroid shift and reassignment rate
+    return reclustering.stats()
+
+@app.get("/models")
+def model_stats():
+    return registry.stats()
+
+class ModelReloadRequest(BaseModel):
+    filename: Optional[str] = None  # a file in models/, defaults to the current one
+    sha256: Optional[str] = None
+
+# Bearer token for the admin endpoints that swap production models; unset
+# leaves them disabled (the MODEL_WATCH_INTERVAL file watcher still works)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model administration is disabled (set ADMIN_TOKEN)")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/models/{name}/reload", dependencies=[Depends(require_admin)])
+def reload_model(name: str, req: ModelReloadRequest = Body(default=ModelReloadRequest())):
+    if name not in registry.stats():
+        raise HTTPException(status_code=404, detail=f"Unknown model '{name}'")
+    try:
+        path = registry.resolve_path(req.filename) if req.filename else None
+        entry = registry.reload(name, path, req.sha256)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ModelIntegrityError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"model": name, **entry.info()}
+
+@app.get("/catalog-version")
+def catalog_version(if_none_match: Optional[str] = Header(None)):
+    # Tagged by the catalog checksum, which every worker computes alike
+    snap = get_catalog()
+    return responses.conditional(
+        {"version": snap.version, "movies": snap.size, "loaded_at": snap.loaded_at},
+        f'"{snap.checksum}"', if_none_match
     )
 
 @app.post("/add-rating")
 def add_rating(req: RatingRequest):
     try:
-        conn = connect_db()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("SELECT userId FROM users WHERE username = %s", (req.username,))
-        user_row = cursor.fetchone()
+        user_row = db.fetch_user(req.username)
         if not user_row:
             raise HTTPException(status_code=404, detail="User not found")
 
         user_id = user_row["userId"]
-        print(f"Debug: username='{req.username}', UserID={user_id}")  # debug message
+        log.debug("add-rating: username=%r, UserID=%s, movie_id=%s", req.username, user_id, req.movie_id)
 
-        cursor.execute("SELECT id FROM movies WHERE id = %s", (req.movie_id,))
-        print(f"Debug: movie_id={req.movie_id}")  # debug message
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Movie not found")
-
-        cursor.execute("""
-            INSERT INTO ratings (UserID, MovieID, Rating)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE Rating = VALUES(Rating)
-        """, (user_id, req.movie_id, req.rating))
+        user_stats.ensure_table()
+        feature_store.ensure_tables()
+        rec_store.ensure_table()
+        with db.transaction() as cursor:
+            cursor.execute("SELECT id FROM movies WHERE id = %s", (req.movie_id,))
+            if not cursor.fetchone():
+                raise HTTPException(status_code=404, detail="Movie not found")
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # Previous rating (if any) so the user's stats can be adjusted
+            cursor.execute(
+                "SELECT Rating FROM ratings WHERE UserID = %s AND MovieID = %s FOR UPDATE",
+                (user_id, req.movie_id)
+            )
+            previous = cursor.fetchone()
+
+            cursor.execute("""
+                INSERT INTO ratings (UserID, MovieID, Rating)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE Rating = VALUES(Rating)
+            """, (user_id, req.movie_id, req.rating))
+
+            old_rating = previous[0] if previous else None
+            count_delta = user_stats.apply_rating(cursor, user_id, req.rating, old_rating)
+            aggregates = feature_store.apply_rating(cursor, user_row, req.movie_id, req.rating, old_rating)
+            rec_store.forget(cursor, [user_id])
+        results.invalidate_user(str(user_id))
+        seen.add(user_id, req.movie_id, count_delta)
+        feature_store.add(aggregates)
 
         return {
             "message": "Rating added successfully",
@@ -1001,81 +1016,119 @@ def add_rating(req: RatingRequest):
 
 
 @app.get("/recommendations")
-def get_personalized_recommendations(username: str, n: int = 15):
-    db = connect_db()
-    cursor = db.cursor(dictionary=True)
-
-    cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-    profile = cursor.fetchone()
+def get_personalized_recommendations(username: str, n: int = RECOMMENDATIONS_N,
+                                     params: Paging = Depends(responses.paging)):
+    # n is the default page size; limit overrides it
+    profile = db.fetch_user(username)
     if not profile:
         raise HTTPException(status_code=404, detail="Username not found")
 
-    user_id = profile["userId"]
-    print(f"Debug: username='{username}', UserID={user_id}")
+    depth = _ranked_depth(n)
+    return _serve("recommendations", profile, lambda rng: _personalized_recommendations(username, profile, depth, rng),
+                  params, n, depth)
 
+def _personalized_recommendations(username, profile, n, rng):
+    user_id = profile["userId"]
     age = profile["age"] or 30
     gender_m = 1 if profile["gender"] == "M" else 0
     occupation = profile["occupation"] or 0
     preferred_genres_set = set((profile.get("preferred_genres") or "").split("|"))
 
-    cursor.execute("SELECT MovieID, Rating FROM ratings WHERE UserID = %s", (user_id,))
-    ratings = cursor.fetchall()
-    rated_ids = {r["MovieID"] for r in ratings}
+    # Ratings uploaded without a value are skipped, as in _cluster_recommendations
+    ratings = [r for r in db.fetch_user_ratings(user_id) if r["Rating"] is not None]
+    seen_items = seen.get(user_id)
     total_ratings = len(ratings)
     avg_rating = np.mean([r["Rating"] for r in ratings]) if ratings else 3.0
     std_rating = np.std([r["Rating"] for r in ratings]) if ratings else 0.0
     user_cluster = 1 if avg_rating >= 4 else 0
 
-    print(f"Debug: total_ratings={total_ratings}, avg_rating={avg_rating:.2f}, std_rating={std_rating:.2f}, cluster={user_cluster}")
+    log.debug("recommendations: username=%r, UserID=%s, total_ratings=%d, avg_rating=%.2f, std_rating=%.2f, cluster=%d",
+              username, user_id, total_ratings, avg_rating, std_rating, user_cluster)
 
-    cursor.execute("SELECT * FROM movies")
-    movies = cursor.fetchall()
-    random.shuffle(movies)
+    snap = get_catalog()
 
-    preds = []
-    for movie in movies:
-        if movie["id"] in rated_ids:
-            continue
-
-        genres_set = set(movie["genres"].split("|")) if movie["genres"] else set()
-        genre_match = len(preferred_genres_set & genres_set)
-
-        feat = np.array([
-            age,
-            gender_m,
-            occupation,
-            total_ratings,
-            avg_rating,
-            std_rating,
-            movie["rating"] or 0,
-            movie["year"] or 2000,
-            len(genres_set) if genres_set else 1,
-            1 if "Comedy" in genres_set else 0,
-            1 if "Drama" in genres_set else 0,
-            1 if "Action" in genres_set else 0,
-            1 if "Sci-Fi" in genres_set else 0,
-            1 if "Thriller" in genres_set else 0,
-            1 if "Romance" in genres_set else 0,
-            1 if "Adventure" in genres_set else 0,
-            1 if "Crime" in genres_set else 0,
-        ]).reshape(1, -1)
-
-        prob = xgb_model2.predict_proba(feat)[0, 1]
-        rating_boost = sum([0.1 for r in ratings if r["Rating"] >= 4])
-        boost = 1.0 + 0.4 * cluster_sim[user_cluster].mean()
-        score = (prob * boost + 0.3 * genre_match + rating_boost) * (1 + np.random.uniform(-0.03, 0.03))
+    # Unrated movies, in random order so equal scores tie-break randomly
+    candidates = np.flatnonzero(~seen_items.mask(snap.id_numbers))
+    candidates = candidates[rng.permutation(len(candidates))]
+    if len(candidates) == 0:
+        return {"recommended_movies": []}
 
+    with metrics.stage("features"):
+        X = recommendation_features(
+            snap, candidates, age, gender_m, occupation,
+            total_ratings, avg_rating, std_rating
+        )
+    with metrics.stage("predict"):
+        prob = registry.get("recommender").predict_proba(X)[:, 1]
+
+    # Terms that do not depend on the movie
+    rating_boost = 0.1 * sum(1 for r in ratings if r["Rating"] >= 4)
+    boost = 1.0 + 0.4 * registry.get("cluster_sim")[user_cluster].mean()
+    genre_match = token_genre_match(snap, preferred_genres_set)[candidates]
+    noise = rng.uniform(-0.03, 0.03, size=len(candidates))
+
+    scores = (prob * boost + 0.3 * genre_match + rating_boost) * (1 + noise)
+
+    preds = []
+    for i in top_k(scores, n):
+        movie = snap.record(candidates[i])
         preds.append({
             "id": movie["id"],
             "title": movie["title"],
             "genres": movie["genres"],
             "posterUrl": movie.get("posterUrl", ""),
             "cluster": user_cluster,
-            "score": score
+            "score": float(scores[i])
         })
 
-    preds.sort(key=lambda x: x["score"], reverse=True)
-    cursor.close()
-    db.close()
-    return {"recommended_movies": preds[:n]}
+    return {"recommended_movies": preds}
+
+
+@app.get("/similar-movies")
+def get_similar_movies(movie_ids: str, username: Optional[str] = None, n: int = 10,
+                       params: Paging = Depends(responses.paging)):
+    # movie_ids is a comma-separated list of seed movies; when a username is
+    # given, movies that user already rated are left out
+    try:
+        seeds = [int(m) for m in movie_ids.split(",") if m.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="movie_ids must be comma-separated integers")
+    if not seeds:
+        raise HTTPException(status_code=400, detail="movie_ids is empty")
+
+    rated_ids = []
+    depth = max(n, RANKED_DEPTH)
+    if username:
+        profile = db.fetch_user(username)
+        if not profile:
+            raise HTTPException(status_code=404, detail="Username not found")
+        rated_ids = seen.get(profile["userId"]).ids()
+
+    try:
+        index = similar.get_index()
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Similar-movies index not built (run: python -m similar build)")
+
+    snap = get_catalog()
+
+    def neighbours():
+        results = []
+        # Ask for a few extra in case some neighbors are missing from the catalog
+        for movie_id, score in index.similar_to(seeds, depth + len(seeds), exclude=rated_ids):
+            row = snap.id_index.get(movie_id)
+            if row is None:
+                continue
+            movie = snap.record(row)
+            results.append({
+                "id": movie["id"],
+                "title": movie["title"],
+                "genres": movie["genres"],
+                "posterUrl": movie.get("posterUrl", ""),
+                "score": round(score, 4)
+            })
+            if len(results) == depth:
+                break
+        return {"seed_movies": seeds, "similar_movies": results}
 
+    ranking = hashlib.sha1(f"{seeds}{username}{len(rated_ids)}{snap.checksum}".encode()).hexdigest()
+    return responses.page(neighbours, "similar_movies", ranking, params, n)
@@ -0,0 +1,150 @@
+# Per-request stage timings, exported as Prometheus histograms on /metrics and
+# as a Server-Timing header on every response.
+#
+# Code marks its stages with `with metrics.stage("predict"):`; time spent in
+# the same stage is summed over the request (every query counts towards
+# "db"). Stages run on worker threads count too: the request's collector is a
+# context variable, which Starlette's thread pool and db.run() carry over.
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+
+import logs
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; upper bounds of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for label_values, counts in sorted(series.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {counts[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time from request start to the end of the response body.",
+    ("endpoint", "method", "status")
+)
+STAGE_SECONDS = Histogram(
+    "http_request_stage_seconds", "Time per request spent in each stage (db, frame, features, predict, serialize).",
+    ("endpoint", "stage")
+)
+
+
+class _Timings:
+    def __init__(self):
+        self.stages = {}  # stage -> seconds, in first-seen order
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def header(self, total):
+        with self._lock:
+            parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name):
+    # Outside a request (batch jobs, startup) this only costs the clock reads
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, time.perf_counter() - start)
+
+
+class TimingMiddleware:
+    # Plain ASGI middleware, so it adds no task or body buffering of its own
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = _Timings()
+        token = _current.set(timings)
+        sampled = logs.begin_request()
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.header(time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            # The router has recorded the matched route in scope by now;
+            # labelling by its path template keeps the label set bounded
+            route = scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            REQUEST_SECONDS.observe((endpoint, scope["method"], str(status)), elapsed)
+            for name, seconds in list(timings.stages.items()):
+                STAGE_SECONDS.observe((endpoint, name), seconds)
+            _current.reset(token)
+            logs.end_request(sampled)
+
+
+def render(snapshots=()):
+    # Prometheus text format: the histograms, then point-in-time values given
+    # as (prefix, {key: number}) pairs, e.g. ("db_pool", db.pool_stats())
+    lines = REQUEST_SECONDS.render() + STAGE_SECONDS.render()
+    for prefix, values in snapshots:
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {prefix}_{key} untyped")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
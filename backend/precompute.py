@@ -0,0 +1,115 @@
+# Batch job: run the recommenders for every user ahead of time and store the
+# responses in precomputed_recommendations (rec_store.py), so the API serves
+# most reads with one primary-key lookup.
+#
+#   cd backend && python -m precompute [--workers 4] [--chunk-size 200] [--only PredictFutureRating ...]
+#
+# Users are split into chunks and scored on a process pool; each chunk is
+# written in its own transaction. Reports users/sec and per-chunk timings.
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from fastapi.encoders import jsonable_encoder
+
+import db
+import rec_store
+import user_stats
+
+RECOMMENDERS = ["PredictFutureRating", "recommendations", "UserRatingsCluster"]
+CHUNK_SIZE = 200
+
+
+def _compute(app, recommender, user_row):
+    # Same call, fingerprint arguments and random seed as the endpoint uses
+    if recommender == "PredictFutureRating":
+        return app._fingerprint(recommender, user_row), app._predict_future_rating(user_row["username"], user_row)
+    if recommender == "recommendations":
+        depth = app._ranked_depth(app.RECOMMENDATIONS_N)
+        fingerprint = app._fingerprint(recommender, user_row, depth)
+        return fingerprint, app._personalized_recommendations(user_row["username"], user_row, depth, app._rng(fingerprint))
+    if recommender == "UserRatingsCluster":
+        fingerprint = app._fingerprint(recommender, user_row)
+        return fingerprint, app._cluster_recommendations(user_row, app._rng(fingerprint))
+    raise ValueError(f"Unknown recommender {recommender}")
+
+
+def run_chunk(index, user_rows, recommenders):
+    # Runs in a worker process; main is imported there so the models and the
+    # catalog are loaded once per worker
+    import main as app
+
+    start = time.perf_counter()
+    rows, errors = [], 0
+    for user_row in user_rows:
+        for recommender in recommenders:
+            try:
+                fingerprint, payload = _compute(app, recommender, user_row)
+            except Exception:
+                errors += 1
+                continue
+            rows.append((user_row["userId"], recommender, fingerprint,
+                         json.dumps(jsonable_encoder(payload)), time.time()))
+    scored = time.perf_counter() - start
+
+    with db.transaction() as cursor:
+        rec_store.write(cursor, rows)
+    return {
+        "chunk": index,
+        "users": len(user_rows),
+        "stored": len(rows),
+        "errors": errors,
+        "score_seconds": round(scored, 3),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def precompute(workers=None, chunk_size=CHUNK_SIZE, recommenders=RECOMMENDERS):
+    rec_store.ensure_table()
+    user_stats.ensure_table()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT * FROM users WHERE username IS NOT NULL")
+        users = cursor.fetchall()
+
+    # Label dirty users once up front rather than in every worker
+    import main as app
+    user_stats.refresh_clusters(app._user_kmeans())
+
+    chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+    start = time.perf_counter()
+    reports = []
+    # spawn, not fork: a forked child would share the parent's pooled sockets
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(run_chunk, i, chunk, list(recommenders)) for i, chunk in enumerate(chunks)]
+        for future in as_completed(futures):
+            report = future.result()
+            reports.append(report)
+            print(f"chunk {report['chunk']:>4}: {report['users']} users, {report['stored']} stored, "
+                  f"{report['errors']} errors, {report['seconds']:.2f}s")
+    elapsed = time.perf_counter() - start
+
+    return {
+        "users": len(users),
+        "chunks": sorted(reports, key=lambda r: r["chunk"]),
+        "seconds": round(elapsed, 2),
+        "users_per_sec": round(len(users) / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute recommendations for every user")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--only", nargs="+", choices=RECOMMENDERS, default=RECOMMENDERS)
+    args = parser.parse_args()
+
+    report = precompute(args.workers, args.chunk_size, args.only)
+    print(f"{report['users']} users in {report['seconds']}s ({report['users_per_sec']} users/sec)")
+
+
+if __name__ == "__main__":
+    main()
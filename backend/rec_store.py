@@ -0,0 +1,88 @@
+# Precomputed recommendation responses, written by the batch job
+# (precompute.py) and read by the API with one primary-key lookup.
+#
+# Every row stores the fingerprint of the inputs it was computed from (see
+# main._fingerprint). A row is only served while the user's fingerprint still
+# matches; anyone who rated, edited their profile, or was affected by a
+# catalog or model change since the last run is scored live instead. Rating
+# writes also delete the user's rows (forget()), so an overwrite that leaves
+# the rating sums unchanged cannot bring back an old response.
+import json
+import threading
+
+import db
+
+STORE_DDL = """
+    CREATE TABLE IF NOT EXISTS precomputed_recommendations (
+        UserID BIGINT NOT NULL,
+        recommender VARCHAR(64) NOT NULL,
+        fingerprint CHAR(40) NOT NULL,
+        payload LONGTEXT NOT NULL,
+        computed_at DOUBLE NOT NULL,
+        PRIMARY KEY (UserID, recommender)
+    )
+"""
+
+LOOKUP = "SELECT fingerprint, payload FROM precomputed_recommendations WHERE UserID = %s AND recommender = %s"
+
+_UPSERT_HEAD = "INSERT INTO precomputed_recommendations (UserID, recommender, fingerprint, payload, computed_at) VALUES "
+_UPSERT_TAIL = (" ON DUPLICATE KEY UPDATE fingerprint = VALUES(fingerprint), payload = VALUES(payload),"
+                " computed_at = VALUES(computed_at)")
+
+BATCH_ROWS = 200  # payloads are a few KB each
+
+_ready = False
+_ready_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {"served": 0, "stale": 0, "missing": 0}
+
+
+def ensure_table():
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            with db.transaction() as cursor:
+                cursor.execute(STORE_DDL)
+            _ready = True
+
+
+def lookup(user_id, recommender, fingerprint):
+    # The stored response if it was computed from the same inputs, else None
+    ensure_table()
+    rows = db.fetch_prepared(LOOKUP, (user_id, recommender))
+    if not rows:
+        outcome, payload = "missing", None
+    elif rows[0]["fingerprint"] != fingerprint:
+        outcome, payload = "stale", None
+    else:
+        outcome, payload = "served", json.loads(rows[0]["payload"])
+    with _stats_lock:
+        _stats[outcome] += 1
+    return payload
+
+
+def forget(cursor, user_ids):
+    # Drop the stored responses of users whose ratings the caller's
+    # transaction changes; call ensure_table() before opening it
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), BATCH_ROWS):
+        chunk = user_ids[start:start + BATCH_ROWS]
+        cursor.execute(
+            f"DELETE FROM precomputed_recommendations WHERE UserID IN ({','.join(['%s'] * len(chunk))})", chunk
+        )
+
+
+def write(cursor, rows, batch_rows=BATCH_ROWS):
+    # rows: (user_id, recommender, fingerprint, payload_json, computed_at)
+    for start in range(0, len(rows), batch_rows):
+        batch = rows[start:start + batch_rows]
+        sql = _UPSERT_HEAD + ",".join(["(%s, %s, %s, %s, %s)"] * len(batch)) + _UPSERT_TAIL
+        cursor.execute(sql, [value for row in batch for value in row])
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,189 @@
+# Online mini-batch re-clustering of users by their rating statistics.
+#
+#   RECLUSTER_INTERVAL=0     seconds between steps of the background worker;
+#                            0 (default) keeps the trained KMeans frozen
+#   RECLUSTER_BATCH=1024     most users folded into the centroids per step
+#
+# Each step reads every user's clustering features from user_rating_stats and
+# takes the users whose features changed since the previous step (they rated
+# something) as the mini-batch. The centroids move towards the batch with
+# per-centroid learning rates 1 / (points seen), as in Sculley's mini-batch
+# k-means, starting from the trained model's centroids. The worker then
+# relabels every user and publishes the refitted model through the registry,
+# all on its own thread; requests keep using the previous model until the
+# swap. A new model file (hot reload) restarts from that file's centroids.
+#
+# Drift is reported per step: how far the centroids moved and the share of
+# users whose cluster changed. Run the worker in one process only; every
+# process reads the labels it writes.
+import os
+import threading
+import time
+
+import numpy as np
+
+import logs
+import user_stats
+from registry import registry
+
+RECLUSTER_INTERVAL = float(os.getenv("RECLUSTER_INTERVAL", "0"))
+RECLUSTER_BATCH = int(os.getenv("RECLUSTER_BATCH", "1024"))
+
+MODEL = "user_kmeans"
+
+log = logs.get_logger("reclustering")
+
+
+class OnlineKMeans:
+    # Centroids plus how many points each has absorbed; predict() matches
+    # KMeans.predict on the same features
+
+    def __init__(self, centers, counts):
+        self.cluster_centers_ = np.array(centers, dtype=float)
+        self.counts = np.maximum(np.asarray(counts, dtype=float), 1.0)
+        self.n_clusters = len(self.cluster_centers_)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=float)
+        distances = ((X[:, None, :] - self.cluster_centers_[None, :, :]) ** 2).sum(axis=2)
+        return distances.argmin(axis=1)
+
+    def partial_fit(self, X):
+        # One mini-batch step: each centroid becomes the running mean of the
+        # points it has absorbed, this batch's included
+        labels = self.predict(X)
+        for c in np.unique(labels).tolist():
+            members = X[labels == c]
+            total = self.counts[c] + len(members)
+            self.cluster_centers_[c] += (members.sum(axis=0) - len(members) * self.cluster_centers_[c]) / total
+            self.counts[c] = total
+        return self
+
+    def copy(self):
+        return OnlineKMeans(self.cluster_centers_, self.counts)
+
+
+_labelled_version = None
+_version_lock = threading.Lock()
+
+
+def current_model():
+    # The user KMeans model. Stored cluster labels belong to the version that
+    # assigned them: after a reload from disk every user is relabelled on the
+    # next refresh, while versions published by the worker arrive labelled.
+    global _labelled_version
+    entry = registry.entry(MODEL)
+    with _version_lock:
+        if entry.version != _labelled_version:
+            if _labelled_version is not None:
+                user_stats.invalidate_clusters()
+            _labelled_version = entry.version
+    return entry.model
+
+
+class Reclusterer:
+    def __init__(self, batch_size=RECLUSTER_BATCH, seed=None):
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+        self.model = None
+        self.version = None     # registry version self.model was built from or published as
+        self.previous = None    # UserID -> feature tuple at the last step
+        self._stats_lock = threading.Lock()
+        self._stats = {"steps": 0, "published": 0, "users": 0, "batch": 0,
+                       "centroid_shift_max": 0.0, "centroid_shift_mean": 0.0,
+                       "reassignment_rate": 0.0, "last_step_seconds": 0.0, "last_step_at": 0.0}
+
+    def step(self):
+        # One pass; returns the stats, with "published" counting refits
+        global _labelled_version
+        start = time.perf_counter()
+        entry = registry.entry(MODEL)
+        rows = user_stats.all_features()
+        X = np.vstack([user_stats.features_of(row) for row in rows]) if rows else np.empty((0, len(user_stats.FEATURES)))
+        current = {row["UserID"]: tuple(x) for row, x in zip(rows, X.tolist())}
+
+        if self.model is None or entry.version != self.version:
+            # First step, or the file was reloaded: start from its centroids,
+            # weighted by how many of the current users are nearest to each
+            self.model = OnlineKMeans(entry.model.cluster_centers_, np.zeros(len(entry.model.cluster_centers_)))
+            if len(X):
+                self.model.counts = np.maximum(np.bincount(self.model.predict(X), minlength=self.model.n_clusters), 1.0)
+            self.version = entry.version
+            self.previous = current
+            return self._record(start, len(rows), 0, None, None)
+
+        changed = [i for i, row in enumerate(rows) if self.previous.get(row["UserID"]) != current[row["UserID"]]]
+        self.previous = current
+        if not changed:
+            return self._record(start, len(rows), 0, None, None)
+        if len(changed) > self.batch_size:
+            changed = self.rng.choice(changed, self.batch_size, replace=False)
+
+        before = self.model.cluster_centers_.copy()
+        self.model.partial_fit(X[changed])
+        shift = np.sqrt(((self.model.cluster_centers_ - before) ** 2).sum(axis=1))
+
+        labels = self.model.predict(X)
+        stored = np.array([-1 if row["cluster"] is None else int(row["cluster"]) for row in rows])
+        labelled = stored >= 0
+        reassigned = float((labels[labelled] != stored[labelled]).mean()) if labelled.any() else 0.0
+        # Only rows whose label changed, or that still wait for one, are written
+        write = [i for i in range(len(rows)) if labels[i] != stored[i] or rows[i]["dirty"]]
+        user_stats.store_clusters([rows[i] for i in write], labels[write])
+
+        published = self.model.copy()
+        with _version_lock:
+            entry = registry.publish(MODEL, published)
+            _labelled_version = entry.version
+        self.version = entry.version
+        log.info("Published %s version %d: batch %d, max centroid shift %.4f, reassigned %.2f%%",
+                 MODEL, entry.version, len(changed), shift.max(), 100 * reassigned)
+        return self._record(start, len(rows), len(changed), shift, reassigned)
+
+    def _record(self, start, users, batch, shift, reassigned):
+        with self._stats_lock:
+            self._stats["steps"] += 1
+            self._stats["users"] = users
+            self._stats["batch"] = batch
+            if shift is not None:
+                self._stats["published"] += 1
+                self._stats["centroid_shift_max"] = float(shift.max())
+                self._stats["centroid_shift_mean"] = float(shift.mean())
+                self._stats["reassignment_rate"] = reassigned
+            self._stats["last_step_seconds"] = round(time.perf_counter() - start, 4)
+            self._stats["last_step_at"] = time.time()
+            return dict(self._stats)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["enabled"] = _worker is not None
+        stats["model_version"] = self.version
+        if self.model is not None:
+            stats["centroids"] = self.model.cluster_centers_.round(4).tolist()
+        return stats
+
+
+reclusterer = Reclusterer()
+_worker = None
+
+
+def start_worker(interval=RECLUSTER_INTERVAL):
+    global _worker
+    if interval <= 0 or _worker is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                reclusterer.step()
+            except Exception as e:  # keep the current model and try again next time
+                log.warning("Reclustering step failed: %s", e)
+
+    _worker = threading.Thread(target=run, name="reclustering", daemon=True)
+    _worker.start()
+
+
+def stats():
+    return reclusterer.stats()
@@ -0,0 +1,212 @@
+# Model registry: pickled artifacts are loaded on first use, checked against
+# a SHA-256 checksum, and can be replaced while the service is running.
+#
+# Each load produces an immutable LoadedModel with a version number. Swapping
+# in a new version replaces one dict entry under a lock, so a request that
+# already fetched a model keeps using that object until it finishes, and new
+# requests see the new one. Nothing is swapped in unless it loaded and verified.
+#
+# Expected checksums come from a "<artifact>.sha256" sidecar file when one
+# exists (first token of the file, as written by sha256sum), or from the
+# caller of reload(). MODEL_WATCH_INTERVAL > 0 starts a thread that reloads
+# any artifact whose file changed on disk.
+import hashlib
+import io
+import logging
+import os
+import pickle
+import threading
+import time
+
+import joblib
+
+import logs
+import metrics
+
+MODEL_DIR = "models"
+WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+
+log = logs.get_logger("registry")
+
+
+class ModelIntegrityError(Exception):
+    pass
+
+
+class LoadedModel:
+    def __init__(self, name, version, path, model, checksum, mtime, load_seconds, file_bytes, rss_delta_bytes):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.model = model
+        self.checksum = checksum
+        self.mtime = mtime
+        self.loaded_at = time.time()
+        self.load_seconds = load_seconds
+        self.file_bytes = file_bytes
+        self.rss_delta_bytes = rss_delta_bytes
+
+    def info(self):
+        return {
+            "version": self.version,
+            "path": self.path,
+            "sha256": self.checksum,
+            "loaded_at": self.loaded_at,
+            "load_ms": round(self.load_seconds * 1000, 1),
+            "file_bytes": self.file_bytes,
+            "rss_delta_bytes": self.rss_delta_bytes,
+        }
+
+
+def _rss_bytes():
+    # Current resident set size (Linux); None where /proc is unavailable. The
+    # delta around a first load also counts modules imported by the unpickler.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _expected_checksum(path):
+    try:
+        with open(path + ".sha256") as f:
+            return f.read().split()[0].lower()
+    except (OSError, IndexError):
+        return None
+
+
+class ModelRegistry:
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self._specs = {}     # name -> (path, loader)
+        self._loaded = {}    # name -> LoadedModel
+        self._versions = {}  # name -> last version number handed out
+        self._lock = threading.Lock()
+        # Loads are serialized so the RSS difference around one load is
+        # attributable to that model
+        self._load_lock = threading.Lock()
+        self._watcher = None
+
+    def register(self, name, path, loader=joblib.load):
+        with self._lock:
+            self._specs[name] = (path, loader)
+
+    def get(self, name):
+        # The model object for `name`, loading it on first use. Fetch it once
+        # per request and use that reference throughout.
+        return self.entry(name).model
+
+    def entry(self, name):
+        entry = self._loaded.get(name)
+        if entry is not None:
+            return entry
+        with self._load_lock:
+            entry = self._loaded.get(name)
+            if entry is None:
+                path, loader = self._specs[name]
+                entry = self._load(name, path, loader, _expected_checksum(path))
+                with self._lock:
+                    self._loaded[name] = entry
+        return entry
+
+    def _load(self, name, path, loader, expected=None):
+        start = time.perf_counter()
+        mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            raw = f.read()
+        # Hash the exact bytes that get unpickled
+        checksum = hashlib.sha256(raw).hexdigest()
+        if expected and checksum != expected.lower():
+            raise ModelIntegrityError(f"{name}: checksum mismatch for {path} (got {checksum}, expected {expected})")
+
+        rss_before = _rss_bytes()
+        with metrics.stage("model_load"):  # a request that triggers a lazy load pays for it
+            model = loader(io.BytesIO(raw))
+        rss_after = _rss_bytes()
+        del raw
+
+        with self._lock:
+            version = self._versions.get(name, 0) + 1
+            self._versions[name] = version
+        rss = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+        return LoadedModel(name, version, path, model, checksum, mtime,
+                           time.perf_counter() - start, os.path.getsize(path), rss)
+
+    def reload(self, name, path=None, sha256=None):
+        # Load a new version (optionally from another file) and swap it in.
+        # Raises without touching the current version if loading or
+        # verification fails.
+        with self._load_lock:
+            current_path, loader = self._specs[name]
+            path = path or current_path
+            entry = self._load(name, path, loader, sha256 or _expected_checksum(path))
+            with self._lock:
+                self._specs[name] = (path, loader)
+                self._loaded[name] = entry
+        return entry
+
+    def publish(self, name, model):
+        # Swap in a model built in-process (e.g. refitted online). It keeps
+        # the current file's path and mtime, so the watcher only replaces it
+        # once that file itself changes.
+        current = self.entry(name)
+        checksum = hashlib.sha256(pickle.dumps(model)).hexdigest()
+        with self._load_lock:
+            with self._lock:
+                version = self._versions.get(name, 0) + 1
+                self._versions[name] = version
+                entry = LoadedModel(name, version, current.path, model, checksum, current.mtime,
+                                    0.0, current.file_bytes, None)
+                self._loaded[name] = entry
+        return entry
+
+    def resolve_path(self, filename):
+        # Admin reloads may only point at files inside the model directory
+        root = os.path.realpath(self.model_dir)
+        path = os.path.realpath(os.path.join(root, filename))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"{filename!r} is not a file in {self.model_dir}/")
+        return os.path.join(self.model_dir, os.path.basename(path))
+
+    def stats(self):
+        with self._lock:
+            specs = dict(self._specs)
+            loaded = dict(self._loaded)
+        models = {}
+        for name, (path, _) in specs.items():
+            entry = loaded.get(name)
+            models[name] = entry.info() if entry else {"version": None, "path": path, "loaded": False}
+        return models
+
+    def check_for_updates(self):
+        # Reload every loaded model whose file changed since it was loaded.
+        # Returns {name: new version or error message}.
+        with self._lock:
+            loaded = dict(self._loaded)
+        results = {}
+        for name, entry in loaded.items():
+            try:
+                if os.path.getmtime(entry.path) == entry.mtime:
+                    continue
+                results[name] = self.reload(name).version
+            except Exception as e:  # keep serving the old version
+                results[name] = f"error: {e}"
+        return results
+
+    def start_watcher(self, interval=WATCH_INTERVAL):
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                for name, result in self.check_for_updates().items():
+                    level = logging.WARNING if str(result).startswith("error") else logging.INFO
+                    log.log(level, "Model reload: %s -> %s", name, result)
+
+        self._watcher = threading.Thread(target=watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+
+registry = ModelRegistry()
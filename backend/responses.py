@@ -0,0 +1,158 @@
+# Response encoding, field projection and cursor pagination for the
+# recommendation endpoints.
+#
+# Recommenders rank RANKED_DEPTH movies once; the ranked list is what the
+# result cache and the precomputed store hold, and requests page through it:
+#
+#   ?limit=10             page size (each endpoint keeps its old default)
+#   ?cursor=<next_cursor> the following page; cursors name the ranking they
+#                         came from, and one from an older ranking (the user
+#                         rated something, the catalog or a model changed)
+#                         is rejected with 410 rather than skipping or
+#                         repeating movies
+#   ?fields=id,title      only these keys in each movie
+#
+# A ranking id must always name the same list: pages may be cut from a
+# recompute after a cache eviction or on another worker, so recommenders seed
+# any random draws from it (main._rng).
+#
+# Pages carry a strong ETag derived from the ranking id and the page
+# parameters; a matching If-None-Match gets 304 Not Modified, before the
+# ranking is even loaded when the caller can name it up front.
+#
+# FastJSONResponse encodes with orjson when it is installed, straight from
+# dicts, lists and NumPy values, without the jsonable_encoder pass.
+import base64
+import decimal
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # optional; falls back to the standard encoder
+    orjson = None
+
+RANKED_DEPTH = int(os.getenv("RANKED_DEPTH", "100"))
+MAX_LIMIT = 100
+# Browsers and the app's HTTP client may keep responses, but must revalidate
+# (cheap: a 304 costs one fingerprint); shared caches must not, they are per user
+CACHE_CONTROL = "private, no-cache"
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        with metrics.stage("serialize"):
+            if orjson is not None:
+                # NaN and infinities are written as null
+                return orjson.dumps(content, default=_default,
+                                    option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+            return super().render(jsonable_encoder(content))
+
+
+class Paging:
+    def __init__(self, fields, cursor, limit, if_none_match=None):
+        self.fields = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+        self.cursor = cursor
+        self.limit = limit
+        self.if_none_match = if_none_match
+
+
+def paging(
+    fields: Optional[str] = Query(None, description="comma-separated movie fields to return"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    if_none_match: Optional[str] = Header(None),
+):
+    return Paging(fields, cursor, limit, if_none_match)
+
+
+def etag_for(*parts):
+    return '"' + hashlib.sha1(repr(parts).encode()).hexdigest() + '"'
+
+
+def etag_matches(etag, if_none_match):
+    # Weak comparison (RFC 9110 13.1.2), ignoring the coding suffix the
+    # compression middleware adds to compressed variants
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+        for suffix in ('-br"', '-gzip"'):
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)] + '"'
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def conditional(content, etag, if_none_match):
+    # content as a FastJSONResponse with its ETag, or 304 if the client has it
+    if etag_matches(etag, if_none_match):
+        return not_modified(etag)
+    return FastJSONResponse(content, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def _encode_cursor(offset, ranking):
+    return base64.urlsafe_b64encode(f"{offset}.{ranking[:12]}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor, ranking):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        offset, tag = raw.split(".", 1)
+        offset = int(offset)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+    if offset < 0 or tag != ranking[:12]:
+        raise HTTPException(status_code=410, detail="Cursor is from an older ranking; start again without it")
+    return offset
+
+
+def page(payload, key, ranking, params, default_limit):
+    # One page of payload[key] as a response. ranking identifies the ranked
+    # list (e.g. the recommender fingerprint), so cursors can be checked and
+    # the ETag derived; payload may be a callable, only called when the
+    # client's copy is out of date.
+    offset = _decode_cursor(params.cursor, ranking) if params.cursor else 0
+    limit = params.limit or default_limit
+    etag = etag_for(ranking, offset, limit, params.fields)
+    if etag_matches(etag, params.if_none_match):
+        return not_modified(etag)
+
+    if callable(payload):
+        payload = payload()
+    items = payload.get(key) or []
+    chunk = items[offset:offset + limit]
+
+    if params.fields:
+        known = set().union(*(item.keys() for item in chunk)) if chunk else set(params.fields)
+        unknown = [f for f in params.fields if f not in known]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        chunk = [{f: item[f] for f in params.fields if f in item} for item in chunk]
+
+    body = dict(payload)
+    body[key] = chunk
+    body["next_cursor"] = _encode_cursor(offset + limit, ranking) if offset + limit < len(items) else None
+    return FastJSONResponse(body, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
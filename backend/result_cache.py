@@ -0,0 +1,96 @@
+# Bounded LRU + TTL cache for per-user recommendation responses.
+#
+# Keys carry everything a response depends on that can change cheaply: the
+# user's rating count and profile, the catalog version and the model versions
+# (see main._cached). A new rating or catalog reload therefore misses on its
+# own, even in another worker; writers also drop a user's entries explicitly
+# so this worker stops holding dead ones. TTL bounds how long inputs that are
+# not in the key (other users' ratings) can stay stale.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+
+
+class ResultCache:
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, user_id, value)
+        self._by_user = {}             # user_id -> set of keys
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _drop(self, key):
+        _, user_id, _ = self._entries.pop(key)
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    def get(self, key):
+        # Returns (found, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                self._counters["expirations"] += 1
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return True, entry[2]
+
+    def put(self, key, user_id, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, user_id, value)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def get_or_compute(self, key, user_id, compute):
+        # Concurrent misses on one key may both compute; the last one is kept.
+        # Responses are shared between requests and must not be mutated.
+        found, value = self.get(key)
+        if found:
+            return value
+        value = compute()
+        self.put(key, user_id, value)
+        return value
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            keys = list(self._by_user.get(user_id, ()))
+            for key in keys:
+                self._drop(key)
+            self._counters["invalidations"] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._counters["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["maxsize"] = self.maxsize
+        stats["ttl_s"] = self.ttl
+        return stats
+
+
+results = ResultCache()
@@ -0,0 +1,104 @@
+# Per-user "already rated" sets as bitsets over MovieID, shared by the
+# recommenders to drop rated movies from their candidates.
+#
+# A user's bitset is built from their ratings on first use and kept in a
+# bounded LRU. /add-rating sets the new bit in place; bulk loads drop the
+# affected users so their sets are rebuilt on next use. Each set remembers
+# the user's rating count (user_rating_stats.n) it was built at, so a rating
+# written through another worker is noticed on the next lookup.
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import db
+import user_stats
+from catalog import movie_numbers
+
+CACHE_SIZE = int(os.getenv("SEEN_CACHE_SIZE", "20000"))
+
+
+class SeenSet:
+    # Bitset over MovieID; replaced rather than mutated, so readers never see
+    # a half-applied update
+
+    def __init__(self, movie_ids, rating_count):
+        ids = movie_numbers(list(movie_ids))
+        ids = ids[ids >= 0]
+        bits = np.zeros(int(ids.max()) // 8 + 1 if len(ids) else 1, dtype=np.uint8)
+        np.bitwise_or.at(bits, ids >> 3, (1 << (ids & 7)).astype(np.uint8))
+        self.bits = bits
+        self.rating_count = rating_count
+
+    def __contains__(self, movie_id):
+        try:
+            movie_id = int(movie_id)
+        except (TypeError, ValueError):
+            return False
+        byte = movie_id >> 3
+        return 0 <= byte < len(self.bits) and bool(self.bits[byte] >> (movie_id & 7) & 1)
+
+    def __len__(self):
+        return int(np.unpackbits(self.bits).sum())
+
+    def mask(self, numbers):
+        # Boolean array: which of the given movie numbers (see movie_numbers)
+        # are in the set
+        numbers = np.asarray(numbers, dtype=np.int64)
+        inside = (numbers >= 0) & (numbers < len(self.bits) * 8)
+        seen = np.zeros(len(numbers), dtype=bool)
+        valid = numbers[inside]
+        seen[inside] = ((self.bits[valid >> 3] >> (valid & 7)) & 1).astype(bool)
+        return seen
+
+    def ids(self):
+        return np.flatnonzero(np.unpackbits(self.bits, bitorder="little")).tolist()
+
+    def with_movie(self, movie_id, count_delta):
+        updated = SeenSet((), self.rating_count + count_delta)
+        size = max(len(self.bits), movie_id // 8 + 1)
+        updated.bits = np.zeros(size, dtype=np.uint8)
+        updated.bits[:len(self.bits)] = self.bits
+        updated.bits[movie_id >> 3] |= np.uint8(1 << (movie_id & 7))
+        return updated
+
+
+_sets = OrderedDict()
+_lock = threading.Lock()
+
+
+def get(user_id):
+    # The user's current SeenSet
+    user_id = str(user_id)
+    count = user_stats.rating_count(user_id)
+    with _lock:
+        seen = _sets.get(user_id)
+        if seen is not None and seen.rating_count == count:
+            _sets.move_to_end(user_id)
+            return seen
+    # Count first, then ratings: a rating landing in between leaves the count
+    # behind, so the next lookup rebuilds rather than missing that rating
+    seen = SeenSet((row["MovieID"] for row in db.fetch_user_ratings(user_id)), count)
+    with _lock:
+        _sets[user_id] = seen
+        _sets.move_to_end(user_id)
+        while len(_sets) > CACHE_SIZE:
+            _sets.popitem(last=False)
+    return seen
+
+
+def add(user_id, movie_id, count_delta):
+    # Record a committed rating; count_delta is the change in the user's
+    # non-NULL rating count (0 when an existing rating was overwritten)
+    user_id = str(user_id)
+    with _lock:
+        seen = _sets.get(user_id)
+        if seen is not None:
+            _sets[user_id] = seen.with_movie(int(movie_id), count_delta)
+
+
+def forget(user_ids):
+    with _lock:
+        for user_id in user_ids:
+            _sets.pop(str(user_id), None)
@@ -0,0 +1,122 @@
+# Item-to-item "more like this" lookups from a precomputed top-K neighbor table.
+#
+# The dense similarity_matrix.pkl (n_movies x n_movies) is only read offline:
+#
+#   cd backend && python -m similar build [--k 50]
+#
+# which keeps each movie's K best neighbors as int32 movie ids and float16
+# scores in .npy files. The API memory-maps those, so a lookup touches O(K)
+# values and the dense matrix is never resident in the server.
+import argparse
+import os
+import pickle
+import threading
+
+import numpy as np
+
+MOVIES_SIM_PATH = "models/movies_for_similarity.pkl"
+SIM_MATRIX_PATH = "models/similarity_matrix.pkl"
+
+INDEX_DIR = "models"
+MOVIES_FILE = "similar_movie_ids.npy"      # (n,) int32, sorted movie ids
+NEIGHBORS_FILE = "similar_neighbors.npy"   # (n, K) int32 neighbor movie ids
+SCORES_FILE = "similar_scores.npy"         # (n, K) float16, best first
+
+DEFAULT_K = 50
+
+
+def build_neighbor_index(similarity, movie_ids, k=DEFAULT_K, out_dir=INDEX_DIR, block_rows=256):
+    movie_ids = np.asarray(movie_ids, dtype=np.int32)
+    n = len(movie_ids)
+    k = min(k, n - 1)
+    order = np.argsort(movie_ids, kind="stable")
+
+    neighbors = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float16)
+    # A few hundred rows at a time keeps the float64 working set small
+    for start in range(0, n, block_rows):
+        rows = order[start:start + block_rows]
+        block = np.array(similarity[rows], dtype=np.float64)
+        block[np.arange(len(rows)), rows] = -np.inf  # a movie is not its own neighbor
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        best_first = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, best_first, axis=1)
+        neighbors[start:start + len(rows)] = movie_ids[top]
+        scores[start:start + len(rows)] = np.take_along_axis(top_scores, best_first, axis=1)
+
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, MOVIES_FILE), movie_ids[order])
+    np.save(os.path.join(out_dir, NEIGHBORS_FILE), neighbors)
+    np.save(os.path.join(out_dir, SCORES_FILE), scores)
+    return n, k
+
+
+class NeighborIndex:
+    def __init__(self, index_dir=INDEX_DIR):
+        self.movie_ids = np.load(os.path.join(index_dir, MOVIES_FILE), mmap_mode="r")
+        self.neighbors = np.load(os.path.join(index_dir, NEIGHBORS_FILE), mmap_mode="r")
+        self.scores = np.load(os.path.join(index_dir, SCORES_FILE), mmap_mode="r")
+
+    def _row(self, movie_id):
+        pos = int(np.searchsorted(self.movie_ids, movie_id))
+        if pos < len(self.movie_ids) and self.movie_ids[pos] == movie_id:
+            return pos
+        return None
+
+    def neighbors_of(self, movie_id):
+        # (neighbor ids, scores), best first; empty for unknown movies
+        row = self._row(movie_id)
+        if row is None:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        return np.asarray(self.neighbors[row]), np.asarray(self.scores[row], dtype=np.float32)
+
+    def similar_to(self, seed_ids, n=10, exclude=()):
+        # Merge the neighbor lists of several seeds: a candidate's score is the
+        # sum of its similarity to each seed, so movies close to more than one
+        # seed rank higher. Seeds and `exclude` are never returned.
+        ids, scores = zip(*(self.neighbors_of(m) for m in seed_ids)) if seed_ids else ((), ())
+        if not ids:
+            return []
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        candidates, inverse = np.unique(ids, return_inverse=True)
+        merged = np.bincount(inverse, weights=scores, minlength=len(candidates))
+
+        banned = np.asarray(list(seed_ids) + list(exclude), dtype=np.int64)
+        keep = ~np.isin(candidates, banned)
+        candidates, merged = candidates[keep], merged[keep]
+        best = np.argsort(-merged, kind="stable")[:n]
+        return list(zip(candidates[best].tolist(), merged[best].tolist()))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NeighborIndex()
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the top-K similar-movies index")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--k", type=int, default=DEFAULT_K)
+    parser.add_argument("--out", default=INDEX_DIR)
+    args = parser.parse_args()
+
+    with open(MOVIES_SIM_PATH, "rb") as f:
+        movie_ids = pickle.load(f)["MovieID"].to_numpy()
+    with open(SIM_MATRIX_PATH, "rb") as f:
+        similarity = np.asarray(pickle.load(f))
+    n, k = build_neighbor_index(similarity, movie_ids, args.k, args.out)
+    print(f"Wrote top-{k} neighbors for {n} movies to {args.out}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+# Storage backends behind db.py's connection pool.
+#
+#   DB_BACKEND=mysql   (default) MySQL through mysql.connector's pool
+#   DB_BACKEND=sqlite  an embedded SQLite file (SQLITE_PATH, default movies.db)
+#
+# Queries are written once, in the MySQL dialect. The SQLite backend rewrites
+# the constructs the app uses (%s placeholders, ON DUPLICATE KEY UPDATE with
+# VALUES(col), FOR UPDATE, inline KEY definitions) and provides STD(),
+# GREATEST() and SQRT(), so callers get the same cursor API from either one:
+# cursor(dictionary=, prepared=), execute/executemany, fetchone/fetchall,
+# rowcount, commit/rollback, in_transaction, and close() to return to the pool.
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+BACKEND = os.getenv("DB_BACKEND", "mysql")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "movies.db")
+# Page cache per connection, in MiB, and how much of the file to memory-map
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+# Seconds a writer waits on another connection's write lock
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+
+class MySQLStorage:
+    name = "mysql"
+
+    def __init__(self, config):
+        self.config = config
+
+    def open_pool(self, size):
+        # Imported here so SQLite deployments do not need the connector
+        from mysql.connector import pooling
+
+        # Session reset is disabled so prepared statements survive being
+        # returned to the pool; db._release() rolls back instead, which is
+        # all the reset was buying us.
+        return pooling.MySQLConnectionPool(
+            pool_name="movies_pool",
+            pool_size=size,
+            pool_reset_session=False,
+            **self.config
+        )
+
+
+# Tables the app reads and writes; in MySQL these are created by the setup
+# scripts (see README). user_rating_stats and precomputed_recommendations
+# create themselves on first use on either backend.
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS movies (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        genres TEXT,
+        rating REAL,
+        year INTEGER,
+        description TEXT,
+        posterUrl TEXT,
+        genres_vector TEXT,
+        popularity INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS users (
+        userId TEXT PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        gender TEXT,
+        age INTEGER,
+        occupation INTEGER,
+        zipCode TEXT,
+        preferred_genres TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS ratings (
+        UserID INT NOT NULL,
+        MovieID INT NOT NULL,
+        Rating FLOAT,
+        Timestamp BIGINT,
+        PRIMARY KEY (UserID, MovieID)
+    )""",
+]
+
+# MySQL -> SQLite rewrites, applied once per distinct statement. The
+# target-less ON CONFLICT DO UPDATE needs SQLite 3.35+.
+_REWRITES = [
+    (re.compile(r"ON DUPLICATE KEY UPDATE", re.I), "ON CONFLICT DO UPDATE SET"),
+    (re.compile(r"\bVALUES\((\w+)\)", re.I), r"excluded.\1"),
+    (re.compile(r"\s+FOR UPDATE\s*$", re.I), ""),
+    (re.compile(r",\s*KEY \w+ \([^)]*\)", re.I), ""),
+    (re.compile(r"%s"), "?"),
+]
+_translated = {}
+
+
+def translate(sql):
+    out = _translated.get(sql)
+    if out is None:
+        out = sql
+        for pattern, repl in _REWRITES:
+            out = pattern.sub(repl, out)
+        _translated[sql] = out
+    return out
+
+
+class _Std:
+    # MySQL STD(): population standard deviation, NULL over no rows
+    def __init__(self):
+        self.n, self.total, self.total_sq = 0, 0.0, 0.0
+
+    def step(self, value):
+        if value is not None:
+            self.n += 1
+            self.total += value
+            self.total_sq += value * value
+
+    def finalize(self):
+        if not self.n:
+            return None
+        return math.sqrt(max(0.0, self.total_sq / self.n - (self.total / self.n) ** 2))
+
+
+def _greatest(*args):
+    return None if None in args else max(args)
+
+
+def _sqrt(x):
+    return None if x is None or x < 0 else math.sqrt(x)
+
+
+def _dict_row(cursor, row):
+    return {d[0]: v for d, v in zip(cursor.description, row)}
+
+
+class SQLiteCursor:
+    def __init__(self, raw, dictionary):
+        self._cur = raw.cursor()
+        if dictionary:
+            self._cur.row_factory = _dict_row
+
+    def execute(self, sql, params=()):
+        self._cur.execute(translate(sql), tuple(params or ()))
+
+    def executemany(self, sql, seq):
+        self._cur.executemany(translate(sql), [tuple(p) for p in seq])
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def close(self):
+        self._cur.close()
+
+
+class SQLiteConnection:
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def cursor(self, dictionary=False, prepared=False):
+        # sqlite3 keeps its own compiled-statement cache per connection, so
+        # prepared cursors are ordinary ones
+        return SQLiteCursor(self._raw, dictionary)
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        self._pool._idle.put(self)
+
+
+class SQLitePool:
+    # Connections are opened on demand and reused; db.py's semaphore bounds
+    # how many are out at once
+    def __init__(self, storage):
+        self.storage = storage
+        self._idle = queue.SimpleQueue()
+
+    def get_connection(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return SQLiteConnection(self, self.storage.connect())
+
+
+class SQLiteStorage:
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def connect(self):
+        # WAL lets readers run alongside the single writer; synchronous=NORMAL
+        # only fsyncs at checkpoints, which WAL keeps crash-safe (the last
+        # commits may roll back on power loss, never corrupt)
+        raw = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        raw.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        raw.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 2 ** 20}")
+        raw.execute("PRAGMA temp_store=MEMORY")
+        raw.create_aggregate("STD", 1, _Std)
+        raw.create_function("GREATEST", -1, _greatest, deterministic=True)
+        raw.create_function("SQRT", 1, _sqrt, deterministic=True)
+        return raw
+
+    def ensure_schema(self):
+        with self._schema_lock:
+            if not self._schema_ready:
+                raw = self.connect()
+                try:
+                    for ddl in SQLITE_SCHEMA:
+                        raw.execute(ddl)
+                    raw.commit()
+                finally:
+                    raw.close()
+                self._schema_ready = True
+
+    def open_pool(self, size):
+        self.ensure_schema()
+        return SQLitePool(self)
+
+
+def from_env(mysql_config):
+    if BACKEND == "sqlite":
+        return SQLiteStorage(SQLITE_PATH)
+    if BACKEND == "mysql":
+        return MySQLStorage(mysql_config)
+    raise ValueError(f"Unknown DB_BACKEND '{BACKEND}' (expected mysql or sqlite)")
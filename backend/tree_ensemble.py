@@ -0,0 +1,176 @@
+# NumPy inference for the pickled XGBoost models, plus a lookup table for the
+# two-feature genre KMeans model.
+#
+# CompiledEnsemble flattens every tree of a fitted XGBRegressor/XGBClassifier
+# into NumPy arrays once, then scores a batch by stepping all (row, tree)
+# pairs one level down per iteration. It skips the DMatrix and thread-pool
+# setup the XGBoost wrapper pays on every call, which dominates for small
+# batches; large batches are still handed to XGBoost. Enabled with
+# INFERENCE_BACKEND=numpy; see benchmarks/bench_tree_ensemble.py for parity
+# and latency.
+import json
+import os
+
+import joblib
+import numpy as np
+
+BACKEND = os.getenv("INFERENCE_BACKEND", "xgboost")
+# Above this many rows the XGBoost wrapper's own overhead is amortized and it
+# is the faster of the two
+MAX_ROWS = int(os.getenv("NUMPY_INFERENCE_MAX_ROWS", "64"))
+BLOCK_ROWS = 256
+
+
+class CompiledEnsemble:
+    # Every tree is laid out as a complete binary tree of the ensemble's
+    # depth (split i has children 2i+1 and 2i+2; leaves above the bottom are
+    # pushed down through always-left pad splits), so traversal is index
+    # arithmetic plus one gather per array per level.
+
+    def __init__(self, model, max_rows=MAX_ROWS):
+        self.model = model
+        self.max_rows = max_rows
+        booster = model.get_booster()
+        learner = json.loads(booster.save_raw("json"))["learner"]
+        objective = learner["objective"]["name"]
+        if objective not in ("reg:squarederror", "binary:logistic"):
+            raise ValueError(f"Unsupported objective {objective}")
+        self.objective = objective
+        self.n_features = int(learner["learner_model_param"]["num_feature"])
+        self.classes_ = getattr(model, "classes_", None)
+
+        trees = learner["gradient_booster"]["model"]["trees"]
+        try:
+            best = model.best_iteration  # only set after early stopping
+        except AttributeError:
+            best = None
+        if best is not None:
+            trees = trees[:best + 1]  # what the wrapper's predict() uses
+        if any(tree.get("categories_nodes") for tree in trees):
+            raise ValueError("Categorical splits are not supported")
+
+        depth = max(_depth(tree["left_children"]) for tree in trees)
+        splits, leaves = 2 ** depth - 1, 2 ** depth
+        feature = np.zeros((len(trees), splits), dtype=np.int32)
+        # NaN thresholds on pad splits: x >= NaN is False, so they go left
+        threshold = np.full((len(trees), splits), np.nan, dtype=np.float32)
+        default_right = np.zeros((len(trees), splits), dtype=bool)
+        value = np.zeros((len(trees), leaves), dtype=np.float32)
+        for t, tree in enumerate(trees):
+            left, right = tree["left_children"], tree["right_children"]
+            # XGBoost stores the leaf value in split_conditions on leaves
+            conditions, indices, default_left = tree["split_conditions"], tree["split_indices"], tree["default_left"]
+            stack = [(0, 0, 0)]  # (xgboost node, position, level)
+            while stack:
+                node, pos, level = stack.pop()
+                if level == depth:
+                    value[t, pos - splits] = conditions[node]
+                elif left[node] == -1:
+                    stack.append((node, 2 * pos + 1, level + 1))
+                else:
+                    feature[t, pos] = indices[node]
+                    threshold[t, pos] = conditions[node]
+                    default_right[t, pos] = not default_left[node]
+                    stack.append((left[node], 2 * pos + 1, level + 1))
+                    stack.append((right[node], 2 * pos + 2, level + 1))
+
+        self.depth = depth
+        self.n_trees = len(trees)
+        self.feature = feature.ravel()
+        self.threshold = threshold.ravel()
+        self.default_right = default_right.ravel()
+        self.value = value.ravel()
+        self._split_base = (np.arange(len(trees)) * splits).astype(np.int32)
+        self._leaf_base = (np.arange(len(trees)) * leaves - splits).astype(np.int32)
+
+        base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+        if objective == "binary:logistic":
+            base_score = float(np.log(base_score / (1 - base_score)))  # stored as a probability
+        self.base_margin = np.float32(base_score)
+
+    def _margin_block(self, X):
+        n = len(X)
+        flat = X.ravel()
+        row_offset = (np.arange(n, dtype=np.int32) * self.n_features)[:, None]
+        has_nan = np.isnan(X).any()
+        pos = np.zeros((n, self.n_trees), dtype=np.int32)
+        for _ in range(self.depth):
+            idx = pos + self._split_base
+            x = flat.take(row_offset + self.feature.take(idx))
+            # XGBoost sends x < threshold left, NaN to the default side
+            go_right = x >= self.threshold.take(idx)
+            if has_nan:
+                go_right |= np.isnan(x) & self.default_right.take(idx)
+            pos = 2 * pos + 1 + go_right
+        # float32 accumulation, as XGBoost does
+        return self.value.take(pos + self._leaf_base).sum(axis=1, dtype=np.float32) + self.base_margin
+
+    def margin(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got shape {X.shape}")
+        # Blocks of a few hundred rows keep the (rows x trees) state in cache
+        return np.concatenate([self._margin_block(X[i:i + BLOCK_ROWS]) for i in range(0, len(X), BLOCK_ROWS)]
+                              or [np.empty(0, dtype=np.float32)])
+
+    def predict(self, X, force=False):
+        # Batches above max_rows go to XGBoost, which is faster there;
+        # force=True always uses the NumPy path
+        if not force and len(X) > self.max_rows:
+            return self.model.predict(X)
+        margin = self.margin(X)
+        if self.objective == "reg:squarederror":
+            return margin
+        labels = (_sigmoid(margin) > 0.5).astype(np.int64)
+        return self.classes_[labels] if self.classes_ is not None else labels
+
+    def predict_proba(self, X, force=False):
+        if not force and len(X) > self.max_rows:
+            return self.model.predict_proba(X)
+        p = _sigmoid(self.margin(X))
+        return np.column_stack([1 - p, p])
+
+
+def _depth(left):
+    # Depth of the deepest leaf; children always come after their parent
+    level = [0] * len(left)
+    for node, child in enumerate(left):
+        if child != -1:
+            level[child] = level[child + 1] = level[node] + 1
+    return max(level)
+
+
+def _sigmoid(margin):
+    return (1.0 / (1.0 + np.exp(-margin.astype(np.float64)))).astype(np.float32)
+
+
+class LookupTable:
+    # A model over a few binary features, evaluated once for every input
+    # combination. Inputs outside {0, 1} go to the wrapped model.
+
+    def __init__(self, model, n_features):
+        self.model = model
+        self.n_features = n_features
+        grid = ((np.arange(2 ** n_features)[:, None] >> np.arange(n_features)[::-1]) & 1)
+        self.table = np.asarray(model.predict(grid))
+        self._weights = 1 << np.arange(n_features)[::-1]
+
+    def predict(self, X):
+        X = np.asarray(X)
+        if X.ndim == 2 and X.shape[1] == self.n_features and np.isin(X, (0, 1)).all():
+            return self.table[X.astype(np.int64) @ self._weights]
+        return self.model.predict(X)
+
+
+def compiling(loader=joblib.load):
+    # Registry loader that compiles XGBoost models when INFERENCE_BACKEND=numpy
+    def load(f):
+        model = loader(f)
+        return CompiledEnsemble(model) if BACKEND == "numpy" else model
+    return load
+
+
+def tabulating(n_features, loader=joblib.load):
+    def load(f):
+        return LookupTable(loader(f), n_features)
+    return load
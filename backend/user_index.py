@@ -0,0 +1,86 @@
+# Process-wide snapshot of the users columns the feature builders read.
+#
+# Like catalog.py: the rows are loaded once into arrays with a userId -> row
+# index, and the aggregates over them (the mean age) are computed at load
+# time rather than per request. Writers to the users table call
+# invalidate_users(); the next reader reloads, so a burst of inserts costs
+# one scan.
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import db
+from catalog import GENRE_NAMES
+
+ALL_USERS = "SELECT userId, age, occupation, preferred_genres FROM users"
+
+# Other workers may write the users table; re-read at most this often (seconds)
+USERS_TTL = float(os.getenv("USERS_TTL", "300"))
+
+
+class UserSnapshot:
+    def __init__(self, rows, version):
+        self.version = version
+        self.loaded_at = time.time()
+        self.size = len(rows)
+        self.ids = [str(r["userId"]) for r in rows]
+        self.id_index = {user_id: i for i, user_id in enumerate(self.ids)}
+        self.age = pd.to_numeric(pd.Series([r["age"] for r in rows], dtype=object), errors="coerce").to_numpy(dtype=float)
+        # NULL occupation reads as 0, as the single-pair endpoint always did
+        self.occupation = np.array([int(r["occupation"] or 0) for r in rows], dtype=np.int64)
+        self.age_mean = float(np.nanmean(self.age)) if np.isfinite(self.age).any() else float("nan")
+        # 0/1 flags parsed from the comma-separated preferred_genres; has_genres
+        # is False where the column is empty or unparseable
+        self.genre_flags = np.zeros((self.size, len(GENRE_NAMES)), dtype=np.uint8)
+        self.has_genres = np.zeros(self.size, dtype=bool)
+        for i, r in enumerate(rows):
+            flags = parse_genre_flags(r.get("preferred_genres"))
+            if flags is not None:
+                flags = flags[:len(GENRE_NAMES)]
+                self.genre_flags[i, :len(flags)] = flags
+                self.has_genres[i] = True
+
+    def rows_of(self, user_ids):
+        # Row positions for the given ids, -1 where the user is unknown
+        return np.fromiter((self.id_index.get(str(u), -1) for u in user_ids), dtype=np.int64, count=len(user_ids))
+
+
+def parse_genre_flags(value):
+    try:
+        return [int(x) for x in value.split(",")] if value else None
+    except ValueError:
+        return None
+
+
+_snapshot = None
+_version = 0
+_stale = False
+_lock = threading.Lock()
+
+
+def _is_fresh(snap):
+    return snap is not None and not _stale and time.time() - snap.loaded_at <= USERS_TTL
+
+
+def get_users():
+    global _snapshot, _version, _stale
+    snap = _snapshot
+    if _is_fresh(snap):
+        return snap
+    with _lock:
+        if _is_fresh(_snapshot):
+            return _snapshot  # another thread reloaded while we waited
+        _stale = False
+        rows = db.fetch_prepared(ALL_USERS)
+        _version += 1
+        _snapshot = UserSnapshot(rows, _version)
+        return _snapshot
+
+
+def invalidate_users():
+    # Called after any write to the users table
+    global _stale
+    _stale = True
@@ -0,0 +1,219 @@
+# Per-user rating statistics and KMeans cluster assignments, kept in MySQL.
+#
+# Each user has one row of running sums (count, count > 0, sum, sum of squares,
+# count >= 4). Writers adjust the sums in the same transaction as the rating
+# change and bump `dirty`; cluster labels are recomputed only for dirty rows,
+# so /UserRatingsCluster reads one row instead of aggregating the ratings table.
+import math
+import threading
+
+import numpy as np
+
+import db
+
+STATS_DDL = """
+    CREATE TABLE IF NOT EXISTS user_rating_stats (
+        UserID BIGINT NOT NULL PRIMARY KEY,
+        n INT NOT NULL DEFAULT 0,
+        n_pos INT NOT NULL DEFAULT 0,
+        total DOUBLE NOT NULL DEFAULT 0,
+        total_sq DOUBLE NOT NULL DEFAULT 0,
+        n_high INT NOT NULL DEFAULT 0,
+        cluster INT NULL,
+        dirty INT NOT NULL DEFAULT 1,
+        KEY idx_cluster (cluster)
+    )
+"""
+
+# Aggregate straight from ratings; NULL ratings are ignored like the old
+# dropna() did
+_AGGREGATE = """
+    INSERT INTO user_rating_stats (UserID, n, n_pos, total, total_sq, n_high, dirty)
+    SELECT UserID, COUNT(Rating), SUM(Rating > 0), SUM(Rating), SUM(Rating * Rating), SUM(Rating >= 4), 1
+    FROM ratings
+    WHERE Rating IS NOT NULL {where}
+    GROUP BY UserID
+    ON DUPLICATE KEY UPDATE
+        n = VALUES(n), n_pos = VALUES(n_pos), total = VALUES(total),
+        total_sq = VALUES(total_sq), n_high = VALUES(n_high), dirty = dirty + 1
+"""
+
+_APPLY_DELTA = """
+    INSERT INTO user_rating_stats (UserID, n, n_pos, total, total_sq, n_high, dirty)
+    VALUES (%s, %s, %s, %s, %s, %s, 1)
+    ON DUPLICATE KEY UPDATE
+        n = n + VALUES(n), n_pos = n_pos + VALUES(n_pos), total = total + VALUES(total),
+        total_sq = total_sq + VALUES(total_sq), n_high = n_high + VALUES(n_high),
+        dirty = dirty + 1
+"""
+
+# Features the KMeans model was trained on, in column order
+FEATURES = ["rating_count", "rating_mean", "rating_std", "high_rating_ratio"]
+
+_FEATURE_SQL = """
+    n_pos AS rating_count,
+    total / n AS rating_mean,
+    CASE WHEN n > 1 THEN SQRT(GREATEST(0, (total_sq - total * total / n) / (n - 1))) ELSE 0 END AS rating_std,
+    CASE WHEN n_pos > 0 THEN 1.0 * n_high / n_pos ELSE 0 END AS high_rating_ratio
+"""
+
+_ready = False
+_ready_lock = threading.Lock()
+
+
+def ensure_table():
+    # Create the table on first use and fill it from ratings if it is empty
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        with db.transaction() as cursor:
+            cursor.execute(STATS_DDL)
+            cursor.execute("SELECT 1 FROM user_rating_stats LIMIT 1")
+            if cursor.fetchone() is None:
+                cursor.execute(_AGGREGATE.format(where=""))
+        _ready = True
+
+
+def rebuild():
+    ensure_table()
+    with db.transaction() as cursor:
+        cursor.execute(_AGGREGATE.format(where=""))
+
+
+def _contribution(rating):
+    if rating is None or (isinstance(rating, float) and math.isnan(rating)):
+        return (0, 0, 0.0, 0.0, 0)
+    rating = float(rating)
+    return (1, int(rating > 0), rating, rating * rating, int(rating >= 4))
+
+
+def apply_rating(cursor, user_id, new_rating, old_rating=None):
+    # Adjust one user's sums for a single rating insert or overwrite. Runs on
+    # the caller's cursor so it commits together with the rating itself; call
+    # ensure_table() before opening that transaction. Returns the change in
+    # the user's rating count.
+    new = _contribution(new_rating)
+    old = _contribution(old_rating)
+    delta = tuple(a - b for a, b in zip(new, old))
+    cursor.execute(_APPLY_DELTA, (user_id,) + delta)
+    return delta[0]
+
+
+def recompute_users(cursor, user_ids, chunk_size=1000):
+    # Re-aggregate the given users from ratings (used after bulk loads, where
+    # the overwritten values are not known). Same transaction rules as
+    # apply_rating().
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        placeholders = ",".join(["%s"] * len(chunk))
+        cursor.execute(_AGGREGATE.format(where=f"AND UserID IN ({placeholders})"), chunk)
+
+
+def refresh_clusters(model):
+    # Assign clusters to every row whose sums changed since it was last labelled
+    ensure_table()
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT UserID, dirty, {_FEATURE_SQL} FROM user_rating_stats WHERE dirty > 0 AND n > 0")
+        rows = cursor.fetchall()
+    if not rows:
+        return 0
+
+    X = np.vstack([features_of(row) for row in rows])
+    store_clusters(rows, model.predict(X))
+    return len(rows)
+
+
+def store_clusters(rows, labels):
+    # Write cluster labels for rows read with their `dirty` value; only clear
+    # `dirty` if no writer touched the row in the meantime
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "UPDATE user_rating_stats SET cluster = %s, dirty = 0 WHERE UserID = %s AND dirty = %s",
+            [(int(label), row["UserID"], row["dirty"]) for row, label in zip(rows, labels)]
+        )
+
+
+def all_features():
+    # UserID, dirty, cluster and the clustering features of every user with
+    # ratings
+    ensure_table()
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT UserID, dirty, cluster, {_FEATURE_SQL} FROM user_rating_stats WHERE n > 0")
+        return cursor.fetchall()
+
+
+def invalidate_clusters():
+    # Mark every row for relabelling, e.g. after the KMeans model changed
+    ensure_table()
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE user_rating_stats SET dirty = dirty + 1")
+
+
+def features_of(row):
+    return np.array([[float(row[f]) for f in FEATURES]])
+
+
+def get_user_stats(user_id):
+    ensure_table()
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"SELECT UserID, n, cluster, {_FEATURE_SQL} FROM user_rating_stats WHERE UserID = %s AND n > 0",
+            (user_id,)
+        )
+        return cursor.fetchone()
+
+
+def rating_count(user_id):
+    # Number of (non-NULL) ratings the user has; a single primary-key read
+    ensure_table()
+    rows = db.fetch_prepared("SELECT n FROM user_rating_stats WHERE UserID = %s", (user_id,))
+    return rows[0]["n"] if rows else 0
+
+
+def rating_sums(user_id):
+    # [n, n_pos, total, total_sq, n_high] of the user's ratings; unlike the
+    # count, these also move when a rating is overwritten
+    ensure_table()
+    rows = db.fetch_prepared(
+        "SELECT n, n_pos, total, total_sq, n_high FROM user_rating_stats WHERE UserID = %s", (user_id,)
+    )
+    return [rows[0][k] for k in ("n", "n_pos", "total", "total_sq", "n_high")] if rows else [0, 0, 0.0, 0.0, 0]
+
+
+def average_features():
+    # Mean of each clustering feature over users with ratings, or None when
+    # nobody has rated anything yet
+    ensure_table()
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) AS users, "
+            + ", ".join(f"AVG({f}) AS {f}" for f in FEATURES)
+            + f" FROM (SELECT {_FEATURE_SQL} FROM user_rating_stats WHERE n > 0) AS s"
+        )
+        row = cursor.fetchone()
+    if not row or not row["users"]:
+        return None
+    return features_of(row)
+
+
+def cluster_members(cluster):
+    ensure_table()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT UserID FROM user_rating_stats WHERE cluster = %s AND n > 0", (int(cluster),))
+        return [str(row["UserID"]) for row in cursor.fetchall()]
+
+
+def cluster_ratings(cluster):
+    ensure_table()
+    with db.cursor() as cursor:
+        cursor.execute(
+            """SELECT r.UserID, r.MovieID, r.Rating
+               FROM ratings r JOIN user_rating_stats s ON s.UserID = r.UserID
+               WHERE s.cluster = %s AND s.n > 0 AND r.Rating IS NOT NULL""",
+            (int(cluster),)
+        )
+        return cursor.fetchall()